@@ -0,0 +1,107 @@
+# Benchmark: CPU cost per GB of the download loop.
+#
+# Compares the original iter_content(8192) + f.write + pbar.update loop with
+# the readinto() path of transfer.stream_response() and its aggregate
+# progress counter. The file is served by a
+# separate `python -m http.server` process so only the client side is measured.
+#
+# Usage: python benchmarks/bench_download_loop.py [size_mb] [chunk_size_mb ...]
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from progress import ProgressTracker  # noqa: E402
+from transfer import WriteBehindWriter, stream_response  # noqa: E402
+
+GB = 1024 ** 3
+# The baseline progress bar is rendered as before, just not to the terminal.
+_NULL = open(os.devnull, 'w')
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_server(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('HTTP server did not start')
+
+
+def _measure(label, size, fn):
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    fn()
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+    print(f"{label:<28} cpu {cpu * GB / size:7.2f} s/GB   wall {wall:6.2f} s   {size / wall / 1e6:8.1f} MB/s")
+
+
+def bench_iter_content(url, out_path):
+    with requests.get(url, stream=True, timeout=10) as r:
+        total_size = int(r.headers.get('content-length', 0))
+        with open(out_path, 'wb') as f:
+            with tqdm(total=total_size, unit='B', unit_scale=True, leave=False, file=_NULL) as pbar:
+                for chunk in r.iter_content(chunk_size=8192):
+                    f.write(chunk)
+                    pbar.update(len(chunk))
+
+
+def bench_readinto(url, out_path, buffer_size):
+    writer = WriteBehindWriter(logging.getLogger(__name__), buffer_size=buffer_size)
+    try:
+        with requests.get(url, stream=True, timeout=10) as r:
+            progress = ProgressTracker(logging.getLogger(__name__), int(r.headers.get('content-length', 0)), 1, mode='off').start()
+            writer.open(out_path)
+            try:
+                stream_response(r, writer, on_progress=progress.add)
+            finally:
+                writer.close()
+                progress.close()
+    finally:
+        writer.shutdown()
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    chunk_sizes_mb = [int(a) for a in sys.argv[2:]] or [1, 4, 8]
+    size = size_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp) / 'src'
+        src.mkdir()
+        with open(src / 'VID_TEST.insv', 'wb') as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(size_mb):
+                f.write(block)
+        port = _free_port()
+        server = subprocess.Popen([sys.executable, '-m', 'http.server', str(port), '--bind', '127.0.0.1', '-d', str(src)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_for_server(port)
+            url = f"http://127.0.0.1:{port}/VID_TEST.insv"
+            out_path = Path(tmp) / 'out'
+            print(f"Downloading {size_mb} MB from a local HTTP server")
+            _measure('iter_content(8192)', size, lambda: bench_iter_content(url, out_path))
+            for mb in chunk_sizes_mb:
+                _measure(f'readinto {mb} MB buffers', size, lambda: bench_readinto(url, out_path, mb * 1024 * 1024))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Benchmark: throughput cost of the durability modes.
+#
+# Writes files as the download workers do (a ".part" file per download,
+# several workers in parallel) and commits them through
+# durability.GroupCommitter in each mode: none, batch (with several batch
+# sizes) and strict. Reports the throughput of writing plus committing and
+# the cost relative to "none". Run it on the backup volume itself (fsync on
+# tmpfs costs nothing), e.g. on the SD card or USB disk of a field station.
+#
+# Usage: python benchmarks/bench_durability.py [directory] [files] [size_mb] [workers]
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from durability import CommitItem, GroupCommitter  # noqa: E402
+from manifest import Manifest  # noqa: E402
+from transfer import PART_SUFFIX  # noqa: E402
+
+BLOCK = os.urandom(1024 * 1024)
+
+
+def _write_part(path, size_mb):
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(BLOCK)
+
+
+def run(root, mode, files, size_mb, workers, batch_files=32):
+    """Writes and commits files in a fresh directory below root. Returns (seconds, committer)."""
+    dest_dir = Path(tempfile.mkdtemp(prefix=f'bench-{mode}-', dir=root))
+    logger = logging.getLogger(__name__)
+    try:
+        manifest = Manifest(dest_dir, logger)
+        committer = GroupCommitter(manifest, logger, mode=mode, batch_files=batch_files)
+
+        def download(i):
+            final_path = dest_dir / f'VID_{i:05d}.insv'
+            part_path = final_path.with_name(final_path.name + PART_SUFFIX)
+            _write_part(part_path, size_mb)
+            committer.commit([CommitItem(final_path.name, part_path, final_path, {'size': size_mb * 1024 * 1024})])
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(download, range(files)))
+        committer.flush()
+        return time.perf_counter() - t0, committer
+    finally:
+        shutil.rmtree(dest_dir, ignore_errors=True)
+
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else tempfile.gettempdir()
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    size_mb = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+    total_mb = files * size_mb
+    print(f"{files} files of {size_mb} MB, {workers} writers, in {root}")
+    runs = [('none', 'none', 32), ('batch', 'batch 8', 8), ('batch', 'batch 32', 32), ('batch', 'batch 128', 128), ('strict', 'strict', 32)]
+    baseline = None
+    for mode, label, batch_files in runs:
+        elapsed, committer = run(root, mode, files, size_mb, workers, batch_files)
+        baseline = baseline or elapsed
+        print(f"{label:<10} {total_mb / elapsed:8.1f} MB/s   {files / elapsed:7.1f} files/s   "
+              f"{committer.fsyncs:5d} fsyncs   cost {100 * (elapsed / baseline - 1):+6.1f}%")
+
+
+if __name__ == '__main__':
+    main()
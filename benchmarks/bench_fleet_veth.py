@@ -0,0 +1,143 @@
+# Benchmark: fleet mode against simulated cameras on veth pairs.
+#
+# Builds one camera per veth pair, each in its own pair of network namespaces:
+# camera_simulator.py listens on 192.168.42.1 on the camera side, the sync
+# side gets 192.168.42.2, exactly like N camera hotspots with the same
+# address. The cameras are then synced one after the other and in parallel
+# with main.py's fleet mode, and the downloads are checked against the source
+# files. With --rate-mbit each veth is shaped to a Wi-Fi-like rate.
+#
+# Needs root (network namespaces). Usage:
+#   sudo python benchmarks/bench_fleet_veth.py [--cameras 4] [--files 3] [--size-mb 64] [--rate-mbit 200]
+import argparse
+import configparser
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+import main  # noqa: E402
+import netns  # noqa: E402
+
+CAMERA_IP = '192.168.42.1'
+
+
+def _sync_namespace(i):
+    return f'insta360-fv{i}'
+
+
+def _camera_namespace(i):
+    return f'insta360-sim{i}'
+
+
+def _wait_for_camera(i, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    with netns.enter_namespace(_sync_namespace(i)):
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((CAMERA_IP, 6666), timeout=0.2).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+    raise RuntimeError(f'Camera simulator {i} did not start')
+
+
+def _make_card(card_dir, files, size):
+    camera_dir = card_dir / 'DCIM' / 'Camera01'
+    camera_dir.mkdir(parents=True)
+    for n in range(files):
+        with open(camera_dir / f'VID_20250101_0000{n:02d}_00_{n:03d}.insv', 'wb') as f:
+            f.write(os.urandom(size))
+
+
+def _config(cameras, dest_dir):
+    config = configparser.ConfigParser()
+    config['Fleet'] = {
+        'interfaces': ', '.join(f'fv{i}' for i in cameras),
+        'namespace_prefix': 'insta360-',
+        'setup_namespaces': 'false',
+    }
+    config['Sync'] = {'listing_cache': 'false', 'download_session': 'false'}
+    config['Storage'] = {'destination_dir': str(dest_dir)}
+    return config
+
+
+def _verify(tmp, count, dest_dir):
+    for i in range(count):
+        card_dir = tmp / f'card{i}' / 'DCIM' / 'Camera01'
+        camera_dest = dest_dir / f'SIM{i:07d}'
+        for src in card_dir.iterdir():
+            dst = camera_dest / src.name
+            if not dst.exists() or dst.read_bytes() != src.read_bytes():
+                raise RuntimeError(f'{dst} does not match {src}')
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--files', type=int, default=3)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--rate-mbit', type=int, default=0, help='Shape each link (0: unshaped).')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(name)s %(levelname)s %(message)s')
+    logger = logging.getLogger('fleet')
+    tmp = Path(tempfile.mkdtemp(prefix='fleet_bench_'))
+    simulators = []
+    try:
+        for i in range(args.cameras):
+            netns.setup_veth_namespace(_sync_namespace(i), f'fv{i}', _camera_namespace(i), f'fs{i}',
+                                       '192.168.42.2/24', f'{CAMERA_IP}/24', logger)
+            if args.rate_mbit:
+                subprocess.run(['ip', 'netns', 'exec', _camera_namespace(i), 'tc', 'qdisc', 'add', 'dev', f'fs{i}',
+                                'root', 'tbf', 'rate', f'{args.rate_mbit}mbit', 'burst', '256kb', 'latency', '50ms'],
+                               check=True)
+            _make_card(tmp / f'card{i}', args.files, args.size_mb * 1024 * 1024)
+            simulators.append(subprocess.Popen(
+                ['ip', 'netns', 'exec', _camera_namespace(i), sys.executable, str(ROOT / 'camera_simulator.py'),
+                 '--files', str(tmp / f'card{i}'), '--serial', f'SIM{i:07d}'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        for i in range(args.cameras):
+            _wait_for_camera(i)
+
+        total = args.cameras * args.files * args.size_mb
+        settings = main._load_sync_settings(_config([], tmp), logger)
+
+        serial_dest = tmp / 'serial'
+        t0 = time.perf_counter()
+        for i in range(args.cameras):
+            main._fleet_command(_config([i], serial_dest), CAMERA_IP, [], serial_dest, logger, settings, use_wifi=False)
+        serial_sec = time.perf_counter() - t0
+        _verify(tmp, args.cameras, serial_dest)
+
+        parallel_dest = tmp / 'parallel'
+        t0 = time.perf_counter()
+        ok = main._fleet_command(_config(range(args.cameras), parallel_dest), CAMERA_IP, [], parallel_dest, logger,
+                                 settings, use_wifi=False)
+        parallel_sec = time.perf_counter() - t0
+        _verify(tmp, args.cameras, parallel_dest)
+
+        print(f'{args.cameras} cameras x {args.files} files x {args.size_mb} MB '
+              f'({"unshaped" if not args.rate_mbit else f"{args.rate_mbit} Mbit/s per link"}), all files verified')
+        print(f'one after the other: {serial_sec:7.2f} s  {total / serial_sec:8.1f} MB/s')
+        print(f'fleet (parallel):    {parallel_sec:7.2f} s  {total / parallel_sec:8.1f} MB/s  ({"ok" if ok else "FAILED"})')
+    finally:
+        for p in simulators:
+            p.terminate()
+        for p in simulators:
+            p.wait()
+        for i in range(args.cameras):
+            netns.delete_namespace(_sync_namespace(i), logger)
+            netns.delete_namespace(_camera_namespace(i), logger)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main_bench()
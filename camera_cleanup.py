@@ -0,0 +1,150 @@
+# Deletion of verified downloads from the camera for the Insta360 Sync application.
+import os
+import time
+
+from hashing import hash_file
+from insta360_api.insta360 import camera
+
+
+class VerifiedDeleter:
+    """
+    Deletes downloaded files from the camera in batches.
+
+    A file is only queued for deletion when its manifest entry has a content
+    hash and the local file still has the recorded size (optionally, the file
+    is re-hashed from disk). Each full batch is sent as one DeleteFiles
+    message. confirm(), at the end of the sync, lists the camera once for all
+    batches: only URIs missing from that readback listing count as deleted.
+    URIs still listed, or all of a batch without a response, stay on the
+    camera and are marked in the manifest so the next sync retries them; so
+    are all sent URIs if the readback fails.
+    """
+
+    RESPONSE_TIMEOUT_SEC = 30
+    LISTING_PAGE_SIZE = 500
+
+    def __init__(self, insta360_client, callback_handler, manifest, dest_dir, logger, batch_size=50, readback_hash=False):
+        """
+        Initializes the deleter.
+        Args:
+            insta360_client (camera): The connected camera API client.
+            callback_handler (Insta360CallbackHandler): Receives the DeleteFiles responses.
+            manifest (Manifest): The download manifest.
+            dest_dir (Path): The backup destination directory.
+            logger: The logging object for logging messages.
+            batch_size (int): Number of URIs per DeleteFiles message.
+            readback_hash (bool): Re-hash local files before deleting them from the camera.
+        """
+        self.insta360_client = insta360_client
+        self.callback_handler = callback_handler
+        self.manifest = manifest
+        self.dest_dir = dest_dir
+        self.logger = logger
+        self.batch_size = max(1, batch_size)
+        self.readback_hash = readback_hash
+        self.pending = {} # map URI to manifest key
+        self.unconfirmed = {} # map URI sent in a DeleteFiles message to manifest key
+        self.reported_failed = set() # URIs in the fail_uri of a DeleteFiles response
+        self.deleted_uris = set()
+        self.deleted_count = 0
+        self.failed_count = 0
+
+    def add(self, key):
+        """Queues the file recorded under key, if it passes verification. Sends a batch when full."""
+        entry = self.manifest.get(key)
+        if not self._is_verified(key, entry):
+            return False
+        self.pending[entry['uri']] = key
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    def _is_verified(self, key, entry):
+        """Checks the manifest entry and the local file before allowing deletion."""
+        if entry is None or not entry.get('hash') or entry.get('size') is None:
+            self.logger.warning(f"Not deleting {key} from camera: no verified download in the manifest.")
+            return False
+        local_path = self.dest_dir / key
+        try:
+            local_size = os.stat(local_path).st_size
+        except OSError as e:
+            self.logger.warning(f"Not deleting {key} from camera: local file is not accessible: {e}")
+            return False
+        if local_size != entry['size']:
+            self.logger.error(f"Not deleting {key} from camera: local size {local_size} does not match manifest size {entry['size']}.")
+            return False
+        if self.readback_hash:
+            digest = hash_file(local_path, entry['hash_algorithm'])
+            if digest != entry['hash']:
+                self.logger.error(f"Not deleting {key} from camera: local {entry['hash_algorithm']} {digest} does not match manifest {entry['hash']}.")
+                return False
+        return True
+
+    def flush(self):
+        """Sends the pending URIs as one DeleteFiles message; confirm() checks the result."""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        uris = list(batch)
+        self.logger.info(f"Deleting {len(uris)} verified files from camera...")
+        self.callback_handler.expect(camera.PHONE_COMMAND_DELETE_FILES)
+        self.insta360_client.DeleteCameraFiles(uris)
+        response = self.callback_handler.wait_for(camera.PHONE_COMMAND_DELETE_FILES, timeout=self.RESPONSE_TIMEOUT_SEC)
+
+        now = time.time()
+        if response is None or response.get('response_code') != camera.RESPONSE_CODE_OK:
+            reason = 'timeout' if response is None else 'error response'
+            self.logger.error(f"DeleteFiles failed ({reason}); {len(uris)} files stay on the camera.")
+            for uri, key in batch.items():
+                self.manifest.record(key, delete_failed_at=now)
+            self.failed_count += len(uris)
+            return
+
+        self.reported_failed.update(response.get('fail_uri', []))
+        self.unconfirmed.update(batch)
+
+    def confirm(self):
+        """
+        Lists the camera once and records the URIs sent for deletion that are gone in the manifest.
+
+        Called at the end of the sync, after the last flush(): one readback
+        listing covers all batches, however large the card is.
+        """
+        if not self.unconfirmed:
+            return
+        batch, self.unconfirmed = self.unconfirmed, {}
+        remaining = self._list_uris()
+        if remaining is None:
+            self.logger.error(f"Could not list the camera to confirm the deletion; {len(batch)} files are treated as not deleted.")
+        now = time.time()
+        deleted = 0
+        for uri, key in batch.items():
+            if remaining is None or uri in remaining:
+                if uri in self.reported_failed:
+                    self.logger.error(f"Camera could not delete {uri}.")
+                elif remaining is not None:
+                    self.logger.error(f"{uri} is still on the camera although DeleteFiles reported no failure.")
+                self.manifest.record(key, delete_failed_at=now)
+            else:
+                self.manifest.record(key, camera_deleted_at=now, delete_failed_at=None)
+                self.deleted_uris.add(uri)
+                deleted += 1
+        self.reported_failed.clear()
+        self.deleted_count += deleted
+        self.failed_count += len(batch) - deleted
+
+    def _list_uris(self):
+        """Lists the URIs on the camera with GetFileList. Returns a set, or None on failure."""
+        uris = set()
+        start = 0
+        while True:
+            self.callback_handler.expect(camera.PHONE_COMMAND_GET_FILE_LIST)
+            self.insta360_client.GetCameraFilesList(start=start, limit=self.LISTING_PAGE_SIZE)
+            response = self.callback_handler.wait_for(camera.PHONE_COMMAND_GET_FILE_LIST, timeout=self.RESPONSE_TIMEOUT_SEC)
+            if response is None or response.get('response_code') != camera.RESPONSE_CODE_OK:
+                return None
+            page = response.get('uri', [])
+            uris.update(page)
+            start += len(page)
+            if not page or start >= response.get('total_count', 0):
+                return uris
@@ -0,0 +1,252 @@
+# Local Insta360 camera simulator for the Insta360 Sync application.
+#
+# Serves a directory as if it were the SD card of a camera: the protobuf
+# protocol on TCP port 6666 and the files over HTTP, like the camera web
+# server. Only the messages used by the sync are answered with content; any
+# other message gets an empty OK response.
+#
+# Usage: python camera_simulator.py --files DIR [--host 0.0.0.0] [--port 6666]
+#            [--http-port 80] [--serial SIM0000001]
+# To simulate a camera hotspot in a network namespace, run it with
+# "ip netns exec <namespace> python camera_simulator.py ...".
+import argparse
+import functools
+import logging
+import os
+import re
+import socketserver
+import struct
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from insta360_api.insta360 import camera
+from insta360_api.pb2 import delete_files_pb2
+from insta360_api.pb2 import extra_info_pb2
+from insta360_api.pb2 import fileinfo_list_pb2
+from insta360_api.pb2 import get_file_list_pb2
+from insta360_api.pb2 import get_options_pb2
+
+
+class SimulatedCamera:
+    """The state of a simulated camera: its serial number and the files of its SD card."""
+
+    TOTAL_SPACE = 128 * 1024 ** 3
+
+    def __init__(self, files_dir, serial, logger):
+        """
+        Initializes the simulated camera.
+        Args:
+            files_dir (str): The directory served as the SD card.
+            serial (str): The camera serial number.
+            logger: The logging object for logging messages.
+        """
+        self.files_dir = os.path.abspath(files_dir)
+        self.serial = serial
+        self.logger = logger
+        self.lock = threading.Lock()
+
+    def list_files(self):
+        """Returns the URIs of all files on the card, relative to files_dir, sorted."""
+        uris = []
+        for root, _, names in os.walk(self.files_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                uris.append(os.path.relpath(path, self.files_dir).replace(os.sep, '/'))
+        return sorted(uris)
+
+    def _path(self, uri):
+        """Returns the local path of uri, refusing paths outside files_dir."""
+        path = os.path.abspath(os.path.join(self.files_dir, uri))
+        if not path.startswith(self.files_dir + os.sep):
+            raise ValueError(f"URI outside of the card: {uri}")
+        return path
+
+    def handle(self, message_code, body):
+        """
+        Handles one request.
+        Returns:
+            bytes: The serialized response body (empty for messages without content).
+        """
+        if message_code == camera.PHONE_COMMAND_GET_OPTIONS:
+            return self._get_options(body)
+        if message_code == camera.PHONE_COMMAND_GET_FILE_LIST:
+            return self._get_file_list(body)
+        if message_code == camera.PHONE_COMMAND_GET_FILEINFO_LIST:
+            return self._get_fileinfo_list(body)
+        if message_code == camera.PHONE_COMMAND_DELETE_FILES:
+            return self._delete_files(body)
+        return b''
+
+    def _get_options(self, body):
+        request = get_options_pb2.GetOptions()
+        request.ParseFromString(body)
+        response = get_options_pb2.GetOptionsResp()
+        response.option_types.extend(request.option_types)
+        response.value.serial_number = self.serial
+        used = sum(os.path.getsize(self._path(uri)) for uri in self.list_files())
+        response.value.storage_state.total_space = self.TOTAL_SPACE
+        response.value.storage_state.free_space = max(0, self.TOTAL_SPACE - used)
+        return response.SerializeToString()
+
+    def _page(self, body):
+        request = get_file_list_pb2.GetFileList()
+        request.ParseFromString(body)
+        uris = self.list_files()
+        limit = request.limit or len(uris)
+        return uris, uris[request.start:request.start + limit]
+
+    def _get_file_list(self, body):
+        uris, page = self._page(body)
+        response = get_file_list_pb2.GetFileListResp()
+        response.uri.extend(page)
+        response.total_count = len(uris)
+        return response.SerializeToString()
+
+    def _get_fileinfo_list(self, body):
+        _, page = self._page(body)
+        response = fileinfo_list_pb2.FileInfo_List()
+        for uri in page:
+            stat = os.stat(self._path(uri))
+            metadata = extra_info_pb2.ExtraMetadata()
+            metadata.file_size = stat.st_size
+            metadata.creation_time = int(stat.st_mtime)
+            metadata.serial_number = self.serial
+            info = response.file_info.add()
+            info.file_path = uri
+            info.metadata = metadata.SerializeToString()
+        return response.SerializeToString()
+
+    def _delete_files(self, body):
+        request = delete_files_pb2.DeleteFiles()
+        request.ParseFromString(body)
+        response = delete_files_pb2.DeleteFilesResp()
+        with self.lock:
+            for uri in request.uri:
+                try:
+                    os.remove(self._path(uri))
+                    self.logger.info(f"Deleted {uri}")
+                except (OSError, ValueError) as e:
+                    self.logger.warning(f"Cannot delete {uri}: {e}")
+                    response.fail_uri.append(uri)
+        return response.SerializeToString()
+
+
+class _ProtocolHandler(socketserver.BaseRequestHandler):
+    """Serves one protocol connection: length-prefixed packets, as read by camera.receive_packet()."""
+
+    def _recv_exactly(self, n):
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                return None
+            data.extend(chunk)
+        return bytes(data)
+
+    def _send(self, payload):
+        self.request.sendall(struct.pack('<i', len(payload) + 4) + payload)
+
+    def handle(self):
+        sim = self.server.camera
+        sim.logger.info(f"Protocol connection from {self.client_address[0]}")
+        while True:
+            length = self._recv_exactly(4)
+            if length is None:
+                break
+            payload = self._recv_exactly(struct.unpack('<i', length)[0] - 4)
+            if payload is None:
+                break
+            if payload in (camera.PKT_SYNC, camera.PKT_KEEPALIVE):
+                self._send(payload)
+                continue
+            if len(payload) < 12:
+                continue
+            message_code = struct.unpack('<H', payload[3:5])[0]
+            seq = payload[6:9]
+            try:
+                body = sim.handle(message_code, payload[12:])
+                response_code = camera.RESPONSE_CODE_OK
+            except Exception as e:
+                sim.logger.error(f"Message code {message_code} failed: {e}")
+                body = b''
+                response_code = camera.RESPONSE_CODE_ERROR
+            header = b'\x04\x00\x00' + struct.pack('<H', response_code) + b'\x02' + seq + b'\x80\x00\x00'
+            self._send(header + body)
+        sim.logger.info(f"Protocol connection from {self.client_address[0]} closed")
+
+
+class _ProtocolServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _CameraHTTPRequestHandler(SimpleHTTPRequestHandler):
+    """Static file server with single "bytes=N-" ranges, used to resume downloads."""
+
+    def send_head(self):
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if match is None or not os.path.isfile(path):
+            return super().send_head()
+        f = open(path, 'rb')
+        size = os.fstat(f.fileno()).st_size
+        start = int(match.group(1))
+        if start >= size:
+            f.close()
+            self.send_error(416, "Requested Range Not Satisfiable")
+            return None
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        self.send_header('Content-Length', str(size - start))
+        self.end_headers()
+        return f
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(files_dir, host='0.0.0.0', port=6666, http_port=80, serial='SIM0000001', logger=None):
+    """
+    Runs the simulator until interrupted.
+    Args:
+        files_dir (str): The directory served as the SD card.
+        host (str): The address to listen on.
+        port (int): The protocol TCP port.
+        http_port (int): The HTTP port.
+        serial (str): The camera serial number.
+        logger: Optional logging object.
+    """
+    logger = logger or logging.getLogger('camera_simulator')
+    sim = SimulatedCamera(files_dir, serial, logger)
+    protocol_server = _ProtocolServer((host, port), _ProtocolHandler)
+    protocol_server.camera = sim
+    http_server = ThreadingHTTPServer((host, http_port), functools.partial(_CameraHTTPRequestHandler, directory=sim.files_dir))
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    logger.info(f"Simulating camera {serial} on {host}:{port} (HTTP port {http_port}), serving {sim.files_dir}")
+    try:
+        protocol_server.serve_forever()
+    finally:
+        http_server.shutdown()
+        protocol_server.server_close()
+        http_server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate an Insta360 camera serving a local directory.")
+    parser.add_argument('--files', required=True, help="Directory served as the camera SD card.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=6666)
+    parser.add_argument('--http-port', type=int, default=80)
+    parser.add_argument('--serial', default='SIM0000001')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        serve(args.files, args.host, args.port, args.http_port, args.serial)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
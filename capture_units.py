@@ -0,0 +1,65 @@
+# Grouping of camera files into capture units for the Insta360 Sync application.
+import re
+
+# VID_20230715_123456_00_001.insv: kind, capture date and time, lens / stream
+# (00 and 10 are the two lenses, 01 and 11 the proxies), sequence number.
+_NAME_PATTERN = re.compile(r'^(?:PRO_)?(VID|LRV|IMG)_(\d{8}_\d{6})_(\d{2})_(\d{3})\.\w+$', re.IGNORECASE)
+
+
+class CaptureUnit:
+    """The files of one capture, downloaded and committed together."""
+
+    def __init__(self, key):
+        self.key = key
+        self.files = {}
+
+    @property
+    def creation_time(self):
+        times = [f['creation_time'] for f in self.files.values() if f.get('creation_time')]
+        return min(times) if times else 0
+
+    @property
+    def size(self):
+        """Total size in bytes, or None if the size of a file is unknown."""
+        sizes = [f['size'] for f in self.files.values()]
+        return None if None in sizes else sum(sizes)
+
+    def __len__(self):
+        return len(self.files)
+
+
+def unit_key(filename):
+    """
+    Returns the capture unit key of a camera file name.
+
+    The two lens files of a video and its LRV proxy share the capture time
+    and sequence number: they form one unit. Photos taken at the same second
+    (HDR brackets, bursts, each lens) form one unit whatever their sequence
+    numbers. Other files are units of their own.
+    """
+    match = _NAME_PATTERN.match(filename)
+    if match is None:
+        return ('file', filename)
+    kind, timestamp, _, sequence = match.groups()
+    if kind.upper() == 'IMG':
+        return ('photo', timestamp)
+    return ('video', timestamp, sequence)
+
+
+def group_capture_units(files, enabled=True):
+    """
+    Groups files into capture units.
+    Args:
+        files (dict): Map of filename to remote file information ({'uri', 'size', 'creation_time'}).
+        enabled (bool): If False, every file is a unit of its own.
+    Returns:
+        list: CaptureUnit objects, oldest capture first.
+    """
+    units = {}
+    for filename, remote_file in files.items():
+        key = unit_key(filename) if enabled else ('file', filename)
+        unit = units.get(key)
+        if unit is None:
+            unit = units[key] = CaptureUnit(key)
+        unit.files[filename] = remote_file
+    return sorted(units.values(), key=lambda u: (u.creation_time, sorted(u.files)[0]))
@@ -0,0 +1,194 @@
+# Durable commit of downloaded files for the Insta360 Sync application.
+#
+# A verified download becomes part of the backup in three steps: its ".part"
+# file is renamed to the final name, the rename is recorded in the manifest,
+# and the file may then be deleted from the camera. Without fsync a power
+# loss can undo any of these in any order, e.g. leave a zero-length file
+# under the final name. The durability mode decides what is synced:
+#   none    nothing, the fastest; a power loss can lose recent downloads
+#   batch   group commit: files are committed in batches, and each batch
+#           costs one round of concurrent fsyncs of its files (which the
+#           file system journal coalesces), one fsync per directory and one
+#           of the manifest
+#   strict  every file is synced, renamed, its directory and the manifest
+#           synced before the next one is committed
+# In batch and strict mode a file is only reported as committed (and so only
+# deleted from the camera) once it is on disk. Files of a batch not yet
+# synced stay ".part" and are reused by the next sync after a power loss.
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DURABILITY_MODES = ('none', 'batch', 'strict')
+DEFAULT_BATCH_FILES = 32
+DEFAULT_BATCH_SEC = 5.0
+# Files synced at once in batch mode.
+FSYNC_THREADS = 8
+
+
+def fsync_path(path):
+    """Flushes the file or directory at path to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class CommitItem:
+    """One verified ".part" file waiting to be committed."""
+
+    def __init__(self, key, part_path, final_path, fields, on_durable=None):
+        """
+        Args:
+            key (str): The manifest key (path relative to the destination directory).
+            part_path (Path): The verified ".part" file.
+            final_path (Path): The final path, on the file system of part_path.
+            fields (dict): Manifest fields (uri, camera_serial, size, hash, ...).
+            on_durable (function): Called without arguments once the file is committed and synced.
+        """
+        self.key = key
+        self.part_path = part_path
+        self.final_path = final_path
+        self.fields = fields
+        self.on_durable = on_durable
+
+
+class GroupCommitter:
+    """
+    Renames verified files into place and records them in the manifest.
+
+    commit() may be called from several threads (download results, mover
+    workers); the committed (key, manifest entry) pairs are collected and
+    handed out by completed() to the sync thread, which deletes them from
+    the camera. In batch mode items are held until batch_files of them are
+    pending or the oldest has waited batch_sec, or until flush().
+    """
+
+    def __init__(self, manifest, logger, mode='batch', batch_files=DEFAULT_BATCH_FILES, batch_sec=DEFAULT_BATCH_SEC):
+        """
+        Args:
+            manifest (Manifest): The download manifest.
+            logger: The logging object for logging messages.
+            mode (str): One of DURABILITY_MODES.
+            batch_files (int): Files per group commit in batch mode.
+            batch_sec (float): Longest time a file waits for its group commit.
+        """
+        self.manifest = manifest
+        self.logger = logger
+        self.mode = mode
+        self.batch_files = max(1, batch_files)
+        self.batch_sec = batch_sec
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_since = None
+        self.done = []
+        self.failed_count = 0
+        # Statistics, reported by close().
+        self.batches = 0
+        self.fsyncs = 0
+        self.sync_sec = 0.0
+
+    def commit(self, items):
+        """Commits items (CommitItem objects), now or with the next batch."""
+        with self.lock:
+            if self.mode != 'batch':
+                self._commit(items)
+                return
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending.extend(items)
+            if len(self.pending) >= self.batch_files:
+                self._flush()
+
+    def flush_if_due(self):
+        """Commits the pending batch if its oldest file has waited batch_sec."""
+        with self.lock:
+            if self.pending and time.monotonic() - self.pending_since >= self.batch_sec:
+                self._flush()
+
+    def flush(self):
+        """Commits the pending batch now."""
+        with self.lock:
+            self._flush()
+
+    def completed(self):
+        """Returns the (key, manifest entry) pairs committed since the last call."""
+        with self.lock:
+            done, self.done = self.done, []
+        return done
+
+    def _flush(self):
+        """Caller holds self.lock."""
+        items, self.pending = self.pending, []
+        if items:
+            self._commit(items)
+
+    def _fsync(self, path):
+        fsync_path(path)
+        self.fsyncs += 1
+
+    def _commit(self, items):
+        """Caller holds self.lock."""
+        t0 = time.monotonic()
+        if self.mode == 'strict':
+            for item in items:
+                self._commit_files([item])
+        else:
+            self._commit_files(items)
+        if self.mode != 'none':
+            self.sync_sec += time.monotonic() - t0
+
+    def _commit_files(self, items):
+        sync = self.mode != 'none'
+        if sync:
+            self.batches += 1
+            if len(items) == 1:
+                results = [self._try_fsync(items[0].part_path)]
+            else:
+                # Concurrent fsyncs of files on one file system share journal commits.
+                with ThreadPoolExecutor(max_workers=min(FSYNC_THREADS, len(items))) as pool:
+                    results = list(pool.map(self._try_fsync, [item.part_path for item in items]))
+            self.fsyncs += len(items)
+            items = [item for item, error in zip(items, results) if not self._failed(item, error)]
+        renamed = []
+        for item in items:
+            try:
+                os.replace(item.part_path, item.final_path)
+            except OSError as e:
+                self._failed(item, e)
+                continue
+            renamed.append(item)
+        if sync:
+            for directory in sorted({item.final_path.parent for item in renamed}):
+                self._fsync(directory)
+        entries = [(item, self.manifest.record(item.key, **item.fields)) for item in renamed]
+        if sync and entries:
+            self.manifest.sync()
+            self.fsyncs += 1
+        for item, entry in entries:
+            if item.on_durable is not None:
+                item.on_durable()
+            self.done.append((item.key, entry))
+
+    def _try_fsync(self, path):
+        try:
+            fsync_path(path)
+        except OSError as e:
+            return e
+        return None
+
+    def _failed(self, item, error):
+        if error is None:
+            return False
+        self.logger.error(f"Failed to commit {item.key}: {error}")
+        self.failed_count += 1
+        return True
+
+    def close(self):
+        """Commits the pending batch and logs the cost of syncing."""
+        self.flush()
+        if self.mode != 'none' and self.batches:
+            self.logger.info(f"Durability ({self.mode}): {self.batches} commits, {self.fsyncs} fsyncs, "
+                             f"{self.sync_sec:.2f}s committing.")
@@ -0,0 +1,82 @@
+# Content hashing helpers for the Insta360 Sync application.
+import hashlib
+
+# Optional, faster hash implementations.
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+DEFAULT_HASH_ALGORITHM = 'sha256'
+HASH_ALGORITHMS = ('xxhash', 'blake3', 'sha256')
+
+
+def is_hash_available(algorithm):
+    """Returns True if the hash algorithm can be used with the installed modules."""
+    if algorithm == 'xxhash':
+        return xxhash is not None
+    if algorithm == 'blake3':
+        return blake3 is not None
+    return algorithm == 'sha256'
+
+
+def new_hash(algorithm):
+    """
+    Creates an incremental hash object with update() and hexdigest().
+    Args:
+        algorithm (str): One of HASH_ALGORITHMS.
+    Raises:
+        ValueError: If the algorithm is unknown or its module is not installed.
+    """
+    if algorithm == 'xxhash':
+        if xxhash is None:
+            raise ValueError("Hash algorithm 'xxhash' requires the xxhash module (pip install xxhash).")
+        return xxhash.xxh3_128()
+    if algorithm == 'blake3':
+        if blake3 is None:
+            raise ValueError("Hash algorithm 'blake3' requires the blake3 module (pip install blake3).")
+        return blake3.blake3()
+    if algorithm == 'sha256':
+        return hashlib.sha256()
+    raise ValueError(f"Unknown hash algorithm '{algorithm}', expected one of {', '.join(HASH_ALGORITHMS)}.")
+
+
+def update_from_file(h, path, length=None, block_size=4 * 1024 * 1024):
+    """
+    Feeds a local file, or its first length bytes, to a hash object with large sequential reads.
+    Returns:
+        int: The number of bytes hashed.
+    """
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    remaining = length
+    hashed = 0
+    with open(path, 'rb', buffering=0) as f:
+        while remaining is None or remaining > 0:
+            n = f.readinto(view if remaining is None or remaining >= block_size else view[:remaining])
+            if not n:
+                break
+            h.update(view[:n])
+            hashed += n
+            if remaining is not None:
+                remaining -= n
+    return hashed
+
+
+def hash_file(path, algorithm, block_size=4 * 1024 * 1024):
+    """
+    Hashes a local file with large sequential reads.
+    Args:
+        path: The file to hash.
+        algorithm (str): One of HASH_ALGORITHMS.
+        block_size (int): Size of each read.
+    Returns:
+        str: The hex digest of the file content.
+    """
+    h = new_hash(algorithm)
+    update_from_file(h, path, block_size=block_size)
+    return h.hexdigest()
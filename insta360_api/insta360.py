@@ -39,6 +39,7 @@ Web References:
 
 """
 
+import contextlib
 import logging
 import select
 import signal
@@ -49,19 +50,30 @@ import time
 import threading
 
 from google.protobuf import json_format
+from google.protobuf.message import DecodeError
+from . import packet_trace
+from .metrics import CameraMetrics
 # Removed sys.path.append('pb2')
 # Changed to relative imports for protobuf modules
 from .pb2 import capture_state_pb2
 from .pb2 import current_capture_status_pb2
+from .pb2 import delete_files_pb2
 from .pb2 import error_pb2
+from .pb2 import extra_info_pb2
+from .pb2 import fileinfo_list_pb2
 from .pb2 import get_current_capture_status_pb2
 from .pb2 import get_file_list_pb2
 from .pb2 import get_options_pb2
 from .pb2 import get_photography_options_pb2
+from .pb2 import open_iperf_service_pb2
 from .pb2 import options_pb2
 from .pb2 import photo_pb2
+from .pb2 import sd_card_speed_pb2
+from .pb2 import set_access_camera_file_state_pb2
 from .pb2 import set_options_pb2
 from .pb2 import set_photography_options_pb2
+from .pb2 import set_standby_mode_pb2
+from .pb2 import set_wifi_seize_pb2
 from .pb2 import start_capture_pb2
 from .pb2 import start_live_stream_pb2
 from .pb2 import stop_capture_pb2
@@ -104,14 +116,53 @@ def bytes_to_hex(bytes_string):
     return hex_string
 
 
+class LazyBytesFormat:
+    """ Defer bytes_to_hex() / bytes_to_hexascii() until a log record is actually rendered """
+    def __init__(self, func, data):
+        self.func = func
+        self.data = bytes(data)
+
+    def __str__(self):
+        return self.func(self.data)
+
+
+# Logging extra for the per-packet logs, which the application may rate limit or drop.
+PACKET_LOG = {'packet_log': True}
+
+
 def protobuf_to_dict(message, response_code=None, message_code=None):
     """ Convert a protobuf message into a Python dictionary """
-    msg =json_format.MessageToDict(message, including_default_value_fields=True)
+    msg =json_format.MessageToDict(message, including_default_value_fields=True, preserving_proto_field_name=True)
     msg['response_code'] = response_code
     msg['message_code'] = message_code
     return msg
 
 
+def fileinfo_list_to_dict(message, response_code=None, message_code=None, logger=None):
+    """ Convert a FileInfo_List message into a Python dictionary, decoding the metadata of each file """
+    # The metadata bytes of each file are a serialized ExtraMetadata message.
+    file_info = []
+    for info in message.file_info:
+        entry = {'file_path': info.file_path}
+        if info.metadata:
+            metadata = extra_info_pb2.ExtraMetadata()
+            try:
+                metadata.ParseFromString(info.metadata)
+                entry['file_size'] = metadata.file_size
+                entry['creation_time'] = metadata.creation_time
+                entry['total_time'] = metadata.total_time
+                entry['serial_number'] = metadata.serial_number
+            except DecodeError as ex:
+                # The file is listed without size and creation time.
+                (logger or logging.getLogger(None)).warning('Cannot parse the metadata of %s: %s' % (info.file_path, ex))
+        file_info.append(entry)
+    return {
+        'file_info': file_info,
+        'response_code': response_code,
+        'message_code': message_code
+    }
+
+
 class camera:
 
     # Socket timing parameters.
@@ -121,6 +172,7 @@ class camera:
     KEEPALIVE_INTERVAL_SEC = 2.0
     IS_CONNECTED_TIMEOUT_SEC = 10.0
     RECONNECT_TIMEOUT_SEC = 30.0
+    STANDBY_WAKE_UP_INTERVAL_SEC = 30.0  # Resend SetStandbyMode(WAKE_UP) during a download session
 
     PKT_SYNC =      bytearray(b'\x06\x00\x00syNceNdinS')
     PKT_KEEPALIVE = bytearray(b'\x05\x00\x00')
@@ -140,6 +192,13 @@ class camera:
     PHONE_COMMAND_DELETE_FILES = 12
     PHONE_COMMAND_GET_FILE_LIST = 13
     PHONE_COMMAND_GET_CURRENT_CAPTURE_STATUS = 15
+    PHONE_COMMAND_TEST_SD_CARD_SPEED = 31
+    PHONE_COMMAND_OPEN_IPERF = 35
+    PHONE_COMMAND_CLOSE_IPERF = 36
+    PHONE_COMMAND_GET_FILEINFO_LIST = 38
+    PHONE_COMMAND_SET_STANDBY_MODE = 56
+    PHONE_COMMAND_SET_WIFI_SEIZE_ENABLE = 85
+    PHONE_COMMAND_SET_ACCESS_CAMERA_FILE_STATE = 118
 
     RESPONSE_CODE_OK = 200
     RESPONSE_CODE_ERROR = 500
@@ -157,18 +216,43 @@ class camera:
         PHONE_COMMAND_GET_OPTIONS: get_options_pb2.GetOptions(),
         PHONE_COMMAND_TAKE_PICTURE: take_picture_pb2.TakePicture(),
         PHONE_COMMAND_GET_FILE_LIST: get_file_list_pb2.GetFileList(),
+        PHONE_COMMAND_DELETE_FILES: delete_files_pb2.DeleteFiles(),
+        # The request takes the same fields as GetFileList; the response is a FileInfo_List.
+        PHONE_COMMAND_GET_FILEINFO_LIST: get_file_list_pb2.GetFileList(),
         PHONE_COMMAND_SET_PHOTOGRAPHY_OPTIONS: set_photography_options_pb2.SetPhotographyOptions(),
         PHONE_COMMAND_GET_PHOTOGRAPHY_OPTIONS: get_photography_options_pb2.GetPhotographyOptions(),
         PHONE_COMMAND_START_CAPTURE: start_capture_pb2.StartCapture(),
         PHONE_COMMAND_STOP_CAPTURE: stop_capture_pb2.StopCapture(),
         PHONE_COMMAND_START_LIVE_STREAM: start_live_stream_pb2.StartLiveStream(),
         PHONE_COMMAND_STOP_LIVE_STREAM: stop_live_stream_pb2.StopLiveStream(),
-        PHONE_COMMAND_GET_CURRENT_CAPTURE_STATUS: get_current_capture_status_pb2.CameraCaptureStatus()
+        PHONE_COMMAND_GET_CURRENT_CAPTURE_STATUS: get_current_capture_status_pb2.CameraCaptureStatus(),
+        PHONE_COMMAND_SET_STANDBY_MODE: set_standby_mode_pb2.SetStandbyMode(),
+        PHONE_COMMAND_SET_WIFI_SEIZE_ENABLE: set_wifi_seize_pb2.SetWifiSeizeEnable(),
+        PHONE_COMMAND_SET_ACCESS_CAMERA_FILE_STATE: set_access_camera_file_state_pb2.SetAccessCameraFileState(),
+        PHONE_COMMAND_TEST_SD_CARD_SPEED: sd_card_speed_pb2.TestSDCardSpeed(),
+        PHONE_COMMAND_OPEN_IPERF: open_iperf_service_pb2.OpenIperfService(),
+        # No message is defined for closing: an empty OpenIperfService() serializes to an empty body.
+        PHONE_COMMAND_CLOSE_IPERF: open_iperf_service_pb2.OpenIperfService()
     }
 
-    def __init__(self, host='192.168.42.1', port=6666, logger=None, callback=None):
+    # Commands whose OK response carries no protobuf body.
+    empty_response_codes = (
+        PHONE_COMMAND_OPEN_IPERF,
+        PHONE_COMMAND_CLOSE_IPERF
+    )
+
+    def __init__(self, host='192.168.42.1', port=6666, logger=None, callback=None, bind_interface=None, source_address=None,
+                 packet_trace=None, metrics=None):
         self.connect_host = host
         self.connect_port = port
+        # Pin the socket to one network adapter: SO_BINDTODEVICE (Linux,
+        # needs CAP_NET_RAW) and/or the local address to connect from.
+        self.bind_interface = bind_interface
+        self.source_address = source_address
+        # Optional packet_trace.PacketTrace recording every packet sent and received.
+        self.packet_trace = packet_trace
+        # Protocol counters and latencies, see metrics.CameraMetrics.
+        self.metrics = metrics if metrics is not None else CameraMetrics(code_names=self.message_code_names())
         if logger is None:
             self.logger = logging.getLogger(None)
         else:
@@ -186,15 +270,40 @@ class camera:
         self.last_pkt_sent_time = time.time()
         self.last_pkt_recv_time = time.time()
         self.program_killed = False
-        signal.signal(signal.SIGTERM, self.SignalHandler)
-        signal.signal(signal.SIGINT, self.SignalHandler)
+        self.download_session_active = False
+        self.last_wake_up_time = time.time()
+        # Signal handlers can only be installed from the main thread; cameras
+        # created in worker threads (e.g. one per camera in a fleet) leave
+        # signal handling to the application.
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.SignalHandler)
+            signal.signal(signal.SIGINT, self.SignalHandler)
         # Enable async receiving function.
-        self.rcv_thread = threading.Thread(target=self.receive_packet, daemon=True)
+        self.rcv_thread = threading.Thread(target=self.receive_packet, name='insta360-receive', daemon=True)
         self.rcv_thread.start()
 
 
+    @classmethod
+    def message_code_names(cls):
+        """ Return a dict message code -> PHONE_COMMAND_* name """
+        return {value: name[len('PHONE_COMMAND_'):] for name, value in vars(cls).items()
+                if name.startswith('PHONE_COMMAND_') and isinstance(value, int)}
+
+
     def SignalHandler(self, signum, frame):
         self.logger.info('Received signal %d, exiting' % (signum,))
+        if self.download_session_active:
+            # Restore the camera state before the socket is closed.
+            self.download_session_active = False
+            # The signal may have interrupted this (main) thread in socket_send(), holding
+            # socket_lock: sending from here would wait for it forever, and would mix the
+            # packets anyway. Other threads only hold it for a moment.
+            if self.socket_lock is not None and self.socket_lock.acquire(timeout=self.SOCKET_TIMEOUT_SEC):
+                self.socket_lock.release()
+                self.SetAccessCameraFileState('IDLE')
+                self.SetWifiSeizeEnable('seizable')
+            else:
+                self.logger.warning('Interrupted while sending: the camera download session is not ended')
         self.program_killed = True
         self.Close()
         sys.exit(signum)
@@ -208,7 +317,12 @@ class camera:
         try:
             self.camera_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.camera_socket.settimeout(self.SOCKET_TIMEOUT_SEC)
+            if self.bind_interface:
+                self.camera_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, self.bind_interface.encode())
+            if self.source_address:
+                self.camera_socket.bind((self.source_address, 0))
             self.camera_socket.connect((self.connect_host, self.connect_port))
+            self.metrics.connection_opened()
             self.logger.debug('Socket opened')
         except Exception as ex:
             self.logger.error('Exception in socket.connect(): %s' % (ex,))
@@ -220,6 +334,9 @@ class camera:
             self.send_packet(self.PKT_SYNC)
             self.send_packet(self.PKT_KEEPALIVE)
             self.SyncLocalTimeToCamera()
+            if self.download_session_active:
+                # Re-connected during a download session: the camera forgot its state.
+                self.send_download_session_state()
             # Enable async timers.
             self.timer_keepalive = self.KeepAliveTimer(self.KEEPALIVE_INTERVAL_SEC, self.KeepAlive)
             self.timer_keepalive.start()
@@ -238,6 +355,7 @@ class camera:
         self.is_connected = False
         self.message_seq = 0
         self.sent_messages_codes = {}
+        self.metrics.connection_closed()
 
 
     class KeepAliveTimer(threading.Timer):
@@ -252,11 +370,13 @@ class camera:
         with self.socket_lock:
             seq_number = self.message_seq
             self.message_seq += 1
-        protobuf_msg = self.pb_msg_class[message_code]
+        # Use a fresh message: ParseDict() merges into existing repeated fields.
+        protobuf_msg = self.pb_msg_class[message_code].__class__()
         proto_module = protobuf_msg.__class__.__module__
         proto_name = protobuf_msg.__class__.__name__
-        self.logger.info('Sending message #%d: "%s.%s()"' % (seq_number, proto_module, proto_name))
+        self.logger.info('Sending message #%d: "%s.%s()"', seq_number, proto_module, proto_name, extra=PACKET_LOG)
         self.sent_messages_codes[seq_number] = message_code
+        self.metrics.message_sent(seq_number, message_code)
         try:
             json_format.ParseDict(message, protobuf_msg)
             header  = b'\x04\x00\x00'
@@ -269,6 +389,7 @@ class camera:
         except Exception as ex:
             self.logger.error('Exception in SendMessage(): %s' % (ex,))
             del self.sent_messages_codes[seq_number]
+            self.metrics.message_failed(seq_number)
         return seq_number
 
 
@@ -277,11 +398,16 @@ class camera:
         if self.is_connected:
             if (time.time() - self.last_pkt_recv_time) > self.IS_CONNECTED_TIMEOUT_SEC:
                 self.logger.info('Timeout expecting packet: assuming disconnected')
+                self.metrics.link_timeout()
                 self.is_connected = False
             elif (time.time() - self.last_pkt_sent_time) > self.KEEPALIVE_INTERVAL_SEC:
                 self.logger.debug('Sending KeepAlive')
                 self.send_packet(self.PKT_KEEPALIVE)
                 self.last_pkt_sent_time = time.time()
+            if self.download_session_active and (time.time() - self.last_wake_up_time) > self.STANDBY_WAKE_UP_INTERVAL_SEC:
+                self.logger.debug('Download session: keeping camera awake')
+                self.SetStandbyMode('STANDBY_MODE_WAKE_UP')
+                self.last_wake_up_time = time.time()
         else:
             # Try a new connection.
             if time.time() - self.reconnect_time > self.RECONNECT_TIMEOUT_SEC:
@@ -296,7 +422,8 @@ class camera:
         try:
             message = message_class
             message.ParseFromString(message_bytes)
-            self.logger.info('Parsed protobuf message "%s.%s()":\n%s' % (proto_module, proto_name, message))
+            # The text rendering of the message is only built if the record is emitted.
+            self.logger.info('Parsed protobuf message "%s.%s()":\n%s', proto_module, proto_name, message, extra=PACKET_LOG)
         except:
             self.logger.error('Cannot parse message as "%s.%s()"' % (proto_module, proto_name))
             message = None
@@ -308,7 +435,10 @@ class camera:
         if self.camera_socket is not None:
             pkt_data = bytearray(struct.pack('<i', len(pkt_payload) + 4))
             pkt_data.extend(pkt_payload)
-            self.logger.info("Sending packet: b'%s%s'" % (bytes_to_hex(pkt_payload[:12]), bytes_to_hexascii(pkt_payload[12:])))
+            self.logger.info("Sending packet: b'%s%s'", LazyBytesFormat(bytes_to_hex, pkt_payload[:12]),
+                             LazyBytesFormat(bytes_to_hexascii, pkt_payload[12:]), extra=PACKET_LOG)
+            if self.packet_trace is not None:
+                self.packet_trace.record(packet_trace.SENT, bytes(pkt_payload))
             self.socket_send(pkt_data)
             time.sleep(0.1) # Actually 0.02 should suffice.
 
@@ -318,6 +448,7 @@ class camera:
         try:
             with self.socket_lock:
                 self.camera_socket.sendall(pkt_data)
+            self.metrics.packet_sent(len(pkt_data))
         except Exception as ex:
             self.logger.error('Exception in socket.sendall(): %s' % (ex,))
             return False
@@ -341,7 +472,7 @@ class camera:
             poller.register(self.camera_socket, select.POLLIN)
             # Loop waiting a packet to be complete.
             while True:
-                self.logger.debug("Receiving buffer: b'%s'" % (bytes_to_hexascii(self.rcv_buffer,)))
+                self.logger.debug("Receiving buffer: b'%s'", LazyBytesFormat(bytes_to_hexascii, self.rcv_buffer))
                 if pkt_len is None and len(self.rcv_buffer) >= 4:
                     pkt_len = int.from_bytes(self.rcv_buffer[0:4], byteorder='little')
                     self.logger.debug('Received begin of packet, length = %d' % (pkt_len,))
@@ -357,13 +488,17 @@ class camera:
                     for sock, evt in evts:
                         if evt and select.POLLIN:
                             if self.camera_socket is not None and sock == self.camera_socket.fileno():
-                                self.rcv_buffer += self.camera_socket.recv(4096)
+                                data = self.camera_socket.recv(4096)
+                                self.metrics.bytes_read(len(data))
+                                self.rcv_buffer += data
                 except Exception as ex:
                     self.logger.error('Exception in receive_packet(): %s' % (ex,))
                 if time.time() - t0 > self.PKT_COMPLETE_TIMEOUT_SEC:
                     self.logger.warning("Timeout in receive_packet(). Discarding buffer: b'%s'" % (bytes_to_hexascii(self.rcv_buffer),))
                     break
             # The packet is complete or receiving complete packet timeout.
+            if self.packet_trace is not None and pkt_data:
+                self.packet_trace.record(packet_trace.RECEIVED, pkt_data)
             self.parse_packet(pkt_data)
 
 
@@ -373,6 +508,7 @@ class camera:
         if len(pkt_data) == 0:
             return
         self.last_pkt_recv_time = time.time()
+        self.metrics.packet_received()
         if pkt_data == self.PKT_SYNC:
             self.is_connected = True
             return
@@ -383,7 +519,8 @@ class camera:
 
         header = pkt_data[:12]
         body = pkt_data[12:]
-        self.logger.info("Received packet: b'%s%s'" % (bytes_to_hex(header), bytes_to_hexascii(body)))
+        self.logger.info("Received packet: b'%s%s'", LazyBytesFormat(bytes_to_hex, header),
+                         LazyBytesFormat(bytes_to_hexascii, body), extra=PACKET_LOG)
         # Responses to messages (header is [:10], protobuf is at [12:])
         # b'\x04\x00\x00\xc8\x00\x02\x1d\x00\x00\x80\x00\x00'  # GetOptionsResp 'LOCAL_TIME', 'TIME_ZONE'
         # b'\x04\x00\x00\xc8\x00\x02\x1e\x00\x00\x80\x3f\x00'  # GetOptionsResp BATTERY_STATUS, STORAGE_STATE, CAMERA_TYPE, FIRMWAREREVISION
@@ -409,7 +546,8 @@ class camera:
         unknown_3       = pkt_data[10:11]   # 3f, bf, 63, 00, 40, 41, 76, 58, 31
         unknown_4       = pkt_data[11:12]   # 00, ee, ff, 85, 6b, d8, d0, f4, 5c, 0b, 34
 
-        self.logger.info("Received message: type: b'%s', code: %d, seq: %d" % (bytes_to_hex(response_type), response_code, response_seq))
+        self.logger.info("Received message: type: b'%s', code: %d, seq: %d", LazyBytesFormat(bytes_to_hex, response_type),
+                         response_code, response_seq, extra=PACKET_LOG)
 
         if response_code == self.RESPONSE_CODE_ERROR:
             message = self.parse_protobuf_message(error_pb2.Error(), body)
@@ -418,7 +556,11 @@ class camera:
                 err_code = error_pb2.Error.ErrorCode.Name(message.code)
                 self.logger.error('Message #%d raised %s "%s"' % (response_seq, err_code, err_message))
             if response_seq in self.sent_messages_codes:
-                del self.sent_messages_codes[response_seq]
+                self.metrics.response_received(response_seq, error=True)
+                sent_msg_code = self.sent_messages_codes.pop(response_seq)
+                # Notify the error, so that callers waiting for a response are unblocked.
+                if message is not None and self.callback_handler is not None:
+                    self.callback_handler(protobuf_to_dict(message, response_code=response_code, message_code=sent_msg_code))
             return
 
         # TODO: Handle the CAMERA_NOTIFICATION_CAPTURE_STOPPED response code (SD full, etc.)
@@ -445,12 +587,13 @@ class camera:
         if response_seq not in self.sent_messages_codes:
             return
 
+        self.metrics.response_received(response_seq)
         # Parse the protobuf message using the proper message type.
         sent_msg_code = self.sent_messages_codes[response_seq]
         sent_msg_class = self.pb_msg_class[sent_msg_code]
         proto_module = sent_msg_class.__class__.__module__
         proto_name = sent_msg_class.__class__.__name__
-        self.logger.info('Received response #%d to message "%s.%s()"' % (response_seq, proto_module, proto_name))
+        self.logger.info('Received response #%d to message "%s.%s()"', response_seq, proto_module, proto_name, extra=PACKET_LOG)
 
         message = None
         if sent_msg_code == self.PHONE_COMMAND_GET_OPTIONS:
@@ -460,6 +603,21 @@ class camera:
             message = self.parse_protobuf_message(set_options_pb2.SetOptionsResp(), body)
         elif sent_msg_code == self.PHONE_COMMAND_GET_FILE_LIST:
             message = self.parse_protobuf_message(get_file_list_pb2.GetFileListResp(), body)
+        elif sent_msg_code == self.PHONE_COMMAND_DELETE_FILES:
+            message = self.parse_protobuf_message(delete_files_pb2.DeleteFilesResp(), body)
+        elif sent_msg_code == self.PHONE_COMMAND_SET_STANDBY_MODE:
+            message = self.parse_protobuf_message(set_standby_mode_pb2.SetStandbyModeResp(), body)
+        elif sent_msg_code == self.PHONE_COMMAND_SET_WIFI_SEIZE_ENABLE:
+            message = self.parse_protobuf_message(set_wifi_seize_pb2.SetWifiSeizeEnableResp(), body)
+        elif sent_msg_code == self.PHONE_COMMAND_SET_ACCESS_CAMERA_FILE_STATE:
+            message = self.parse_protobuf_message(set_access_camera_file_state_pb2.SetAccessCameraFileStateResp(), body)
+        elif sent_msg_code == self.PHONE_COMMAND_GET_FILEINFO_LIST:
+            message = self.parse_protobuf_message(fileinfo_list_pb2.FileInfo_List(), body)
+            del self.sent_messages_codes[response_seq]
+            if message is not None and self.callback_handler is not None:
+                self.callback_handler(fileinfo_list_to_dict(message, response_code=self.RESPONSE_CODE_OK, message_code=sent_msg_code,
+                                                            logger=self.logger))
+            return
         elif sent_msg_code == self.PHONE_COMMAND_STOP_CAPTURE:
             message = self.parse_protobuf_message(stop_capture_pb2.StopCaptureResp(), body)
         elif sent_msg_code == self.PHONE_COMMAND_TAKE_PICTURE:
@@ -468,6 +626,13 @@ class camera:
             message = self.parse_protobuf_message(get_photography_options_pb2.GetPhotographyOptionsResp(), body)
         elif sent_msg_code == self.PHONE_COMMAND_GET_CURRENT_CAPTURE_STATUS:
             message = self.parse_protobuf_message(get_current_capture_status_pb2.GetCurrentCaptureStatusResp(), body)
+        elif sent_msg_code == self.PHONE_COMMAND_TEST_SD_CARD_SPEED:
+            message = self.parse_protobuf_message(sd_card_speed_pb2.TestSDCardSpeedResp(), body)
+        elif sent_msg_code in self.empty_response_codes:
+            del self.sent_messages_codes[response_seq]
+            if self.callback_handler is not None:
+                self.callback_handler({'response_code': self.RESPONSE_CODE_OK, 'message_code': sent_msg_code})
+            return
 
         # Remove the sequence number from the dictionary of sent messages.
         del self.sent_messages_codes[response_seq]
@@ -563,23 +728,119 @@ class camera:
         pass
 
 
-    def GetCameraFilesList(self):
+    def GetCameraFilesList(self, start=0, limit=500):
         """ Request file listing """
         message = {
             'media_type': 'VIDEO_AND_PHOTO',
-            'limit': 500
+            'start': start,
+            'limit': limit
         }
         return self.SendMessage(message, self.PHONE_COMMAND_GET_FILE_LIST)
 
 
-    def DeleteCameraFile(self):
-        pass
+    def GetCameraFileInfoList(self, start=0, limit=500):
+        """ Request file listing with size and metadata of each file """
+        message = {
+            'media_type': 'VIDEO_AND_PHOTO',
+            'start': start,
+            'limit': limit
+        }
+        return self.SendMessage(message, self.PHONE_COMMAND_GET_FILEINFO_LIST)
+
+
+    def DeleteCameraFiles(self, uris):
+        """ Delete a batch of files; the response lists the URIs which could not be deleted in fail_uri """
+        message = {
+            'uri': list(uris)
+        }
+        return self.SendMessage(message, self.PHONE_COMMAND_DELETE_FILES)
+
+
+    def DeleteCameraFile(self, uri):
+        """ Delete a single file """
+        return self.DeleteCameraFiles([uri])
 
 
     def DownloadCameraFile(self):
         pass
 
 
+    def OpenIperf(self, mode='TCP'):
+        """ Start the iperf server on the camera, to measure Wi-Fi throughput """
+        message = {
+            'mode': mode
+        }
+        return self.SendMessage(message, self.PHONE_COMMAND_OPEN_IPERF)
+
+
+    def CloseIperf(self):
+        """ Stop the iperf server on the camera """
+        message = {}
+        return self.SendMessage(message, self.PHONE_COMMAND_CLOSE_IPERF)
+
+
+    def TestSDCardSpeed(self, block_size, duration, times):
+        """ Run the camera SD card write speed test; the response holds one value per run in write_speeds """
+        message = {
+            'block_size': block_size,
+            'duration': duration,
+            'times': times
+        }
+        return self.SendMessage(message, self.PHONE_COMMAND_TEST_SD_CARD_SPEED)
+
+
+    def SetAccessCameraFileState(self, state):
+        """ Tell the camera what the files are accessed for: IDLE, EXPORT, DOWNLOAD, PLAYBACK, LIVE_VIEW """
+        message = {
+            'state': state
+        }
+        return self.SendMessage(message, self.PHONE_COMMAND_SET_ACCESS_CAMERA_FILE_STATE)
+
+
+    def SetWifiSeizeEnable(self, state):
+        """ Set whether other devices may take over the camera Wi-Fi: monopolized or seizable """
+        message = {
+            'state': state
+        }
+        return self.SendMessage(message, self.PHONE_COMMAND_SET_WIFI_SEIZE_ENABLE)
+
+
+    def SetStandbyMode(self, standby_mode):
+        """ Set STANDBY_MODE_WAKE_UP or STANDBY_MODE_LOW_ENERGY """
+        message = {
+            'standby_mode': standby_mode
+        }
+        return self.SendMessage(message, self.PHONE_COMMAND_SET_STANDBY_MODE)
+
+
+    def send_download_session_state(self):
+        """ Put the camera into bulk download state, as the official app does before transfers """
+        self.SetAccessCameraFileState('DOWNLOAD')
+        self.SetWifiSeizeEnable('monopolized')
+        self.SetStandbyMode('STANDBY_MODE_WAKE_UP')
+        self.last_wake_up_time = time.time()
+
+
+    @contextlib.contextmanager
+    def DownloadSession(self):
+        """ Context manager keeping the camera in DOWNLOAD state, restoring IDLE on exit """
+        # While the session is active the camera is kept awake by KeepAlive()
+        # and the state is sent again after a re-connection.
+        self.logger.info('Starting download session')
+        self.download_session_active = True
+        self.send_download_session_state()
+        try:
+            yield self
+        finally:
+            self.download_session_active = False
+            self.logger.info('Ending download session')
+            try:
+                self.SetAccessCameraFileState('IDLE')
+                self.SetWifiSeizeEnable('seizable')
+            except Exception as ex:
+                self.logger.error('Exception restoring camera state: %s' % (ex,))
+
+
     def SetNormalVideoOptions(self, record_resolution=None, fov_type=None, focal_length_value=None, gamma_mode=None, white_balance=None, white_balance_value=None):
         """ Set video capture settings """
         # Labels on camera display are not updated.
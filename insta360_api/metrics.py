@@ -0,0 +1,332 @@
+"""
+Protocol metrics of an Insta360 camera session.
+
+CameraMetrics counts what the camera client sends and receives: per message
+code, the latency from SendMessage() to the response resolved by
+parse_packet(), error responses and messages left unanswered, plus bytes and
+packets in each direction, socket (re)connections and the gaps between
+received packets, which keep-alives are meant to bound.
+
+Latencies and gaps are kept in Histogram, a log-linear histogram in the
+spirit of HdrHistogram: exact below SUB_BUCKETS microseconds, and within
+1/(SUB_BUCKETS/2) of the value above, with a fixed cost per sample and a
+small sparse bucket table whatever the range.
+
+snapshot() returns the counters as a dict; MetricsRegistry renders the
+metrics of one or more cameras in the Prometheus text format and
+serve_prometheus() exposes them over HTTP on /metrics.
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+DEFAULT_RESPONSE_TIMEOUT_SEC = 10.0
+# Upper bounds of the buckets exported to Prometheus, in seconds.
+PROMETHEUS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """ Log-linear histogram of non negative integer values (microseconds) """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def _bucket(value):
+        """ Return (index, lowest value) of the bucket of value """
+        if value < SUB_BUCKETS:
+            return value, value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        mantissa = value >> shift
+        return SUB_BUCKETS + (shift - 1) * (SUB_BUCKETS // 2) + mantissa - SUB_BUCKETS // 2, mantissa << shift
+
+    def record(self, value):
+        value = max(0, int(value))
+        index, low = self._bucket(value)
+        entry = self.counts.get(index)
+        if entry is None:
+            self.counts[index] = [low, 1]
+        else:
+            entry[1] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """ Return the lowest value of the bucket holding the p-th percentile, or None if empty """
+        if not self.count:
+            return None
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            low, n = self.counts[index]
+            seen += n
+            if seen >= rank:
+                return max(low, self.min)
+        return self.max
+
+    def cumulative(self, bounds):
+        """ Return the count of values <= each bound, as needed by Prometheus buckets """
+        buckets = sorted(self.counts.values())
+        result = []
+        for bound in bounds:
+            result.append(sum(n for low, n in buckets if low <= bound))
+        return result
+
+    def summary(self, scale=1e-6):
+        """ Return count, mean, min, max and percentiles, scaled (to seconds by default) """
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count * scale,
+            'min': self.min * scale,
+            'p50': self.percentile(50) * scale,
+            'p90': self.percentile(90) * scale,
+            'p99': self.percentile(99) * scale,
+            'max': self.max * scale,
+        }
+
+
+class _MessageStats:
+    """ Counters of one message code """
+
+    def __init__(self):
+        self.sent = 0
+        self.responses = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latency = Histogram()
+
+
+class CameraMetrics:
+    """ Thread safe protocol counters, updated by camera() """
+
+    def __init__(self, response_timeout_sec=DEFAULT_RESPONSE_TIMEOUT_SEC, code_names=None):
+        self.response_timeout_sec = response_timeout_sec
+        # Message code -> name, for the reports.
+        self.code_names = code_names or {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.messages = {}
+        self.pending = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.connects = 0
+        self.link_timeouts = 0
+        self.late_responses = 0
+        self.receive_gap = Histogram()
+        self.last_receive = None
+
+    def _stats(self, message_code):
+        stats = self.messages.get(message_code)
+        if stats is None:
+            stats = self.messages[message_code] = _MessageStats()
+        return stats
+
+    def _expire(self, now):
+        """ Count the messages unanswered for response_timeout_sec as timeouts; caller holds the lock """
+        expired = [seq for seq, (code, t) in self.pending.items() if now - t > self.response_timeout_sec]
+        for seq in expired:
+            code, _ = self.pending.pop(seq)
+            self._stats(code).timeouts += 1
+
+    def message_sent(self, seq, message_code):
+        now = time.monotonic()
+        with self.lock:
+            self._stats(message_code).sent += 1
+            self.pending[seq] = (message_code, now)
+            if len(self.pending) > 16:
+                self._expire(now)
+
+    def message_failed(self, seq):
+        """ The message could not be sent: forget it """
+        with self.lock:
+            entry = self.pending.pop(seq, None)
+            if entry is not None:
+                self._stats(entry[0]).sent -= 1
+
+    def response_received(self, seq, error=False):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.pending.pop(seq, None)
+            if entry is None:
+                # Already counted as a timeout, or sent before a reconnection.
+                self.late_responses += 1
+                return
+            message_code, t = entry
+            stats = self._stats(message_code)
+            stats.responses += 1
+            if error:
+                stats.errors += 1
+            stats.latency.record((now - t) * 1e6)
+
+    def packet_sent(self, nbytes):
+        with self.lock:
+            self.packets_sent += 1
+            self.bytes_sent += nbytes
+
+    def bytes_read(self, nbytes):
+        with self.lock:
+            self.bytes_received += nbytes
+
+    def packet_received(self):
+        now = time.monotonic()
+        with self.lock:
+            self.packets_received += 1
+            if self.last_receive is not None:
+                self.receive_gap.record((now - self.last_receive) * 1e6)
+            self.last_receive = now
+
+    def connection_opened(self):
+        with self.lock:
+            self.connects += 1
+            self.last_receive = None
+
+    def connection_closed(self):
+        """ Messages still pending will never be answered on this connection """
+        with self.lock:
+            for message_code, _ in self.pending.values():
+                self._stats(message_code).timeouts += 1
+            self.pending.clear()
+
+    def link_timeout(self):
+        with self.lock:
+            self.link_timeouts += 1
+
+    def snapshot(self):
+        """ Return all counters as a dict; latencies and gaps are in seconds """
+        with self.lock:
+            self._expire(time.monotonic())
+            messages = {}
+            for code, stats in sorted(self.messages.items()):
+                messages[code] = {
+                    'name': self.code_names.get(code, str(code)),
+                    'sent': stats.sent,
+                    'responses': stats.responses,
+                    'errors': stats.errors,
+                    'timeouts': stats.timeouts,
+                    'latency': stats.latency.summary(),
+                }
+            return {
+                'uptime_sec': time.time() - self.started,
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'packets_sent': self.packets_sent,
+                'packets_received': self.packets_received,
+                'reconnects': max(0, self.connects - 1),
+                'link_timeouts': self.link_timeouts,
+                'late_responses': self.late_responses,
+                'pending': len(self.pending),
+                'receive_gap': self.receive_gap.summary(),
+                'messages': messages,
+            }
+
+    def prometheus_lines(self, labels=''):
+        """ Return the metrics in the Prometheus text format, without HELP/TYPE lines """
+        with self.lock:
+            self._expire(time.monotonic())
+            lines = []
+            sep = ',' if labels else ''
+            for name, value in (('bytes_sent_total', self.bytes_sent), ('bytes_received_total', self.bytes_received),
+                                ('packets_sent_total', self.packets_sent), ('packets_received_total', self.packets_received),
+                                ('reconnects_total', max(0, self.connects - 1)), ('link_timeouts_total', self.link_timeouts),
+                                ('late_responses_total', self.late_responses), ('pending_messages', len(self.pending))):
+                lines.append('insta360_%s{%s} %d' % (name, labels, value))
+            lines.extend(_histogram_lines('insta360_receive_gap_seconds', labels, self.receive_gap))
+            for code, stats in sorted(self.messages.items()):
+                code_labels = '%s%scode="%d",name="%s"' % (labels, sep, code, self.code_names.get(code, str(code)))
+                for name, value in (('sent', stats.sent), ('responses', stats.responses),
+                                    ('errors', stats.errors), ('timeouts', stats.timeouts)):
+                    lines.append('insta360_messages_%s_total{%s} %d' % (name, code_labels, value))
+                lines.extend(_histogram_lines('insta360_response_latency_seconds', code_labels, stats.latency))
+            return lines
+
+
+def _histogram_lines(name, labels, histogram):
+    sep = ',' if labels else ''
+    lines = []
+    for bound, count in zip(PROMETHEUS_BUCKETS, histogram.cumulative([b * 1e6 for b in PROMETHEUS_BUCKETS])):
+        lines.append('%s_bucket{%s%sle="%g"} %d' % (name, labels, sep, bound, count))
+    lines.append('%s_bucket{%s%sle="+Inf"} %d' % (name, labels, sep, histogram.count))
+    lines.append('%s_sum{%s} %.6f' % (name, labels, histogram.total * 1e-6))
+    lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+    return lines
+
+
+class MetricsRegistry:
+    """ The CameraMetrics of every camera of the process, by camera label """
+
+    TYPES = (
+        ('insta360_bytes_sent_total', 'counter'), ('insta360_bytes_received_total', 'counter'),
+        ('insta360_packets_sent_total', 'counter'), ('insta360_packets_received_total', 'counter'),
+        ('insta360_reconnects_total', 'counter'), ('insta360_link_timeouts_total', 'counter'),
+        ('insta360_late_responses_total', 'counter'), ('insta360_pending_messages', 'gauge'),
+        ('insta360_receive_gap_seconds', 'histogram'),
+        ('insta360_messages_sent_total', 'counter'), ('insta360_messages_responses_total', 'counter'),
+        ('insta360_messages_errors_total', 'counter'), ('insta360_messages_timeouts_total', 'counter'),
+        ('insta360_response_latency_seconds', 'histogram'),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cameras = {}
+
+    def add(self, label, metrics):
+        with self.lock:
+            self.cameras[label] = metrics
+
+    def render(self):
+        """ Return the metrics of all cameras in the Prometheus text exposition format """
+        with self.lock:
+            cameras = sorted(self.cameras.items())
+        by_name = {}
+        for label, metrics in cameras:
+            for line in metrics.prometheus_lines('camera="%s"' % (label,)):
+                name = line.split('{', 1)[0]
+                for suffix in ('_bucket', '_sum', '_count'):
+                    if name.endswith(suffix) and name[:-len(suffix)].endswith('_seconds'):
+                        name = name[:-len(suffix)]
+                by_name.setdefault(name, []).append(line)
+        lines = []
+        for name, kind in self.TYPES:
+            if name in by_name:
+                lines.append('# TYPE %s %s' % (name, kind))
+                lines.extend(by_name[name])
+        return '\n'.join(lines) + '\n'
+
+
+def serve_prometheus(registry, host='127.0.0.1', port=9360):
+    """ Serve registry.render() on http://host:port/metrics from a daemon thread; return the server """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
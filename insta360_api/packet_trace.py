@@ -0,0 +1,164 @@
+"""
+Compact binary trace of the packets exchanged with an Insta360 camera.
+
+A lighter alternative to logging every packet as a hex dump: each packet is
+stored as it is, behind a fixed size record header, and the file is written
+through a large buffer. The file starts with TRACE_MAGIC, followed by
+records of:
+
+  RECORD_HEADER  timestamp (float64, Unix time), direction (uint8,
+                 SENT or RECEIVED), length (uint32), little endian
+  payload        the packet without its 4-byte length prefix
+
+With max_bytes, the trace rotates like logging.handlers.RotatingFileHandler:
+path is renamed to path.1, path.1 to path.2 and so on, up to backup_count.
+
+read_trace() iterates over the records of a trace file and replay() feeds a
+trace back through camera.parse_packet(), to benchmark the parser on real
+traffic or to debug a field issue without the camera:
+
+  python -m insta360_api.packet_trace TRACE_FILE [--max-speed] [--repeat N] [--quiet]
+"""
+
+import argparse
+import logging
+import os
+import struct
+import threading
+import time
+
+TRACE_MAGIC = b'I360TRC1'
+RECORD_HEADER = struct.Struct('<dBI')
+SENT = 0
+RECEIVED = 1
+
+
+class PacketTrace:
+    """ Appends packets to a binary trace file, optionally rotating it """
+
+    BUFFER_SIZE = 256 * 1024
+
+    def __init__(self, path, max_bytes=None, backup_count=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.lock = threading.Lock()
+        self.file = None
+        self.size = 0
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, 'ab', buffering=self.BUFFER_SIZE)
+        self.size = self.file.tell()
+        if self.size == 0:
+            self.file.write(TRACE_MAGIC)
+            self.size = len(TRACE_MAGIC)
+
+    def _rotate(self):
+        """ Close the current file and shift path -> path.1 -> ... -> path.<backup_count> """
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = '%s.%d' % (self.path, i)
+            if os.path.exists(src):
+                os.replace(src, '%s.%d' % (self.path, i + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def record(self, direction, payload):
+        """ Append one packet; direction is SENT or RECEIVED """
+        with self.lock:
+            if self.file is None:
+                return
+            if self.max_bytes and self.size + RECORD_HEADER.size + len(payload) > self.max_bytes and self.size > len(TRACE_MAGIC):
+                self._rotate()
+            self.file.write(RECORD_HEADER.pack(time.time(), direction, len(payload)))
+            self.file.write(payload)
+            self.size += RECORD_HEADER.size + len(payload)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_trace(path):
+    """ Yield (timestamp, direction, payload) for each packet of a trace file """
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError('%s is not a packet trace' % (path,))
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # End of file, or a record torn by a crash.
+                return
+            timestamp, direction, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield timestamp, direction, payload
+
+
+def replay(path, client, max_speed=True):
+    """
+    Feed the packets received in a trace to client.parse_packet().
+
+    Sent messages are not transmitted: their sequence number and message code
+    are registered in client.sent_messages_codes, as SendMessage() does, so
+    that the responses are parsed with the right protobuf class. At original
+    speed, packets are delivered with the delays they were captured with.
+    Returns a dict with the counts of sent and received packets, received
+    bytes and the time spent in parse_packet().
+    """
+    stats = {'sent': 0, 'received': 0, 'received_bytes': 0, 'parse_sec': 0.0}
+    first_timestamp = None
+    t_start = time.monotonic()
+    for timestamp, direction, payload in read_trace(path):
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        if not max_speed:
+            delay = (timestamp - first_timestamp) - (time.monotonic() - t_start)
+            if delay > 0:
+                time.sleep(delay)
+        if direction == SENT:
+            stats['sent'] += 1
+            # Message packets: b'\x04\x00\x00' + code (2 bytes) + b'\x02' + seq (3 bytes) + ...
+            if len(payload) >= 12 and payload[0:3] == b'\x04\x00\x00':
+                message_code = struct.unpack('<H', payload[3:5])[0]
+                seq = struct.unpack('<I', payload[6:9] + b'\x00')[0]
+                client.sent_messages_codes[seq] = message_code
+        else:
+            stats['received'] += 1
+            stats['received_bytes'] += len(payload)
+            t0 = time.perf_counter()
+            client.parse_packet(payload)
+            stats['parse_sec'] += time.perf_counter() - t0
+    return stats
+
+
+def main():
+    from .insta360 import camera
+    parser = argparse.ArgumentParser(description='Replay a packet trace through the camera packet parser.')
+    parser.add_argument('trace_file')
+    parser.add_argument('--max-speed', action='store_true', help='Do not reproduce the captured timing.')
+    parser.add_argument('--repeat', type=int, default=1, help='Replay the trace several times.')
+    parser.add_argument('--quiet', action='store_true', help='Log warnings only, to measure the parser alone.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    responses = []
+    # Not connected: the client never opens its socket.
+    client = camera(logger=logging.getLogger('replay'), callback=responses.append)
+    totals = {'sent': 0, 'received': 0, 'received_bytes': 0, 'parse_sec': 0.0}
+    for _ in range(args.repeat):
+        for key, value in replay(args.trace_file, client, max_speed=args.max_speed).items():
+            totals[key] += value
+    parse_sec = totals['parse_sec'] or 1e-9
+    print('%d packets sent, %d received (%d bytes), %d callbacks' % (totals['sent'], totals['received'], totals['received_bytes'], len(responses)))
+    print('parse_packet(): %.3f s, %.0f packets/s, %.1f MB/s' % (totals['parse_sec'], totals['received'] / parse_sec, totals['received_bytes'] / parse_sec / 1e6))
+
+
+if __name__ == '__main__':
+    main()
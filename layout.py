@@ -0,0 +1,110 @@
+# Destination layout for the Insta360 Sync application.
+import hashlib
+import itertools
+import re
+import string
+import time
+from pathlib import PurePosixPath
+
+# Files directly in the destination directory, as before layouts existed.
+DEFAULT_TEMPLATE = '{name}'
+_DATE_IN_NAME = re.compile(r'_(\d{4})(\d{2})(\d{2})_\d{6}_')
+_TYPE_BY_PREFIX = {'VID': 'video', 'PRO_VID': 'video', 'IMG': 'photo', 'LRV': 'proxy', 'PRO_LRV': 'proxy'}
+_TYPE_BY_EXTENSION = {'.insv': 'video', '.mp4': 'video', '.insp': 'photo', '.jpg': 'photo', '.dng': 'photo', '.lrv': 'proxy'}
+
+
+class LayoutError(Exception):
+    """Raised for an invalid layout template."""
+
+
+class Layout:
+    """
+    Maps camera files to paths below the destination directory.
+
+    The template is a str.format() pattern with these fields:
+      {name}    file name, e.g. VID_20230715_123456_00_001.insv
+      {stem}    file name without extension; {ext} the extension, without the dot
+      {serial}  camera serial number ("unknown" if the camera did not report it)
+      {folder}  the camera directory of the file, e.g. Camera01
+      {type}    video, photo, proxy or other
+      {date}    capture date as YYYY-MM-DD; {year}, {month}, {day} its parts
+      {shard}   two hex digits from a hash of serial and URI, to spread files
+                over 256 directories of similar size
+    e.g. "{serial}/{year}/{month}/{type}/{name}" or "{shard}/{name}".
+    """
+
+    FIELDS = ('name', 'stem', 'ext', 'serial', 'folder', 'type', 'date', 'year', 'month', 'day', 'shard')
+
+    def __init__(self, template=DEFAULT_TEMPLATE):
+        template = template.strip() or DEFAULT_TEMPLATE
+        fields = set()
+        try:
+            for _, field, _, _ in string.Formatter().parse(template):
+                if field is not None:
+                    fields.add(field)
+        except ValueError as e:
+            raise LayoutError(f"invalid layout template '{template}': {e}") from e
+        unknown = fields - set(self.FIELDS)
+        if unknown:
+            raise LayoutError(f"unknown layout fields {', '.join(sorted(unknown))} in '{template}'")
+        if not fields & {'name', 'stem'}:
+            raise LayoutError(f"layout template '{template}' must contain {{name}} or {{stem}}")
+        if template.startswith('/') or '..' in PurePosixPath(template).parts:
+            raise LayoutError(f"layout template '{template}' must stay inside the destination directory")
+        self.template = template
+
+    def relative_path(self, filename, remote_file, serial):
+        """
+        Returns the path of a camera file relative to the destination directory.
+        Args:
+            filename (str): The file name.
+            remote_file (dict): Remote file information ({'uri', 'size', 'creation_time'}).
+            serial (str): The camera serial number, or None.
+        Returns:
+            str: A relative POSIX path, used as the manifest key.
+        """
+        uri = remote_file['uri']
+        stem, dot, ext = filename.rpartition('.')
+        if not dot:
+            stem, ext = filename, ''
+        prefix = filename.split('_', 2)
+        file_type = _TYPE_BY_PREFIX.get(prefix[0].upper())
+        if file_type is None and len(prefix) > 1:
+            file_type = _TYPE_BY_PREFIX.get('_'.join(prefix[:2]).upper())
+        if file_type is None:
+            file_type = _TYPE_BY_EXTENSION.get(f'.{ext.lower()}', 'other')
+        match = _DATE_IN_NAME.search(filename)
+        if match is not None:
+            year, month, day = match.groups()
+        elif remote_file.get('creation_time'):
+            year, month, day = time.strftime('%Y-%m-%d', time.localtime(remote_file['creation_time'])).split('-')
+        else:
+            year, month, day = 'undated', '', ''
+        serial = serial or 'unknown'
+        path = self.template.format(
+            name=filename, stem=stem, ext=ext, serial=serial,
+            folder=PurePosixPath(uri).parent.name or 'root', type=file_type,
+            date='-'.join(p for p in (year, month, day) if p), year=year, month=month or '00', day=day or '00',
+            shard=hashlib.sha1(f"{serial}/{uri}".encode()).hexdigest()[:2])
+        return str(PurePosixPath(*[part for part in PurePosixPath(path).parts if part not in ('', '/', '.', '..')]))
+
+    def resolve(self, filename, remote_file, serial, manifest, taken=()):
+        """
+        Returns the manifest key for a camera file that is not in the manifest yet.
+
+        If the templated path is already recorded for another file (another
+        camera, or an earlier card with the same file names), a suffix with the
+        serial number, then a counter, is added before the extension. Keys
+        in taken, given to other files of the same listing, are skipped too.
+        """
+        path = PurePosixPath(self.relative_path(filename, remote_file, serial))
+        names = itertools.chain([path.name, f"{path.stem}~{serial or 'unknown'}{path.suffix}"],
+                                (f"{path.stem}~{n}{path.suffix}" for n in range(2, 1000)))
+        for name in names:
+            candidate = str(path.with_name(name))
+            if candidate in taken:
+                continue
+            entry = manifest.get(candidate)
+            if entry is None or (entry.get('uri') == remote_file['uri'] and entry.get('camera_serial') in (None, serial)):
+                return candidate
+        raise LayoutError(f"no free destination path for {filename}")
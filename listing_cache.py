@@ -0,0 +1,88 @@
+# Remote listing cache for the Insta360 Sync application.
+import json
+import os
+import re
+import time
+
+
+class ListingCache:
+    """
+    Remembers the last remote file listing of each camera.
+
+    Entries are keyed by the camera serial number and carry a storage
+    fingerprint (SD card free and total space). If the fingerprint reported by
+    the camera is unchanged, nothing was recorded or deleted since the listing
+    was taken, so it can be reused instead of listing the card again. When the
+    previous sync also completed, the whole sync can be skipped.
+    """
+
+    DIR_NAME = '.insta360_listing_cache'
+
+    def __init__(self, dest_dir, logger):
+        """
+        Initializes the cache.
+        Args:
+            dest_dir (Path): The backup destination directory.
+            logger: The logging object for logging messages.
+        """
+        self.logger = logger
+        self.cache_dir = dest_dir / self.DIR_NAME
+
+    def _path(self, serial):
+        """Returns the cache file for a camera serial number."""
+        safe_serial = re.sub(r'[^A-Za-z0-9_.-]', '_', serial)
+        return self.cache_dir / f"{safe_serial}.json"
+
+    def load(self, serial, fingerprint):
+        """
+        Returns the cached entry for the camera if its fingerprint still matches.
+        Returns:
+            dict: {'files', 'complete', 'saved_at', ...}, or None.
+        """
+        path = self._path(serial)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable listing cache {path}: {e}")
+            return None
+        if cached.get('fingerprint') != fingerprint:
+            self.logger.info(f"Camera {serial} storage changed since the cached listing.")
+            return None
+        return cached
+
+    def save(self, serial, fingerprint, files, complete):
+        """
+        Stores the listing of a camera.
+        Args:
+            serial (str): The camera serial number.
+            fingerprint (dict): The storage fingerprint the listing belongs to.
+            files (dict): The remote files map, as returned by the listing.
+            complete (bool): True if every listed file is downloaded (and deleted, if enabled).
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(serial)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'serial': serial,
+                'fingerprint': fingerprint,
+                'files': files,
+                'complete': complete,
+                'saved_at': time.time(),
+            }, f)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, serials=None):
+        """Drops the cached listings of the given camera serial numbers, or of all cameras."""
+        if serials is None:
+            paths = list(self.cache_dir.glob('*.json')) if self.cache_dir.is_dir() else []
+        else:
+            paths = [self._path(serial) for serial in serials]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,116 @@
+# Logging setup for the Insta360 Sync application.
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+PACKET_LOG_MODES = ('full', 'rate_limited', 'off')
+DEFAULT_PACKET_LOG_RATE = 20
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s'
+
+
+class PacketLogFilter(logging.Filter):
+    """
+    Limits the per-packet protocol logs of the camera client.
+
+    Records logged with extra={'packet_log': True} (see insta360.PACKET_LOG)
+    are let through up to rate per second in "rate_limited" mode, all of them
+    in "full" mode and none in "off" mode. The first record let through after
+    some were dropped says how many. Other records are never filtered.
+    """
+
+    def __init__(self, mode='rate_limited', rate=DEFAULT_PACKET_LOG_RATE):
+        super().__init__()
+        self.mode = mode
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._window_start = 0.0
+        self._count = 0
+        self._suppressed = 0
+
+    def filter(self, record):
+        if not getattr(record, 'packet_log', False) or self.mode == 'full':
+            return True
+        if self.mode == 'off':
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start = now
+                self._count = 0
+            if self._count >= self.rate:
+                self._suppressed += 1
+                return False
+            self._count += 1
+            if self._suppressed:
+                record.msg = f"({self._suppressed} packet log lines suppressed) {record.msg}"
+                self._suppressed = 0
+        return True
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves message formatting to the listener thread.
+
+    QueueHandler.prepare() formats every record before queueing it, which
+    would render packet hex dumps and protobuf messages on the receive thread.
+    Records go through a queue.Queue in this process, so they can be queued
+    as they are.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(log_file, log_level, packet_log='rate_limited', packet_log_rate=DEFAULT_PACKET_LOG_RATE):
+    """
+    Routes all logging through a queue to a dedicated writer thread.
+
+    Logging calls only create a record and queue it; formatting and writing to
+    the log file and the console happen on the listener thread, so slow log
+    storage (e.g. an SD card) does not stall the camera receive loop.
+    Args:
+        log_file (str): Path of the log file.
+        log_level (str): Level name, e.g. "INFO".
+        packet_log (str): Per-packet protocol logs: "full", "rate_limited" or "off".
+        packet_log_rate (int): Per-packet log lines per second in "rate_limited" mode.
+    Returns:
+        logging.Logger: The application logger.
+    """
+    level = getattr(logging, str(log_level).strip().upper(), logging.INFO)
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(formatter)
+    handlers.append(console_handler)
+    file_error = None
+    try:
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    except OSError as e:
+        file_error = e
+
+    log_queue = queue.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Stopping the listener flushes the records still queued at exit.
+    atexit.register(listener.stop)
+
+    queue_handler = _DeferredQueueHandler(log_queue)
+    if packet_log not in PACKET_LOG_MODES:
+        packet_log = 'rate_limited'
+    queue_handler.addFilter(PacketLogFilter(packet_log, packet_log_rate))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    logger = logging.getLogger('insta360_sync')
+    if file_error is not None:
+        logger.warning(f"Cannot write log file {log_file}, logging to the console only: {file_error}")
+    return logger
@@ -1,30 +1,87 @@
 # Main entry point for the Insta360 Sync application.
+import argparse
 import configparser
+import json
 import logging
+import multiprocessing
 import os
 import platform
 import sys
 from pathlib import Path
+import queue
 import time
 import threading # Added for callback event handling
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests # Added for HTTP file downloads
-from tqdm import tqdm # Added for progress bar
 
 from wifi_manager import WifiManager
+from logging_setup import DEFAULT_PACKET_LOG_RATE, setup_logging
+import netns
+from transfer import WriteBehindWriter, VerificationError, TruncatedDownloadError, PART_SUFFIX, clamp_buffer_size, make_http_session, stream_response
+from hashing import DEFAULT_HASH_ALGORITHM, is_hash_available, new_hash, update_from_file
+from manifest import Manifest
+from camera_cleanup import VerifiedDeleter
+from listing_cache import ListingCache
+from readiness import run_dhcp, wait_until_ready
+from supervisor import SessionSupervisor
+from probe import LinkProbe
+from tracing import get_tracer
+from progress import DEFAULT_INTERVAL_SEC, PROGRESS_MODES, ProgressTracker
+from capture_units import group_capture_units
+from layout import DEFAULT_TEMPLATE, Layout, LayoutError
+from staging import DEFAULT_MOVER_WORKERS, IO_PRIORITIES, StagingMover
+from space import DEFAULT_MIN_FREE_MB, SPACE_POLICIES, plan_space
+from durability import DEFAULT_BATCH_FILES, DEFAULT_BATCH_SEC, DURABILITY_MODES, CommitItem, GroupCommitter
+from scrub import DEFAULT_CHECKPOINT_INTERVAL_SEC, Scrubber
+from profiler import DEFAULT_SAMPLE_INTERVAL_SEC, PROFILE_MODES, start_profiler, stop_profiler
 from insta360_api.insta360 import camera # Corrected: Import the 'camera' class
+from insta360_api.metrics import DEFAULT_RESPONSE_TIMEOUT_SEC, CameraMetrics, MetricsRegistry, serve_prometheus
+from insta360_api.packet_trace import PacketTrace
 
 # Protobuf message codes, for callback handling
 from insta360_api.pb2 import get_file_list_pb2
 
+# Readiness check and Open() rounds before giving up on the camera API.
+API_CONNECT_ATTEMPTS = 3
+tracer = get_tracer()
+
 class Insta360CallbackHandler:
     """
     A callback handler for the Insta360 camera API to process asynchronous responses.
+
+    Responses are stored per message code. Call expect() before sending a
+    message and wait_for() afterwards to get its response (or error).
     """
     def __init__(self, logger):
         self.logger = logger
-        self.file_list_response = None
-        self.event = threading.Event()
-        self.file_list_lock = threading.Lock() # To protect file_list_response
+        self.responses = {}
+        self.events = {}
+        self.lock = threading.Lock() # To protect responses and events
+
+    def _event(self, message_code):
+        """Returns the event for message_code. Caller holds self.lock."""
+        if message_code not in self.events:
+            self.events[message_code] = threading.Event()
+        return self.events[message_code]
+
+    def expect(self, message_code):
+        """Forgets any previous response to message_code, before sending it again."""
+        with self.lock:
+            self.responses.pop(message_code, None)
+            self._event(message_code).clear()
+
+    def wait_for(self, message_code, timeout):
+        """
+        Waits for the response to message_code.
+        Returns:
+            dict: The response (OK or ERROR), or None on timeout.
+        """
+        with self.lock:
+            event = self._event(message_code)
+        if not event.wait(timeout=timeout):
+            return None
+        with self.lock:
+            return self.responses.get(message_code)
 
     def __call__(self, message_dict):
         """
@@ -34,201 +91,991 @@ class Insta360CallbackHandler:
         message_code = message_dict.get('message_code')
 
         if response_code == camera.RESPONSE_CODE_OK:
-            if message_code == camera.PHONE_COMMAND_GET_FILE_LIST:
-                self.logger.debug(f"Received GetFileList response: {message_dict}")
-                with self.file_list_lock:
-                    self.file_list_response = message_dict
-                self.event.set() # Signal that the file list has arrived
-            else:
-                self.logger.debug(f"Received unhandled OK response for message code: {message_code}")
+            self.logger.debug(f"Received OK response for message code {message_code}: {message_dict}")
         elif response_code == camera.RESPONSE_CODE_ERROR:
             self.logger.error(f"Received ERROR response for message code {message_code}: {message_dict}")
-            self.event.set() # Signal even on error to unblock main thread
         else:
             self.logger.debug(f"Received non-OK/ERROR response: {message_dict}")
+            return
+        if message_code is None:
+            return
+        with self.lock:
+            self.responses[message_code] = message_dict
+            self._event(message_code).set() # Signal even on error to unblock the waiting thread
 
-def _sync_files(insta360_client, dest_dir, logger, camera_ip, callback_handler, delete_after_download):
+def _download_file(download_url, local_file_path, writer, hash_algorithm, expected_size=None, on_progress=None, http_session=None,
+                   resume=False, commit=True):
     """
-    Synchronizes files from Insta360 camera to the local destination directory.
+    Downloads one file, hashing it while it streams to disk.
+
+    Data is written to a ".part" file which is renamed to local_file_path only
+    after its size matches the Content-Length announced by the camera and the
+    expected_size from the file listing, if known.
+
+    With resume, an existing ".part" file left by an interrupted attempt is
+    continued with a Range request: its content is hashed again and the rest
+    is appended. If the camera answers with the whole file, the download
+    starts over (and on_progress is called with minus the discarded bytes).
+    A ".part" file which already has expected_size bytes is only hashed.
+    Without expected_size, the total comes from the Content-Range header of
+    the response.
+
+    With commit=False the file is left as ".part", to be renamed with
+    _commit_download() together with the rest of its capture unit.
+    Returns:
+        dict: Manifest fields (size, hash, hash_algorithm, downloaded_at).
+    Raises:
+        VerificationError: If the downloaded size does not match.
+    """
+    part_path = local_file_path.with_name(local_file_path.name + PART_SUFFIX)
+    offset = 0
+    if resume and part_path.exists():
+        offset = part_path.stat().st_size
+        if expected_size is not None and offset > expected_size:
+            offset = 0
+    if offset and offset == expected_size:
+        # Completed by an earlier attempt whose capture unit was not committed.
+        hasher = new_hash(hash_algorithm)
+        update_from_file(hasher, part_path)
+        if on_progress:
+            on_progress(offset)
+        size, digest = offset, hasher.hexdigest()
+    else:
+        size, digest = _fetch_to_part(download_url, part_path, writer, hash_algorithm, offset, on_progress, http_session)
+        if expected_size is not None and size != expected_size:
+            raise VerificationError(f"received {size} bytes, file listing reported {expected_size}")
+    if commit:
+        _commit_download(local_file_path)
+    return {
+        'size': size,
+        'hash': digest,
+        'hash_algorithm': hash_algorithm,
+        'downloaded_at': time.time(),
+    }
+
+def _fetch_to_part(download_url, part_path, writer, hash_algorithm, offset, on_progress, http_session):
+    """
+    Streams download_url into part_path from offset (see _download_file).
+    Returns:
+        tuple: (size, hex digest) of the whole ".part" file.
+    """
+    headers = {'Range': f'bytes={offset}-'} if offset else None
+    get = http_session.get if http_session is not None else requests.get
+    t_request = time.time_ns()
+    with get(download_url, stream=True, timeout=10, headers=headers) as r:
+        tracer.add('http_ttfb', t_request, time.time_ns(), status=r.status_code)
+        # "bytes 100-199/200" for a partial response, "bytes */200" for a range past the end.
+        content_range = r.headers.get('content-range', '')
+        range_total = content_range.rpartition('/')[2]
+        range_total = int(range_total) if range_total.isdigit() else None
+        if offset and r.status_code == 416:
+            if range_total != offset:
+                # The ".part" file is longer than the camera file: start over.
+                return _fetch_to_part(download_url, part_path, writer, hash_algorithm, 0, on_progress, http_session)
+            # The ".part" file already holds the whole file, whose size the listing did not report.
+            hasher = new_hash(hash_algorithm)
+            update_from_file(hasher, part_path)
+            if on_progress:
+                on_progress(offset)
+            return offset, hasher.hexdigest()
+        r.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
+        total_size = None
+        if offset and content_range.startswith(f'bytes {offset}-'):
+            total_size = range_total
+        elif offset:
+            # Range not honoured: the response holds the whole file.
+            if on_progress:
+                on_progress(-offset)
+            offset = 0
+        if total_size is None and 'content-length' in r.headers:
+            total_size = offset + int(r.headers['content-length'])
+
+        hasher = new_hash(hash_algorithm)
+        if offset:
+            update_from_file(hasher, part_path, offset)
+        writer.open(part_path, hasher=hasher, offset=offset, size=total_size)
+        try:
+            with tracer.span('transfer', offset=offset) as span:
+                # The writer belongs to this worker: its stall time grows only with this file.
+                stall_sec = writer.stats()['reader_stall_sec']
+                size = offset + stream_response(r, writer, on_progress=on_progress)
+                span.set('bytes', size - offset)
+                span.set('write_stall_sec', writer.stats()['reader_stall_sec'] - stall_sec)
+        finally:
+            with tracer.span('write_flush'):
+                digest = writer.close()
+
+    if total_size is not None and size != total_size:
+        # http.client reports a connection closed mid-body as a short read, not as an error.
+        error = TruncatedDownloadError if size < total_size else VerificationError
+        raise error(f"received {size} bytes, expected {total_size}")
+    return size, digest
+
+def _commit_download(local_file_path):
+    """Renames the verified ".part" file of local_file_path to its final name."""
+    os.replace(local_file_path.with_name(local_file_path.name + PART_SUFFIX), local_file_path)
+
+def _request_listing_page(insta360_client, callback_handler, logger, message_code, start, limit):
+    """Requests one page of the remote file listing. Returns the response dict, or None on failure."""
+    callback_handler.expect(message_code)
+    if message_code == camera.PHONE_COMMAND_GET_FILEINFO_LIST:
+        insta360_client.GetCameraFileInfoList(start=start, limit=limit)
+    else:
+        insta360_client.GetCameraFilesList(start=start, limit=limit)
+    # Wait for the file list response for up to 30 seconds
+    response = callback_handler.wait_for(message_code, timeout=30)
+    if response is None:
+        logger.error("Timeout waiting for file list from camera.")
+        return None
+    if response.get('response_code') != camera.RESPONSE_CODE_OK:
+        logger.error("Failed to retrieve file list or received error response.")
+        return None
+    return response
+
+def _list_remote_files(insta360_client, callback_handler, logger, listing_mode, page_size=500):
+    """
+    Retrieves the list of files on the camera.
+
+    In "fileinfo" mode a single GetFileInfoList request per page returns size
+    and creation time of every file, so no per-file HTTP request is needed to
+    detect truncated local copies. If the camera does not answer it, the
+    URI-only GetFileList is used.
+    Returns:
+        dict: Map of filename to {'uri', 'size', 'creation_time'}, or None on failure.
     """
     logger.info("Requesting remote file list from camera...")
+    remote_files_map = {} # map filename to remote file information
     try:
-        # Clear any previous event and response
-        callback_handler.event.clear()
-        with callback_handler.file_list_lock:
-            callback_handler.file_list_response = None
+        if listing_mode == 'fileinfo':
+            start = 0
+            while True:
+                response = _request_listing_page(insta360_client, callback_handler, logger, camera.PHONE_COMMAND_GET_FILEINFO_LIST, start, page_size)
+                if response is None:
+                    logger.warning("GetFileInfoList failed, falling back to GetFileList.")
+                    remote_files_map = {}
+                    listing_mode = 'filelist'
+                    break
+                page = response.get('file_info', [])
+                for info in page:
+                    filename = Path(info['file_path']).name
+                    if filename:
+                        remote_files_map[filename] = {
+                            'uri': info['file_path'],
+                            'size': info.get('file_size') or None,
+                            'creation_time': info.get('creation_time'),
+                        }
+                start += len(page)
+                if len(page) < page_size:
+                    break
 
-        insta360_client.GetCameraFilesList()
-        
-        # Wait for the file list response for up to 30 seconds
-        if not callback_handler.event.wait(timeout=30):
-            logger.error("Timeout waiting for file list from camera.")
-            return False
-        
-        with callback_handler.file_list_lock:
-            file_list_data = callback_handler.file_list_response
-        
-        if not file_list_data or file_list_data.get('response_code') != camera.RESPONSE_CODE_OK:
-            logger.error("Failed to retrieve file list or received error response.")
-            return False
+        if listing_mode != 'fileinfo':
+            start = 0
+            while True:
+                response = _request_listing_page(insta360_client, callback_handler, logger, camera.PHONE_COMMAND_GET_FILE_LIST, start, page_size)
+                if response is None:
+                    return None
+                remote_uris = response.get('uri', [])
+                total_remote_count = response.get('total_count', 0)
+                logger.info(f"Received {len(remote_uris)} URIs from camera (Total count: {total_remote_count}).")
+                # We assume URIs are relative paths like DCIM/Camera01/filename.mp4
+                # Need to extract just the filename for local comparison
+                for uri in remote_uris:
+                    filename = Path(uri).name
+                    if filename: # Ensure it's not empty
+                        remote_files_map[filename] = {'uri': uri, 'size': None, 'creation_time': None}
+                start += len(remote_uris)
+                if not remote_uris or start >= total_remote_count:
+                    break
 
-        remote_uris = file_list_data.get('uri', [])
-        total_remote_count = file_list_data.get('total_count', 0)
-        
-        logger.info(f"Received {len(remote_uris)} URIs from camera (Total count: {total_remote_count}).")
-        
-        # We assume URIs are relative paths like DCIM/Camera01/filename.mp4
-        # Need to extract just the filename for local comparison
-        remote_files_map = {} # map filename to full URI
-        for uri in remote_uris:
-            filename = Path(uri).name
-            if filename: # Ensure it's not empty
-                remote_files_map[filename] = uri
-        
-        logger.info(f"Identified {len(remote_files_map)} unique files from URIs on the camera.")
-        
     except Exception as e:
         logger.error(f"Error during file list request: {e}")
-        return False
+        return None
 
-    logger.info(f"Scanning local directory: {dest_dir} for existing files...")
-    local_files = {f for f in os.listdir(dest_dir) if (dest_dir / f).is_file()}
-    logger.info(f"Found {len(local_files)} files in local directory.")
+    logger.info(f"Identified {len(remote_files_map)} unique files from URIs on the camera.")
+    return remote_files_map
+
+def _get_storage_fingerprint(insta360_client, callback_handler, logger):
+    """
+    Asks the camera for its identity and storage state with one GetOptions request.
+    Returns:
+        tuple: (serial number, fingerprint dict), or (None, None) on failure.
+    """
+    callback_handler.expect(camera.PHONE_COMMAND_GET_OPTIONS)
+    insta360_client.GetCameraInfo()
+    response = callback_handler.wait_for(camera.PHONE_COMMAND_GET_OPTIONS, timeout=10)
+    if response is None or response.get('response_code') != camera.RESPONSE_CODE_OK:
+        logger.warning("Could not get camera info; the listing cache is not used.")
+        return None, None
+    value = response.get('value', {})
+    serial = value.get('serial_number')
+    storage = value.get('storage_state', {})
+    if not serial or not storage:
+        logger.warning("Camera info has no serial number or storage state; the listing cache is not used.")
+        return None, None
+    # 64 bit integers are converted to strings by protobuf_to_dict().
+    fingerprint = {
+        'card_state': storage.get('card_state'),
+        'free_space': int(storage.get('free_space', 0)),
+        'total_space': int(storage.get('total_space', 0)),
+    }
+    return serial, fingerprint
+
+def _sync_files(insta360_client, dest_dir, logger, camera_ip, callback_handler, settings, http_session=None, supervisor=None):
+    """
+    Synchronizes files from Insta360 camera to the local destination directory.
+    """
+    with tracer.span('listing'):
+        listing_cache = None
+        camera_serial = fingerprint = None
+        remote_files_map = None
+        # The serial number identifies the camera in the manifest index, even if the layout does not use it.
+        camera_serial, fingerprint = _get_storage_fingerprint(insta360_client, callback_handler, logger)
+        if settings['listing_cache']:
+            listing_cache = ListingCache(dest_dir, logger)
+            if camera_serial is not None:
+                cached = listing_cache.load(camera_serial, fingerprint)
+                # A complete sync may have run without delete_after_download: the
+                # files it backed up are still on the card and have to be deleted now.
+                if cached is not None and cached['complete'] and not settings['delete_after_download']:
+                    logger.info(f"Camera {camera_serial} storage is unchanged since the last complete sync. Nothing to do.")
+                    return True
+                if cached is not None:
+                    logger.info(f"Camera {camera_serial} storage is unchanged; reusing the cached listing of {len(cached['files'])} files.")
+                    remote_files_map = cached['files']
+
+        if remote_files_map is None:
+            remote_files_map = _list_remote_files(insta360_client, callback_handler, logger, settings['listing_mode'])
+        if remote_files_map is None:
+            return False
+
+    manifest = Manifest(dest_dir, logger)
+    layout = settings['layout']
+    with tracer.span('local_scan') as span:
+        # The manifest indexes downloads by camera and URI: each camera file
+        # costs one lookup and one stat(), however large the library is.
+        logger.info(f"Looking up {len(remote_files_map)} camera files in {dest_dir}...")
+        local_keys = {} # map filename to manifest key (path relative to dest_dir)
+        assigned = set()
+        present = []
+        files_to_download = {}
+        for filename, remote_file in remote_files_map.items():
+            key = manifest.find(camera_serial, remote_file['uri'])
+            if (key is None and filename not in assigned and manifest.get(filename) is None
+                    and (dest_dir / filename).is_file()):
+                # Downloaded by a version without manifest or layout. A file the
+                # manifest records belongs to another camera or card, not to this one.
+                key = filename
+            if key is None:
+                key = layout.resolve(filename, remote_file, camera_serial, manifest, taken=assigned)
+            local_keys[filename] = key
+            assigned.add(key)
+            try:
+                local_size = os.stat(dest_dir / key).st_size
+            except OSError:
+                files_to_download[filename] = remote_file
+                continue
+            if remote_file['size'] is not None and local_size != remote_file['size']:
+                logger.warning(f"Local {key} has {local_size} bytes, camera has {remote_file['size']}: downloading again.")
+                files_to_download[filename] = remote_file
+            else:
+                present.append(filename)
+        logger.info(f"Found {len(present)} of them locally.")
+        span.set('files', len(present))
+
+    deleter = None
+    if settings['delete_after_download']:
+        deleter = VerifiedDeleter(insta360_client, callback_handler, manifest, dest_dir, logger,
+                                  batch_size=settings['delete_batch_size'], readback_hash=settings['delete_readback_hash'])
+        # Files downloaded by a previous run whose deletion failed or was not attempted.
+        for filename in present:
+            if manifest.get(local_keys[filename]) is not None:
+                deleter.add(local_keys[filename])
 
-    files_to_download = {}
-    for filename, remote_uri in remote_files_map.items():
-        if filename not in local_files:
-            files_to_download[filename] = remote_uri
-    
     if not files_to_download:
         logger.info("No new files to download. Local directory is up to date.")
+        _finish_deletion(deleter, logger)
+        _save_listing(insta360_client, callback_handler, logger, listing_cache, camera_serial,
+                      fingerprint, remote_files_map, deleter, failed_count=0)
         return True
 
     logger.info(f"Found {len(files_to_download)} new files to download.")
-    
-    # Calculate total size for progress bar if possible, otherwise use unknown size
-    # This might require making HEAD requests, which adds overhead.
-    # For now, we'll just show progress per file.
-    
+
+    if settings['probe_on_connect']:
+        # Measure the link before the first download and size the transfer for it.
+        sample = max(files_to_download.values(), key=lambda f: f['size'] or 0)
+        settings = _apply_probe(_run_probe(insta360_client, callback_handler, dest_dir, logger, camera_ip, camera_serial, sample['uri'], http_session),
+                                settings, logger)
+
+    # The files of one capture (lens pair and proxy, photo set) are scheduled
+    # next to each other, so that they download concurrently, and committed
+    # together once all of them are verified. Oldest captures first, so that
+    # deletion can free camera storage early.
+    units = group_capture_units(files_to_download, settings['capture_units'])
+    grouped = sum(1 for unit in units if len(unit) > 1)
+    if grouped:
+        logger.info(f"{len(files_to_download)} files form {len(units)} capture units, {grouped} of them with several files.")
+
+    # With a staging directory, downloads are committed there and a mover
+    # migrates them to dest_dir in the background; the manifest and the
+    # camera deletions follow the mover.
+    landing_dir = dest_dir
+    if settings['staging_dir'] is not None:
+        landing_dir = settings['staging_dir']
+        landing_dir.mkdir(parents=True, exist_ok=True)
+
     download_count = 0
-    for file_name, remote_uri in tqdm(files_to_download.items(), desc="Downloading files"):
+    failed_count = 0
+    if settings['space_policy'] != 'off':
+        def part_bytes(filename):
+            part_path = landing_dir / (local_keys[filename] + PART_SUFFIX)
+            try:
+                return part_path.stat().st_size
+            except OSError:
+                return 0
+        with tracer.span('space_planning'):
+            plan = plan_space(units, landing_dir, dest_dir, part_bytes, policy=settings['space_policy'],
+                              min_free_bytes=settings['min_free_bytes'])
+        for directory, needed in plan.needed.items():
+            logger.info(f"Free space in {directory}: {max(0, plan.free[directory]) / 1e6:.1f} MB usable, "
+                        f"{needed / 1e6:.1f} MB needed.")
+        if plan.unknown_size:
+            logger.warning(f"{plan.unknown_size} files have no size in the listing and are not covered by the space check.")
+        if plan.left_out:
+            left_out = {name: f for unit in plan.left_out for name, f in unit.files.items()}
+            action = 'deferred to a later sync' if settings['space_policy'] == 'defer' else 'skipped'
+            logger.error(f"Not enough free space: {len(left_out)} files "
+                         f"({sum(f['size'] or 0 for f in left_out.values()) / 1e6:.1f} MB) {action}.")
+            # Not counted as downloaded: the listing is not cached as complete.
+            failed_count += len(left_out)
+            units = plan.scheduled
+            files_to_download = {name: f for name, f in files_to_download.items() if name not in left_out}
+            if not units:
+                _finish_deletion(deleter, logger)
+                _save_listing(insta360_client, callback_handler, logger, listing_cache, camera_serial,
+                              fingerprint, remote_files_map, deleter, failed_count)
+                return True
+
+    # With sizes from the listing, progress is shown in bytes for the whole sync.
+    sizes = [f['size'] for f in files_to_download.values()]
+    total_bytes = sum(sizes) if None not in sizes else None
+    if total_bytes is not None:
+        logger.info(f"Total download size: {total_bytes / 1e6:.1f} MB.")
+
+    workers = max(1, settings['download_workers'])
+    # Disk writes run on their own thread so a slow destination disk does not
+    # stall reading from the camera socket. Each download worker has its own
+    # write-behind stage; together they stay within the memory cap.
+    writers = queue.Queue()
+    for _ in range(workers):
+        writers.put(WriteBehindWriter(logger, buffer_size=settings['buffer_size'],
+                                      max_buffered_bytes=settings['write_behind_bytes'] // workers,
+                                      preallocate=settings['preallocate']))
+    progress = ProgressTracker(logger, total_bytes, len(files_to_download), mode=settings['progress'],
+                               interval=settings['progress_interval_sec'], label=camera_serial).start()
+    # Verified files are renamed into place and recorded in the manifest in
+    # group commits, synced according to the durability mode.
+    committer = GroupCommitter(manifest, logger, mode=settings['durability'],
+                               batch_files=settings['durability_batch_files'], batch_sec=settings['durability_batch_sec'])
+    mover = None
+    if landing_dir != dest_dir:
+        mover = StagingMover(landing_dir, dest_dir, committer, logger,
+                             workers=settings['mover_workers'], io_priority=settings['mover_io_priority'])
+        logger.info(f"Downloading to staging directory {landing_dir}.")
+
+    def record_committed():
+        """Counts the files committed so far and queues them for deletion from the camera."""
+        nonlocal download_count
+        for key, entry in committer.completed():
+            logger.info(f"Successfully downloaded {key} ({entry['size']} bytes, {entry['hash_algorithm']} {entry['hash']}).")
+            download_count += 1
+            if deleter is not None:
+                # Deleted in batches, as soon as a batch is full, to free camera storage early.
+                deleter.add(key)
+
+    def download_one(file_name, remote_file, parent_span):
+        """Runs in a worker thread: downloads one file with a free writer."""
         # Construct full download URL (assuming standard camera web server structure)
-        download_url = f"http://{camera_ip}/{remote_uri}"
-        local_file_path = dest_dir / file_name
-        
+        download_url = f"http://{camera_ip}/{remote_file['uri']}"
+        local_path = landing_dir / local_keys[file_name]
         logger.info(f"Downloading {file_name} from {download_url}...")
-        try:
-            with requests.get(download_url, stream=True, timeout=10) as r:
-                r.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-                total_size = int(r.headers.get('content-length', 0))
-                
-                with open(local_file_path, 'wb') as f:
-                    with tqdm(total=total_size, unit='B', unit_scale=True, desc=file_name, leave=False) as pbar:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                            pbar.update(len(chunk))
-                logger.info(f"Successfully downloaded {file_name}.")
-                download_count += 1
-
-            if delete_after_download:
-                # TODO: Implement robust verification before deletion.
-                # E.g., hash check, file size check.
-                logger.warning(f"Deletion is enabled but not fully implemented with verification. Skipping deletion for {file_name}.")
-                # try:
-                #     insta360_client.DeleteCameraFile(remote_uri) # Assuming such a method exists/will be implemented
-                #     logger.info(f"Deleted {file_name} from camera.")
-                # except Exception as del_e:
-                #     logger.error(f"Failed to delete {file_name} from camera: {del_e}")
-
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to download {file_name} (HTTP request error): {e}")
-        except Exception as e:
-            logger.error(f"Failed to download {file_name} (General error): {e}")
-            
+        with tracer.span('file', parent=parent_span, file=file_name) as span:
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            if mover is not None and local_path.is_file():
+                # Staged by an earlier run but not moved: verify it again as a complete ".part".
+                os.replace(local_path, local_path.with_name(local_path.name + PART_SUFFIX))
+            with tracer.span('writer_wait'):
+                writer = writers.get()
+            try:
+                attempt = 0
+                while True:
+                    generation = supervisor.generation if supervisor is not None else None
+                    span.set('attempts', attempt + 1)
+                    try:
+                        # Retries after a link drop, and files of a capture unit which failed
+                        # in an earlier run, continue the ".part" file where it stopped.
+                        return _download_file(download_url, local_path, writer, settings['hash_algorithm'],
+                                              expected_size=remote_file['size'], on_progress=progress.add,
+                                              http_session=http_session, resume=True, commit=False)
+                    except Exception as e:
+                        if (supervisor is None or not supervisor.is_link_error(e)
+                                or not supervisor.recover(generation, f"{file_name}: {e}")):
+                            raise
+                        attempt += 1
+            finally:
+                writers.put(writer)
+
+    if workers > 1:
+        logger.info(f"Downloading with {workers} parallel workers.")
+    remaining = {unit.key: len(unit) for unit in units}
+    results = {unit.key: {} for unit in units}
+    with tracer.span('download', files=len(files_to_download), units=len(units), workers=workers) as download_span, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download') as pool:
+        futures = {}
+        for unit in units:
+            for name, remote_file in sorted(unit.files.items()):
+                futures[pool.submit(download_one, name, remote_file, download_span)] = (unit, name)
+        for future in as_completed(futures):
+            unit, file_name = futures[future]
+            committer.flush_if_due()
+            record_committed()
+            entry = None
+            try:
+                entry = future.result()
+                progress.file_done()
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Failed to download {file_name} (HTTP request error): {e}")
+            except VerificationError as e:
+                logger.error(f"Failed to download {file_name} (verification failed): {e}")
+            except Exception as e:
+                logger.error(f"Failed to download {file_name} (General error): {e}")
+            if entry is None:
+                progress.file_done(ok=False)
+            results[unit.key][file_name] = entry
+            remaining[unit.key] -= 1
+            if remaining[unit.key]:
+                continue
+
+            entries = results.pop(unit.key)
+            failed = sorted(name for name, entry in entries.items() if entry is None)
+            if failed:
+                failed_count += len(unit)
+                if len(unit) > 1:
+                    logger.error(f"Capture unit {', '.join(sorted(unit.files))} not committed: {', '.join(failed)} failed. "
+                                 f"The downloaded files are kept as {PART_SUFFIX} and reused by the next sync.")
+                continue
+            with tracer.span('commit', files=len(unit)):
+                items = []
+                for file_name, entry in sorted(entries.items()):
+                    key = local_keys[file_name]
+                    fields = dict(uri=unit.files[file_name]['uri'], camera_serial=camera_serial, **entry)
+                    if mover is None:
+                        items.append(CommitItem(key, dest_dir / (key + PART_SUFFIX), dest_dir / key, fields))
+                        continue
+                    # Committed in staging without a manifest entry; the mover commits it at the destination.
+                    try:
+                        _commit_download(landing_dir / key)
+                    except OSError as e:
+                        logger.error(f"Failed to commit {key}: {e}")
+                        failed_count += 1
+                        continue
+                    mover.submit(key, **fields)
+                committer.commit(items)
+
+    progress.close()
+    if mover is not None:
+        mover.close()
+        failed_count += mover.failed_count
+    with tracer.span('durable_commit'):
+        committer.close()
+    record_committed()
+    failed_count += committer.failed_count
+    while not writers.empty():
+        writer = writers.get()
+        writer.shutdown()
+        stats = writer.stats()
+        logger.info(f"Write-behind stats: max queue depth {stats['max_queue_depth']}/{stats['buffers']}, "
+                    f"avg queue depth {stats['avg_queue_depth']:.1f}, "
+                    f"reader stalled {stats['reader_stall_sec']:.2f}s waiting for disk, "
+                    f"disk write time {stats['write_sec']:.2f}s, "
+                    f"stream hashing {stats['hash_sec']:.2f}s.")
+    with tracer.span('cleanup'):
+        _finish_deletion(deleter, logger)
+        _save_listing(insta360_client, callback_handler, logger, listing_cache, camera_serial,
+                      fingerprint, remote_files_map, deleter, failed_count)
+        manifest.compact()
     logger.info(f"Synchronization complete. Downloaded {download_count} new files.")
     return True
 
-def main():
-    """Main function to run the sync process."""
-    
-    # --- 1. Initialization ---
-    config = configparser.ConfigParser()
-    # Use an absolute path for config.ini to run from any directory
-    config_path = Path(__file__).parent / 'config.ini'
-    config.read(config_path)
-    
-    # Setup logging
-    log_file = config.get('Logging', 'log_file', fallback='insta360_sync.log')
-    log_level = config.get('Logging', 'log_level', fallback='INFO')
-    logger = setup_logging(log_file, log_level)
-    
-    logger.info("--- Starting Insta360 Sync ---")
-    
-    # Check destination directory
-    dest_dir = Path(config.get('Storage', 'destination_dir'))
+def _run_probe(insta360_client, callback_handler, dest_dir, logger, camera_ip, camera_serial, sample_uri, http_session=None):
+    """Runs the link probe and records its results in the probe history."""
+    link_probe = LinkProbe(insta360_client, callback_handler, camera_ip, logger)
+    results = link_probe.run(sample_uri=sample_uri, http_session=http_session)
+    results['camera_serial'] = camera_serial
+    link_probe.record(results, dest_dir)
+    return results
+
+def _apply_probe(results, settings, logger):
+    """Returns a copy of settings with download concurrency and buffer size recommended by the probe."""
+    recommended = results.get('recommended')
+    if not recommended:
+        return settings
+    logger.info(f"Using probe recommendation: {recommended['download_workers']} download workers, "
+                f"{recommended['chunk_size_mb']} MB buffers.")
+    return dict(settings,
+                download_workers=recommended['download_workers'],
+                buffer_size=clamp_buffer_size(recommended['chunk_size_mb'] * 1024 * 1024))
+
+def _probe_command(insta360_client, callback_handler, dest_dir, logger, camera_ip, settings, http_session=None):
+    """The "probe" command: measures the link and prints the results."""
+    camera_serial, _ = _get_storage_fingerprint(insta360_client, callback_handler, logger)
+    remote_files_map = _list_remote_files(insta360_client, callback_handler, logger, settings['listing_mode'])
+    sample_uri = None
+    if remote_files_map:
+        sample_uri = max(remote_files_map.values(), key=lambda f: f['size'] or 0)['uri']
+    else:
+        logger.warning("No files on the camera: HTTP goodput cannot be measured.")
+    results = _run_probe(insta360_client, callback_handler, dest_dir, logger, camera_ip, camera_serial, sample_uri, http_session)
+    print(json.dumps(results, indent=2))
+
+def _finish_deletion(deleter, logger):
+    """Sends the last deletion batch, confirms all batches and logs the deletion totals."""
+    if deleter is None:
+        return
+    deleter.flush()
+    deleter.confirm()
+    logger.info(f"Deleted {deleter.deleted_count} files from camera, {deleter.failed_count} deletions failed.")
+
+def _save_listing(insta360_client, callback_handler, logger, listing_cache, camera_serial, fingerprint, remote_files_map, deleter, failed_count):
+    """Stores the listing with the storage fingerprint it belongs to."""
+    if listing_cache is None or camera_serial is None:
+        return
+    files = remote_files_map
+    if deleter is not None and deleter.deleted_uris:
+        # Deleting files changed the free space: drop them and ask the camera
+        # for the new fingerprint.
+        files = {name: f for name, f in remote_files_map.items() if f['uri'] not in deleter.deleted_uris}
+        camera_serial, fingerprint = _get_storage_fingerprint(insta360_client, callback_handler, logger)
+        if camera_serial is None:
+            return
+    complete = failed_count == 0 and (deleter is None or deleter.failed_count == 0)
     try:
-        dest_dir.mkdir(parents=True, exist_ok=True)
-        logger.info(f"Backup destination: {dest_dir}")
+        listing_cache.save(camera_serial, fingerprint, files, complete)
     except OSError as e:
-        logger.error(f"Error creating destination directory {dest_dir}: {e}")
-        sys.exit(1)
+        logger.warning(f"Could not save the listing cache: {e}")
 
+def _load_sync_settings(config, logger):
+    """Reads the [Sync] section into a dictionary of download settings."""
+    hash_algorithm = config.get('Sync', 'hash_algorithm', fallback=DEFAULT_HASH_ALGORITHM).strip().lower()
+    if not is_hash_available(hash_algorithm):
+        logger.warning(f"Hash algorithm '{hash_algorithm}' is not available, using {DEFAULT_HASH_ALGORITHM}.")
+        hash_algorithm = DEFAULT_HASH_ALGORITHM
+    progress = config.get('Sync', 'progress', fallback='auto').strip().lower()
+    try:
+        layout = Layout(config.get('Storage', 'layout', fallback=DEFAULT_TEMPLATE))
+    except LayoutError as e:
+        logger.error(f"{e}; files go directly into the destination directory.")
+        layout = Layout(DEFAULT_TEMPLATE)
+    staging_dir = config.get('Storage', 'staging_dir', fallback='').strip()
+    mover_io_priority = config.get('Storage', 'mover_io_priority', fallback='idle').strip().lower()
+    space_policy = config.get('Storage', 'space_policy', fallback='defer').strip().lower()
+    durability = config.get('Storage', 'durability', fallback='batch').strip().lower()
+    return {
+        'delete_after_download': config.getboolean('Sync', 'delete_after_download', fallback=False),
+        'write_behind_bytes': config.getint('Sync', 'write_behind_mb', fallback=64) * 1024 * 1024,
+        'buffer_size': clamp_buffer_size(config.getint('Sync', 'chunk_size_mb', fallback=4) * 1024 * 1024),
+        'hash_algorithm': hash_algorithm,
+        'download_workers': config.getint('Sync', 'download_workers', fallback=1),
+        'capture_units': config.getboolean('Sync', 'capture_units', fallback=True),
+        'layout': layout,
+        'staging_dir': Path(staging_dir) if staging_dir else None,
+        'mover_workers': config.getint('Storage', 'mover_workers', fallback=DEFAULT_MOVER_WORKERS),
+        'mover_io_priority': mover_io_priority if mover_io_priority in IO_PRIORITIES else 'idle',
+        'space_policy': space_policy if space_policy in SPACE_POLICIES else 'defer',
+        'min_free_bytes': config.getint('Storage', 'min_free_mb', fallback=DEFAULT_MIN_FREE_MB) * 1024 * 1024,
+        'preallocate': config.getboolean('Storage', 'preallocate', fallback=True),
+        'durability': durability if durability in DURABILITY_MODES else 'batch',
+        'durability_batch_files': config.getint('Storage', 'durability_batch_files', fallback=DEFAULT_BATCH_FILES),
+        'durability_batch_sec': config.getfloat('Storage', 'durability_batch_sec', fallback=DEFAULT_BATCH_SEC),
+        'progress': progress if progress in PROGRESS_MODES else 'auto',
+        'progress_interval_sec': config.getfloat('Sync', 'progress_interval_sec', fallback=DEFAULT_INTERVAL_SEC),
+        'probe_on_connect': config.getboolean('Sync', 'probe_on_connect', fallback=False),
+        'download_session': config.getboolean('Sync', 'download_session', fallback=True),
+        'ready_timeout_sec': config.getfloat('Camera', 'ready_timeout_sec', fallback=30.0),
+        'packet_trace_file': config.get('Logging', 'packet_trace_file', fallback='').strip(),
+        'packet_trace_max_bytes': config.getint('Logging', 'packet_trace_max_mb', fallback=64) * 1024 * 1024,
+        'packet_trace_backups': config.getint('Logging', 'packet_trace_backups', fallback=3),
+        'response_timeout_sec': config.getfloat('Metrics', 'response_timeout_sec', fallback=DEFAULT_RESPONSE_TIMEOUT_SEC),
+        'listing_cache': config.getboolean('Sync', 'listing_cache', fallback=True),
+        'listing_mode': config.get('Sync', 'listing_mode', fallback='fileinfo').strip().lower(),
+        'delete_batch_size': config.getint('Sync', 'delete_batch_size', fallback=50),
+        'delete_readback_hash': config.getboolean('Sync', 'delete_readback_hash', fallback=False),
+    }
+
+def _run_camera(command, camera_ip, dest_dir, logger, sync_settings, wifi_manager=None, ssid_prefixes=None,
+                dhcp_command=None, camera_label=None, bind_interface=None, source_address=None, metrics_registry=None):
+    """
+    Connects to one camera and runs command ("sync" or "probe") on it.
+    Args:
+        command (str): The command to run.
+        camera_ip (str): The camera IP address.
+        dest_dir (Path): The backup destination directory.
+        logger: The logging object for logging messages.
+        sync_settings (dict): Settings from _load_sync_settings().
+        wifi_manager (WifiManager): Joins the camera Wi-Fi first, if given.
+        ssid_prefixes (list): SSID prefixes of the camera networks.
+        dhcp_command (str): Optional command run after joining the Wi-Fi to get an address.
+        camera_label (str): When set (fleet mode), files go to a subdirectory named after the
+            camera serial number, or after camera_label if the serial number is unknown.
+        bind_interface (str): Optional network interface the camera traffic is pinned to.
+        source_address (str): Optional local IP address the camera traffic is sent from.
+        metrics_registry (MetricsRegistry): Exposes the protocol metrics of the camera, if given.
+    Returns:
+        bool: True on success.
+    """
     insta360_client = None # Initialize client as None
-    delete_after_download = config.getboolean('Sync', 'delete_after_download', fallback=False)
     insta360_callback_handler = None # Initialize callback handler
+    trace = None
 
     try:
         # --- 2. Connection Phase ---
-        logger.info("Starting Wi-Fi connection phase...")
-        wifi_manager = WifiManager(logger)
-        
-        ssid_prefixes = [p.strip() for p in config.get('Camera', 'ssid_prefix').split(',')]
-        camera_ip = config.get('Camera', 'camera_ip')
+        if wifi_manager is not None:
+            with tracer.span('wifi_connect'):
+                logger.info("Starting Wi-Fi connection phase...")
+                connection_successful = wifi_manager.find_and_connect(ssid_prefixes)
 
-        connection_successful = wifi_manager.find_and_connect(ssid_prefixes)
-        
-        if not connection_successful:
-            logger.error("Could not connect to camera Wi-Fi. Aborting.")
-            sys.exit(1)
+                if not connection_successful:
+                    logger.error("Could not connect to camera Wi-Fi. Aborting.")
+                    return False
+                if dhcp_command and not run_dhcp(dhcp_command, logger):
+                    return False
             
         logger.info("Attempting to connect to Insta360 camera API...")
         insta360_callback_handler = Insta360CallbackHandler(logger)
-        insta360_client = camera(camera_ip, logger, callback=insta360_callback_handler) # Pass callback handler
+        trace_file = sync_settings['packet_trace_file']
+        if trace_file:
+            # One trace per camera in fleet mode.
+            trace = PacketTrace(f"{trace_file}.{camera_label}" if camera_label else trace_file,
+                                max_bytes=sync_settings['packet_trace_max_bytes'],
+                                backup_count=sync_settings['packet_trace_backups'])
+            logger.info(f"Recording protocol packets to {trace.path}.")
+        insta360_client = camera(camera_ip, logger=logger, callback=insta360_callback_handler, # Pass callback handler
+                                 bind_interface=bind_interface, source_address=source_address,
+                                 packet_trace=trace,
+                                 metrics=CameraMetrics(sync_settings['response_timeout_sec'], camera.message_code_names()))
+        if metrics_registry is not None:
+            metrics_registry.add(camera_label or 'camera', insta360_client.metrics)
+        http_session = make_http_session(bind_interface, source_address,
+                                         pool_size=max(4, sync_settings['download_workers']))
+        if bind_interface or source_address:
+            logger.info(f"Camera traffic bound to {bind_interface or source_address}.")
         
         api_connected = False
-        for i in range(5): # Retry API connection a few times
-            try:
+        with tracer.span('api_connect'):
+            for i in range(API_CONNECT_ATTEMPTS):
+                # Wait until the camera answers on its API and web ports, then open the
+                # API session. Open() logs and swallows connection errors.
+                if wait_until_ready(camera_ip, logger, timeout=sync_settings['ready_timeout_sec'],
+                                    bind_interface=bind_interface, source_address=source_address) is None:
+                    continue
                 insta360_client.Open()
-                api_connected = True
-                logger.info("Successfully connected to Insta360 API.")
-                break
-            except Exception as e:
-                logger.warning(f"Attempt {i+1}: Failed to connect to Insta360 API: {e}")
-                time.sleep(2) # Wait before retrying
+                if insta360_client.camera_socket is not None:
+                    api_connected = True
+                    logger.info("Successfully connected to Insta360 API.")
+                    break
+                logger.warning(f"Attempt {i+1}: Failed to connect to Insta360 API.")
         
         if not api_connected:
             logger.error("Failed to connect to Insta360 API after multiple attempts. Aborting.")
-            sys.exit(1)
+            return False
+
+        if camera_label is not None:
+            camera_serial, _ = _get_storage_fingerprint(insta360_client, insta360_callback_handler, logger)
+            dest_dir = dest_dir / (camera_serial or camera_label)
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            if sync_settings['staging_dir'] is not None:
+                sync_settings = dict(sync_settings, staging_dir=sync_settings['staging_dir'] / (camera_serial or camera_label))
+            logger.info(f"Camera backup destination: {dest_dir}")
         
+        if command == 'probe':
+            _probe_command(insta360_client, insta360_callback_handler, dest_dir, logger, camera_ip, sync_settings, http_session)
+            return True
+
         # --- 3. Synchronization Phase ---
         logger.info("Starting synchronization phase...")
+        # Re-associates and reopens the session if the link drops during downloads.
+        supervisor = SessionSupervisor(insta360_client, camera_ip, logger, wifi_manager, ssid_prefixes, dhcp_command,
+                                       ready_timeout_sec=sync_settings['ready_timeout_sec'],
+                                       bind_interface=bind_interface, source_address=source_address)
         # Call the new _sync_files function
-        _sync_files(insta360_client, dest_dir, logger, camera_ip, insta360_callback_handler, delete_after_download)
+        if sync_settings['download_session']:
+            with insta360_client.DownloadSession():
+                _sync_files(insta360_client, dest_dir, logger, camera_ip, insta360_callback_handler, sync_settings,
+                            http_session, supervisor)
+        else:
+            _sync_files(insta360_client, dest_dir, logger, camera_ip, insta360_callback_handler, sync_settings,
+                        http_session, supervisor)
+        return True
         
     finally:
         # --- 4. Cleanup Phase ---
         logger.info("Starting cleanup phase...")
         if insta360_client:
             try:
-                insta360_client.Close()
+                with tracer.span('disconnect'):
+                    insta360_client.Close()
                 logger.info("Insta360 API disconnected.")
             except Exception as e:
                 logger.error(f"Error disconnecting Insta360 API: {e}")
+            _log_metrics(insta360_client.metrics.snapshot(), logger)
         
-        wifi_manager.disconnect()
-        
-        logger.info("--- Insta360 Sync finished ---")
+        if trace is not None:
+            trace.close()
+
+        if wifi_manager is not None:
+            wifi_manager.disconnect()
+
+def _log_metrics(stats, logger):
+    """Logs a summary of a CameraMetrics.snapshot()."""
+    logger.info(f"Protocol: {stats['packets_sent']} packets / {stats['bytes_sent']} bytes sent, "
+                f"{stats['packets_received']} packets / {stats['bytes_received']} bytes received, "
+                f"{stats['reconnects']} reconnects, {stats['link_timeouts']} link timeouts.")
+    gap = stats['receive_gap']
+    if gap['count']:
+        logger.info(f"Receive gaps: p50 {gap['p50'] * 1000:.0f} ms, p99 {gap['p99'] * 1000:.0f} ms, max {gap['max'] * 1000:.0f} ms.")
+    for code, message in stats['messages'].items():
+        latency = message['latency']
+        timing = (f", latency p50 {latency['p50'] * 1000:.1f} ms, p99 {latency['p99'] * 1000:.1f} ms, "
+                  f"max {latency['max'] * 1000:.1f} ms") if latency['count'] else ''
+        logger.info(f"Message {message['name']} ({code}): {message['sent']} sent, {message['responses']} answered, "
+                    f"{message['errors']} errors, {message['timeouts']} timeouts{timing}.")
+
+def _fleet_command(config, camera_ip, ssid_prefixes, dest_dir, logger, sync_settings, use_wifi=True,
+                   metrics_registry=None):
+    """
+    The "fleet" command: syncs one camera per Wi-Fi interface, all in parallel.
+
+    Every camera hotspot has the same address, so by default each interface
+    lives in its own network namespace, named namespace_prefix + interface.
+    One thread per camera enters the namespace and runs the whole sync there:
+    Wi-Fi, protocol client and downloads. With isolation = bind_interface,
+    the interfaces stay in the host namespace and the camera sockets are
+    pinned to them with SO_BINDTODEVICE instead. Each camera gets its own
+    destination subdirectory.
+    Returns:
+        bool: True if every camera synced successfully.
+    """
+    interfaces = [i.strip() for i in config.get('Fleet', 'interfaces', fallback='').split(',') if i.strip()]
+    if not interfaces:
+        logger.error("Fleet mode needs the [Fleet] interfaces setting.")
+        return False
+    isolation = config.get('Fleet', 'isolation', fallback='namespace').strip().lower()
+    if isolation not in ('namespace', 'bind_interface'):
+        logger.error(f"Unknown [Fleet] isolation '{isolation}', expected namespace or bind_interface.")
+        return False
+    namespace_prefix = config.get('Fleet', 'namespace_prefix', fallback='insta360-')
+    setup_namespaces = config.getboolean('Fleet', 'setup_namespaces', fallback=True)
+    dhcp_command = config.get('Fleet', 'dhcp_command', fallback='').strip()
+    results = {}
+    fleet_span = tracer.current()
+
+    def run(interface):
+        with tracer.span('camera', parent=fleet_span, interface=interface):
+            _run(interface)
+
+    def _run(interface):
+        namespace = namespace_prefix + interface
+        camera_logger = logger.getChild(interface)
+        results[interface] = False
+
+        def sync(bind_interface=None):
+            wifi_manager = None
+            if use_wifi:
+                wifi_manager = WifiManager(camera_logger, interface=interface,
+                                           cache_path=dest_dir / f'.insta360_wifi_profiles_{interface}.json')
+            return _run_camera('sync', camera_ip, dest_dir, camera_logger, sync_settings,
+                               wifi_manager, ssid_prefixes,
+                               dhcp_command.format(interface=interface) if use_wifi and dhcp_command else None,
+                               camera_label=interface, bind_interface=bind_interface,
+                               metrics_registry=metrics_registry)
+
+        try:
+            if isolation == 'bind_interface':
+                results[interface] = sync(bind_interface=interface)
+                return
+            if use_wifi and setup_namespaces:
+                netns.setup_wifi_namespace(namespace, interface, camera_logger)
+            with netns.enter_namespace(namespace):
+                results[interface] = sync()
+        except netns.NamespaceError as e:
+            camera_logger.error(f"Cannot use network namespace {namespace}: {e}")
+        except Exception as e:
+            camera_logger.error(f"Camera sync on {interface} failed: {e}")
+
+    logger.info(f"Fleet mode: syncing {len(interfaces)} cameras in parallel on {', '.join(interfaces)}.")
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=run, args=(interface,), name=f'fleet-{interface}', daemon=True)
+               for interface in interfaces]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    failed = [i for i in interfaces if not results.get(i)]
+    logger.info(f"Fleet sync finished in {time.monotonic() - t0:.1f}s: "
+                f"{len(interfaces) - len(failed)} cameras synced, {len(failed)} failed{' (' + ', '.join(failed) + ')' if failed else ''}.")
+    return not failed
+
+def _scrub_command(config, dest_dir, logger, restart=False):
+    """
+    The "scrub" command: verifies the local library against its manifests and prints the problems found.
+
+    Fleet mode keeps one manifest per camera subdirectory; all of them are scrubbed.
+    Returns:
+        bool: True if no damaged or missing file was found.
+    """
+    directories = [d for d in [dest_dir, *sorted(p for p in dest_dir.iterdir() if p.is_dir())]
+                   if (d / Manifest.FILE_NAME).is_file()]
+    if not directories:
+        logger.warning(f"No manifest found in {dest_dir}: nothing to scrub.")
+        return True
+    results = {}
+    for directory in directories:
+        scrubber = Scrubber(directory, logger,
+                            processes=config.getint('Scrub', 'processes', fallback=0),
+                            read_size=config.getint('Scrub', 'read_size_mb', fallback=8) * 1024 * 1024,
+                            max_read_bps=config.getfloat('Scrub', 'max_read_mb_per_sec', fallback=0) * 1e6,
+                            checkpoint_interval_sec=config.getfloat('Scrub', 'checkpoint_interval_sec',
+                                                                    fallback=DEFAULT_CHECKPOINT_INTERVAL_SEC))
+        with tracer.span('scrub', directory=str(directory)):
+            state = scrubber.run(restart=restart)
+        requeued, lost = [], []
+        if state['problems'] and config.getboolean('Scrub', 'requeue', fallback=True):
+            requeued, lost = scrubber.requeue(state['problems'])
+            if requeued:
+                logger.info(f"{len(requeued)} damaged or missing files will be downloaded again by the next sync.")
+            if lost:
+                logger.error(f"{len(lost)} damaged or missing files are no longer on the camera: {', '.join(lost)}")
+        results[str(directory)] = {
+            'files': len(state['verified']),
+            'bytes_read': state['bytes'],
+            'unverified': state['unverified'],
+            'problems': {key: {'status': status, 'detail': detail} for key, (status, detail) in state['problems'].items()},
+            'requeued': requeued,
+            'lost': lost,
+        }
+    print(json.dumps(results, indent=2))
+    return not any(r['problems'] for r in results.values())
+
+def _finish_tracing(config, logger):
+    """Logs the span summary table and exports the spans if [Logging] span_file is set."""
+    logger.info("Time spent per span:\n" + tracer.format_summary())
+    span_file = config.get('Logging', 'span_file', fallback='').strip()
+    if span_file:
+        try:
+            tracer.export(span_file)
+            logger.info(f"Spans exported to {span_file}.")
+        except OSError as e:
+            logger.error(f"Cannot export spans to {span_file}: {e}")
+
+def _parse_args(argv=None):
+    """Parses the command line. Without a command, "sync" is run."""
+    parser = argparse.ArgumentParser(description="Back up files from Insta360 cameras over Wi-Fi.")
+    parser.add_argument('--config', type=Path, default=Path(__file__).parent / 'config.ini',
+                        help="Configuration file (default: config.ini next to main.py).")
+    parser.add_argument('--profile', nargs='?', const='sampling', choices=PROFILE_MODES,
+                        help="Profile the run (default: sampling) and write the profile next to the log file.")
+    parser.add_argument('--profile-thread', metavar='PREFIX',
+                        help="Only profile threads whose name starts with PREFIX, e.g. insta360-receive.")
+    parser.add_argument('--profile-interval', type=float, default=DEFAULT_SAMPLE_INTERVAL_SEC * 1000, metavar='MS',
+                        help="Sampling interval in milliseconds (default: %(default)s).")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('sync', help="Download new files from the camera (default).")
+    subparsers.add_parser('probe', help="Measure Wi-Fi goodput and SD card speed of the camera and record them.")
+    fleet_parser = subparsers.add_parser('fleet', help="Sync one camera per [Fleet] interface in parallel (Linux, root).")
+    fleet_parser.add_argument('--no-wifi', action='store_true',
+                              help="The interfaces are already connected (e.g. veth pairs to camera simulators).")
+    scrub_parser = subparsers.add_parser('scrub', help="Verify the local backups against the sizes and hashes in the manifest.")
+    scrub_parser.add_argument('--restart', action='store_true',
+                              help="Start over instead of continuing an interrupted scrub.")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args.command = 'sync'
+    return args
+
+def main():
+    """Main function to run the sync process."""
+    args = _parse_args()
+    
+    # --- 1. Initialization ---
+    config = configparser.ConfigParser()
+    # --config defaults to the absolute path of config.ini, to run from any directory
+    config.read(args.config)
+    
+    # Setup logging
+    log_file = config.get('Logging', 'log_file', fallback='insta360_sync.log')
+    log_level = config.get('Logging', 'log_level', fallback='INFO')
+    logger = setup_logging(log_file, log_level,
+                           packet_log=config.get('Logging', 'packet_log', fallback='rate_limited').strip().lower(),
+                           packet_log_rate=config.getint('Logging', 'packet_log_rate', fallback=DEFAULT_PACKET_LOG_RATE))
+    
+    logger.info("--- Starting Insta360 Sync ---")
+    
+    # Check destination directory
+    dest_dir = Path(config.get('Storage', 'destination_dir'))
+    try:
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Backup destination: {dest_dir}")
+    except OSError as e:
+        logger.error(f"Error creating destination directory {dest_dir}: {e}")
+        sys.exit(1)
+
+    sync_settings = _load_sync_settings(config, logger)
+    ssid_prefixes = [p.strip() for p in config.get('Camera', 'ssid_prefix').split(',')]
+    camera_ip = config.get('Camera', 'camera_ip')
+
+    metrics_registry = None
+    prometheus_port = config.get('Metrics', 'prometheus_port', fallback='').strip()
+    if prometheus_port:
+        metrics_registry = MetricsRegistry()
+        prometheus_address = config.get('Metrics', 'prometheus_address', fallback='127.0.0.1').strip()
+        try:
+            serve_prometheus(metrics_registry, prometheus_address, int(prometheus_port))
+            logger.info(f"Serving metrics on http://{prometheus_address}:{prometheus_port}/metrics")
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot serve metrics on {prometheus_address}:{prometheus_port}: {e}")
+
+    profiler = None
+    if args.profile:
+        logger.info(f"Profiling ({args.profile}{', threads ' + args.profile_thread + '*' if args.profile_thread else ''}).")
+        try:
+            profiler = start_profiler(args.profile, args.profile_thread, args.profile_interval / 1000)
+        except ValueError as e:
+            logger.error(f"Cannot start the profiler: {e}")
+    try:
+        with tracer.span('main', command=args.command):
+            if args.command == 'scrub':
+                # Local only: no camera connection.
+                success = _scrub_command(config, dest_dir, logger, restart=args.restart)
+            elif args.command == 'fleet':
+                success = _fleet_command(config, camera_ip, ssid_prefixes, dest_dir, logger, sync_settings,
+                                         use_wifi=not args.no_wifi, metrics_registry=metrics_registry)
+            else:
+                bind_interface = config.get('Camera', 'bind_interface', fallback='').strip() or None
+                source_address = config.get('Camera', 'source_address', fallback='').strip() or None
+                success = _run_camera(args.command, camera_ip, dest_dir, logger, sync_settings,
+                                      WifiManager(logger, interface=bind_interface, cache_path=dest_dir / '.insta360_wifi_profiles.json'),
+                                      ssid_prefixes,
+                                      bind_interface=bind_interface, source_address=source_address,
+                                      metrics_registry=metrics_registry)
+    finally:
+        if profiler is not None:
+            stop_profiler(profiler, log_file, logger)
+        _finish_tracing(config, logger)
+    logger.info("--- Insta360 Sync finished ---")
+    if not success:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
+    # The scrub worker processes start from the PyInstaller binary too.
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,148 @@
+# Download manifest for the Insta360 Sync application.
+import json
+import os
+import threading
+import time
+
+from durability import fsync_path
+
+
+class Manifest:
+    """
+    Records every downloaded file with its size and content hash.
+
+    The manifest is an append-only journal of JSON lines stored in the
+    destination directory: recording a file appends one line, so the cost does
+    not grow with the size of the library. When the journal is loaded, later
+    lines replace earlier ones for the same key; a line with "deleted": true
+    removes the entry. compact() rewrites the journal with only the live
+    entries.
+
+    Keys are paths relative to the destination directory. The manifest also
+    indexes entries by the camera file they were downloaded from (camera
+    serial number and URI), so find() locates a camera file wherever the
+    destination layout put it, without listing directories.
+    """
+
+    FILE_NAME = '.insta360_manifest.jsonl'
+
+    def __init__(self, dest_dir, logger):
+        """
+        Initializes the manifest and loads the existing journal, if any.
+        Args:
+            dest_dir (Path): The backup destination directory.
+            logger: The logging object for logging messages.
+        """
+        self.logger = logger
+        self.path = dest_dir / self.FILE_NAME
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.sources = {} # map (camera_serial, uri) to key
+        self._journal_lines = 0
+        self._synced = False
+        self._load()
+
+    def _load(self):
+        """Replays the journal into self.entries."""
+        if not self.path.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line after a crash is expected; anything else is worth a warning.
+                    self.logger.warning(f"Ignoring unreadable manifest line {line_number} in {self.path}.")
+                    continue
+                self._journal_lines += 1
+                key = record.pop('key', None)
+                if key is None:
+                    continue
+                if record.get('deleted'):
+                    self._unindex(key, self.entries.pop(key, None))
+                else:
+                    self._unindex(key, self.entries.get(key))
+                    self.entries[key] = record
+                    self._index(key, record)
+        self.logger.info(f"Loaded {len(self.entries)} entries from manifest {self.path}.")
+
+    def _index(self, key, entry):
+        if entry.get('uri') is not None:
+            self.sources[(entry.get('camera_serial'), entry['uri'])] = key
+
+    def _unindex(self, key, entry):
+        if entry is not None and self.sources.get((entry.get('camera_serial'), entry.get('uri'))) == key:
+            del self.sources[(entry.get('camera_serial'), entry.get('uri'))]
+
+    def find(self, camera_serial, uri):
+        """Returns the key of the file downloaded from uri of camera_serial (or of an unknown camera), or None."""
+        with self.lock:
+            key = self.sources.get((camera_serial, uri))
+            if key is None and camera_serial is not None:
+                key = self.sources.get((None, uri))
+            return key
+
+    def get(self, key):
+        """Returns the entry for key, or None."""
+        with self.lock:
+            return self.entries.get(key)
+
+    def record(self, key, **fields):
+        """
+        Adds or updates the entry for key and appends it to the journal.
+        Args:
+            key (str): The file path relative to the destination directory.
+            **fields: Entry fields, e.g. uri, size, hash, hash_algorithm.
+        Returns:
+            dict: The updated entry.
+        """
+        with self.lock:
+            previous = self.entries.get(key)
+            entry = dict(previous or {})
+            entry.update(fields)
+            entry['updated_at'] = time.time()
+            self._unindex(key, previous)
+            self.entries[key] = entry
+            self._index(key, entry)
+            self._append(dict(entry, key=key))
+            return entry
+
+    def remove(self, key):
+        """Removes the entry for key."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self._unindex(key, entry)
+                self._append({'key': key, 'deleted': True})
+
+    def _append(self, record):
+        """Appends one record to the journal. Caller holds self.lock."""
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._journal_lines += 1
+
+    def sync(self):
+        """Flushes the journal to disk, and its directory entry the first time."""
+        with self.lock:
+            fsync_path(self.path)
+            if not self._synced:
+                fsync_path(self.path.parent)
+                self._synced = True
+
+    def compact(self):
+        """Rewrites the journal with one line per live entry, if it has grown much larger."""
+        with self.lock:
+            if self._journal_lines <= 2 * len(self.entries) + 100:
+                return
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for key, entry in self.entries.items():
+                    f.write(json.dumps(dict(entry, key=key), separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.logger.debug(f"Compacted manifest from {self._journal_lines} to {len(self.entries)} lines.")
+            self._journal_lines = len(self.entries)
@@ -0,0 +1,160 @@
+# Linux network namespace helpers for the fleet mode of the Insta360 Sync application.
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import subprocess
+import tempfile
+
+NETNS_DIR = '/var/run/netns'
+CLONE_NEWNET = 0x40000000
+WPA_SUPPLICANT_CTRL_DIR = '/var/run/wpa_supplicant'
+
+_libc = None
+
+
+class NamespaceError(Exception):
+    """Raised when a network namespace cannot be created, configured or entered."""
+
+
+def _setns(fd):
+    """Moves the calling thread into the network namespace referred to by fd."""
+    global _libc
+    if hasattr(os, 'setns'):
+        os.setns(fd, CLONE_NEWNET)
+        return
+    # os.setns() is only available from Python 3.12.
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if _libc.setns(fd, CLONE_NEWNET) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def namespace_exists(name):
+    """Returns True if the named network namespace (as created by "ip netns add") exists."""
+    return os.path.exists(os.path.join(NETNS_DIR, name))
+
+
+@contextlib.contextmanager
+def enter_namespace(name):
+    """
+    Runs the body with the calling thread inside the named network namespace.
+
+    Network namespaces are per thread: sockets created by this thread, and the
+    threads and processes it starts, belong to the namespace. That includes the
+    camera receive and keepalive threads and the download workers, so a whole
+    camera sync can run in one namespace while other threads use other ones.
+    The thread returns to its original namespace on exit; threads started
+    inside stay in the namespace.
+    """
+    try:
+        target = os.open(os.path.join(NETNS_DIR, name), os.O_RDONLY)
+    except OSError as e:
+        raise NamespaceError(f"Network namespace {name} does not exist: {e}") from e
+    original = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+    try:
+        try:
+            _setns(target)
+        except OSError as e:
+            raise NamespaceError(f"Cannot enter network namespace {name} (root or CAP_SYS_ADMIN is needed): {e}") from e
+        try:
+            yield
+        finally:
+            _setns(original)
+    finally:
+        os.close(target)
+        os.close(original)
+
+
+def _run(command, logger):
+    """Runs a setup command. Raises NamespaceError with its output on failure."""
+    logger.debug(f"Running: {' '.join(command)}")
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except FileNotFoundError as e:
+        raise NamespaceError(f"Command not found: {command[0]}") from e
+    except subprocess.CalledProcessError as e:
+        raise NamespaceError(f"{' '.join(command)} failed (exit code {e.returncode}): {e.stderr.strip()}") from e
+
+
+def create_namespace(name, logger):
+    """Creates the named network namespace with its loopback up, if it does not exist yet."""
+    if namespace_exists(name):
+        return
+    logger.info(f"Creating network namespace {name}.")
+    _run(['ip', 'netns', 'add', name], logger)
+    _run(['ip', '-n', name, 'link', 'set', 'lo', 'up'], logger)
+
+
+def delete_namespace(name, logger):
+    """Deletes the named network namespace. Physical interfaces inside return to the host."""
+    if namespace_exists(name):
+        logger.info(f"Deleting network namespace {name}.")
+        _run(['ip', 'netns', 'delete', name], logger)
+
+
+def setup_wifi_namespace(name, interface, logger):
+    """
+    Gives a Wi-Fi interface its own network namespace.
+
+    Wireless interfaces are moved with their phy, then a wpa_supplicant is
+    started for the interface inside the namespace so that WifiManager can
+    drive it. Does nothing if the namespace already holds the interface.
+    Args:
+        name (str): The network namespace name.
+        interface (str): The Wi-Fi interface, e.g. "wlan1".
+        logger: The logging object for logging messages.
+    Raises:
+        NamespaceError: If a step fails, typically for lack of root privileges.
+    """
+    create_namespace(name, logger)
+    phy_path = f'/sys/class/net/{interface}/phy80211/name'
+    if os.path.exists(phy_path):
+        with open(phy_path, 'r', encoding='ascii') as f:
+            phy = f.read().strip()
+        logger.info(f"Moving Wi-Fi interface {interface} ({phy}) into network namespace {name}.")
+        _run(['iw', 'phy', phy, 'set', 'netns', 'name', name], logger)
+    else:
+        # Not in the host namespace: either already moved or missing.
+        logger.debug(f"Interface {interface} is not in the host namespace; assuming it is already in {name}.")
+    _run(['ip', '-n', name, 'link', 'set', interface, 'up'], logger)
+    if not os.path.exists(os.path.join(WPA_SUPPLICANT_CTRL_DIR, interface)):
+        # wpa_supplicant talks nl80211 to the interface, so it has to run inside the namespace.
+        # Its control socket is a path in the file system, reachable from any namespace.
+        # The configuration is read before wpa_supplicant goes to the background, so
+        # the file is removed once it has started; without update_config the networks
+        # added later, with their passphrases, are never written back to disk.
+        conf = tempfile.NamedTemporaryFile('w', prefix=f'wpa_{interface}_', suffix='.conf', delete=False)
+        try:
+            with conf:
+                conf.write(f'ctrl_interface={WPA_SUPPLICANT_CTRL_DIR}\n')
+            _run(['ip', 'netns', 'exec', name, 'wpa_supplicant', '-B', '-i', interface, '-c', conf.name], logger)
+        finally:
+            os.remove(conf.name)
+
+
+def setup_veth_namespace(name, interface, peer_namespace, peer_interface, address, peer_address, logger):
+    """
+    Creates a veth pair between two namespaces, for testing fleet mode without radios.
+
+    The camera side (peer) typically runs camera_simulator.py with the camera
+    address, e.g. 192.168.42.1/24, while the sync side gets another address of
+    the same subnet, as a Wi-Fi client of the camera hotspot would.
+    Args:
+        name (str): The sync side network namespace.
+        interface (str): The sync side veth interface name.
+        peer_namespace (str): The camera side network namespace.
+        peer_interface (str): The camera side veth interface name.
+        address (str): The sync side address with prefix length.
+        peer_address (str): The camera side address with prefix length.
+        logger: The logging object for logging messages.
+    """
+    create_namespace(name, logger)
+    create_namespace(peer_namespace, logger)
+    _run(['ip', 'link', 'add', interface, 'netns', name, 'type', 'veth',
+          'peer', 'name', peer_interface, 'netns', peer_namespace], logger)
+    _run(['ip', '-n', name, 'addr', 'add', address, 'dev', interface], logger)
+    _run(['ip', '-n', peer_namespace, 'addr', 'add', peer_address, 'dev', peer_interface], logger)
+    _run(['ip', '-n', name, 'link', 'set', interface, 'up'], logger)
+    _run(['ip', '-n', peer_namespace, 'link', 'set', peer_interface, 'up'], logger)
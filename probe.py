@@ -0,0 +1,169 @@
+# Link capacity probe for the Insta360 Sync application.
+import json
+import shutil
+import subprocess
+import time
+
+import requests
+
+from insta360_api.insta360 import camera
+from transfer import MIN_BUFFER_SIZE, MAX_BUFFER_SIZE
+
+
+class LinkProbe:
+    """
+    Measures Wi-Fi goodput and SD card speed of a connected camera.
+
+    Three numbers are collected:
+      - iperf throughput: the camera iperf server (PHONE_COMMAND_OPEN_IPERF)
+        measured with a local iperf3 client, i.e. the radio alone;
+      - HTTP goodput: a timed download of a real file, i.e. radio plus card
+        reads plus the camera web server;
+      - SD card write speed: the camera's own TEST_SD_CARD_SPEED command.
+    Comparing them tells whether the radio or the card limits the sync, and
+    recommend() turns them into download concurrency and buffer size.
+    """
+
+    HISTORY_FILE_NAME = '.insta360_probe_history.jsonl'
+    IPERF_DURATION_SEC = 5
+    HTTP_DURATION_SEC = 5
+    HTTP_MAX_BYTES = 256 * 1024 * 1024
+    SD_TEST_BLOCK_SIZE = 1024 * 1024
+    SD_TEST_DURATION = 3
+    SD_TEST_TIMES = 1
+    RESPONSE_TIMEOUT_SEC = 30
+
+    def __init__(self, insta360_client, callback_handler, camera_ip, logger):
+        """
+        Initializes the probe.
+        Args:
+            insta360_client (camera): The connected camera API client.
+            callback_handler (Insta360CallbackHandler): Receives the camera responses.
+            camera_ip (str): The camera IP address.
+            logger: The logging object for logging messages.
+        """
+        self.insta360_client = insta360_client
+        self.callback_handler = callback_handler
+        self.camera_ip = camera_ip
+        self.logger = logger
+
+    def run(self, sample_uri=None, http_session=None):
+        """
+        Runs all measurements.
+        Args:
+            sample_uri (str): Optional, a file on the camera used for the HTTP goodput test.
+            http_session: Optional requests.Session to download with.
+        Returns:
+            dict: The results; unavailable measurements are None.
+        """
+        results = {
+            'timestamp': time.time(),
+            'camera_ip': self.camera_ip,
+            'iperf_mbps': self.measure_iperf(),
+            'http_mbps': self.measure_http(sample_uri, http_session) if sample_uri else None,
+            'sd_write_speeds': self.measure_sd_card(),
+        }
+        results['bottleneck'] = self._bottleneck(results)
+        results['recommended'] = self.recommend(results)
+        self.logger.info(f"Link probe: iperf {results['iperf_mbps']} Mbit/s, HTTP {results['http_mbps']} Mbit/s, "
+                         f"SD card write {results['sd_write_speeds']}, bottleneck: {results['bottleneck']}.")
+        return results
+
+    def _request(self, message_code, send):
+        """Sends a command with send() and waits for its response. Returns the response dict or None."""
+        self.callback_handler.expect(message_code)
+        send()
+        response = self.callback_handler.wait_for(message_code, timeout=self.RESPONSE_TIMEOUT_SEC)
+        if response is None or response.get('response_code') != camera.RESPONSE_CODE_OK:
+            return None
+        return response
+
+    def measure_iperf(self):
+        """Measures raw Wi-Fi throughput in Mbit/s against the camera iperf server, or returns None."""
+        iperf3 = shutil.which('iperf3')
+        if iperf3 is None:
+            self.logger.info("iperf3 is not installed, skipping the Wi-Fi throughput test.")
+            return None
+        if self._request(camera.PHONE_COMMAND_OPEN_IPERF, lambda: self.insta360_client.OpenIperf('TCP')) is None:
+            self.logger.warning("Camera did not start its iperf server.")
+            return None
+        try:
+            # Receive from the camera (-R), which is the direction of the downloads.
+            output = subprocess.run([iperf3, '-c', self.camera_ip, '-R', '-J', '-t', str(self.IPERF_DURATION_SEC)],
+                                    capture_output=True, text=True, timeout=self.IPERF_DURATION_SEC + 15)
+            report = json.loads(output.stdout)
+            return round(report['end']['sum_received']['bits_per_second'] / 1e6, 1)
+        except (subprocess.SubprocessError, ValueError, KeyError) as e:
+            self.logger.warning(f"iperf3 measurement failed: {e}")
+            return None
+        finally:
+            self._request(camera.PHONE_COMMAND_CLOSE_IPERF, self.insta360_client.CloseIperf)
+
+    def measure_http(self, sample_uri, http_session=None):
+        """Measures HTTP download goodput in Mbit/s by reading sample_uri for a few seconds."""
+        get = http_session.get if http_session is not None else requests.get
+        received = 0
+        try:
+            t0 = time.monotonic()
+            with get(f"http://{self.camera_ip}/{sample_uri}", stream=True, timeout=10) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    received += len(chunk)
+                    elapsed = time.monotonic() - t0
+                    if elapsed > self.HTTP_DURATION_SEC or received >= self.HTTP_MAX_BYTES:
+                        break
+            elapsed = time.monotonic() - t0
+        except requests.exceptions.RequestException as e:
+            self.logger.warning(f"HTTP goodput measurement failed: {e}")
+            return None
+        if elapsed <= 0 or received == 0:
+            return None
+        return round(received * 8 / elapsed / 1e6, 1)
+
+    def measure_sd_card(self):
+        """Runs the camera SD card speed test. Returns the list of write speeds reported, or None."""
+        response = self._request(camera.PHONE_COMMAND_TEST_SD_CARD_SPEED,
+                                 lambda: self.insta360_client.TestSDCardSpeed(self.SD_TEST_BLOCK_SIZE, self.SD_TEST_DURATION, self.SD_TEST_TIMES))
+        if response is None:
+            self.logger.warning("Camera did not run the SD card speed test.")
+            return None
+        return [int(v) for v in response.get('write_speeds', [])]
+
+    @staticmethod
+    def _bottleneck(results):
+        """Guesses what limits downloads: 'radio', 'camera' (card or web server) or 'unknown'."""
+        iperf, http = results['iperf_mbps'], results['http_mbps']
+        if iperf is None or http is None:
+            return 'unknown'
+        # HTTP reaching most of the iperf rate means the radio is the limit.
+        return 'radio' if http >= 0.7 * iperf else 'camera'
+
+    @staticmethod
+    def recommend(results):
+        """
+        Derives download settings from probe results.
+        Returns:
+            dict: {'download_workers', 'chunk_size_mb'}, or an empty dict without HTTP goodput.
+        """
+        http = results['http_mbps']
+        if not http:
+            return {}
+        # Buffers hold about a quarter of a second of data, within the 1-8 MB range.
+        bytes_per_quarter_sec = http * 1e6 / 8 / 4
+        chunk_size_mb = 1
+        while chunk_size_mb < MAX_BUFFER_SIZE // (1024 * 1024) and chunk_size_mb * 1024 * 1024 < bytes_per_quarter_sec:
+            chunk_size_mb *= 2
+        chunk_size_mb = max(MIN_BUFFER_SIZE // (1024 * 1024), chunk_size_mb)
+        # A radio-bound link gains nothing from parallel requests; when the camera
+        # side is slower, overlapping requests hides per-request latency.
+        workers = 2 if results['bottleneck'] == 'camera' else 1
+        return {'download_workers': workers, 'chunk_size_mb': chunk_size_mb}
+
+    def record(self, results, dest_dir):
+        """Appends the results to the probe history in the destination directory, for trend analysis."""
+        path = dest_dir / self.HISTORY_FILE_NAME
+        try:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(results, separators=(',', ':')) + '\n')
+        except OSError as e:
+            self.logger.warning(f"Could not record probe results in {path}: {e}")
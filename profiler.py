@@ -0,0 +1,190 @@
+# Built-in profiling for the Insta360 Sync application.
+#
+# "main.py --profile" runs the command under one of two profilers and writes
+# the result next to the log file:
+#   sampling  samples the stacks of all threads with sys._current_frames()
+#             and writes them in the collapsed format read by flamegraph.pl,
+#             speedscope or inferno (<log_file>.profile.collapsed).
+#   cprofile  runs cProfile in every thread and writes the merged statistics
+#             (<log_file>.profile.pstats, for pstats, snakeviz or flameprof).
+#             From Python 3.12 on, a single cProfile covers all threads (it
+#             is built on sys.monitoring, which allows only one at a time).
+# Both work in the PyInstaller binary, as they only need the standard library.
+# --profile-thread restricts profiling to threads whose name starts with the
+# given prefix, e.g. "insta360-receive" for the camera receive thread.
+import collections
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+PROFILE_MODES = ('sampling', 'cprofile')
+DEFAULT_SAMPLE_INTERVAL_SEC = 0.005
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of running threads at a fixed interval."""
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL_SEC, thread_prefix=None):
+        self.interval = interval
+        self.thread_prefix = thread_prefix
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.sample_sec = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._names = {}
+
+    def _thread_name(self, ident):
+        name = self._names.get(ident)
+        if name is None:
+            self._names = {t.ident: t.name for t in threading.enumerate()}
+            name = self._names.get(ident, str(ident))
+        return name
+
+    def _sample(self):
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            name = self._thread_name(ident)
+            if self.thread_prefix and not name.startswith(self.thread_prefix):
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(name)
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            t0 = time.perf_counter()
+            self._sample()
+            self.sample_sec += time.perf_counter() - t0
+            self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        """Writes the collapsed stacks: one "thread;outer;...;inner count" line per distinct stack."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ThreadedCProfile:
+    """
+    cProfile in the current thread and in every thread started while it runs.
+
+    Before Python 3.12 each thread gets its own cProfile.Profile. From 3.12
+    on only one profiler can be active in the process, and it sees every
+    thread, so one profile is enabled for the whole process; it cannot be
+    restricted to some threads.
+    """
+
+    # cProfile is process-wide from Python 3.12 on.
+    PROCESS_WIDE = sys.version_info >= (3, 12)
+
+    def __init__(self, thread_prefix=None):
+        """
+        Args:
+            thread_prefix (str): Only profile threads whose name starts with it.
+        Raises:
+            ValueError: If thread_prefix is given on Python 3.12 or later.
+        """
+        if thread_prefix and self.PROCESS_WIDE:
+            raise ValueError("cprofile cannot be restricted to some threads on Python 3.12 and later; "
+                             "use the sampling profiler with --profile-thread")
+        self.thread_prefix = thread_prefix
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _wanted(self):
+        return not self.thread_prefix or threading.current_thread().name.startswith(self.thread_prefix)
+
+    def _start_in_thread(self, frame, event, arg):
+        # Called once by each new thread: replaces itself with a cProfile hook.
+        sys.setprofile(None)
+        if self._wanted():
+            try:
+                self._enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger) is active: this thread runs unprofiled.
+                pass
+
+    def _enable(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        if self.PROCESS_WIDE:
+            self._enable()
+            return
+        threading.setprofile(self._start_in_thread)
+        if self._wanted():
+            self._enable()
+
+    def stop(self):
+        if not self.PROCESS_WIDE:
+            threading.setprofile(None)
+        # Profiles of other threads stay enabled until those threads end;
+        # their statistics are taken as they are now.
+        for profile in self.profiles:
+            profile.disable()
+
+    def write(self, path):
+        stats = None
+        for profile in self.profiles:
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        if stats is None:
+            raise ValueError("no thread matched the profile filter")
+        stats.dump_stats(path)
+
+
+def start_profiler(mode, thread_prefix=None, interval=DEFAULT_SAMPLE_INTERVAL_SEC):
+    """
+    Starts and returns a profiler for mode ("sampling" or "cprofile").
+    Raises:
+        ValueError: If the profiler cannot run as requested (see ThreadedCProfile).
+    """
+    if mode == 'cprofile':
+        profiler = ThreadedCProfile(thread_prefix)
+    else:
+        profiler = SamplingProfiler(interval, thread_prefix)
+    profiler.start()
+    return profiler
+
+
+def stop_profiler(profiler, log_file, logger):
+    """Stops profiler and writes its output next to log_file. Returns the output path, or None."""
+    profiler.stop()
+    if isinstance(profiler, SamplingProfiler):
+        path = f"{log_file}.profile.collapsed"
+        summary = (f"{profiler.samples} samples, {len(profiler.stacks)} distinct stacks, "
+                   f"sampling took {profiler.sample_sec:.2f}s")
+    else:
+        path = f"{log_file}.profile.pstats"
+        summary = "all threads profiled" if profiler.PROCESS_WIDE else f"{len(profiler.profiles)} threads profiled"
+    try:
+        profiler.write(path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot write the profile to {path}: {e}")
+        return None
+    logger.info(f"Profile written to {path} ({summary}).")
+    return path
@@ -0,0 +1,162 @@
+# Download progress reporting for the Insta360 Sync application.
+import json
+import sys
+import threading
+import time
+
+PROGRESS_MODES = ('auto', 'bar', 'log', 'json', 'off')
+DEFAULT_INTERVAL_SEC = 1.0
+# Weight of the last interval in the throughput average.
+EWMA_ALPHA = 0.3
+
+
+def _format_bytes(n):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(n) < 1000:
+            return f"{n:.1f} {unit}"
+        n /= 1000
+    return f"{n:.1f} TB"
+
+
+def _format_duration(sec):
+    if sec is None:
+        return '--:--'
+    sec = int(sec)
+    if sec >= 3600:
+        return f"{sec // 3600}:{sec % 3600 // 60:02d}:{sec % 60:02d}"
+    return f"{sec // 60:02d}:{sec % 60:02d}"
+
+
+class ProgressTracker:
+    """
+    Aggregates the progress of all download workers and reports it on a timer.
+
+    Workers only add to lock-protected counters (add() is the on_progress
+    callback of the downloads, file_done() is called once per file), so their
+    cost does not depend on how often they report. A reporter thread reads the
+    counters every interval, updates an exponentially weighted moving average
+    of the throughput and renders one of:
+      bar   a single status line on stderr, redrawn in place
+      log   an INFO log line (every 10 intervals)
+      json  one JSON object per line on stdout, for headless runs
+      off   nothing
+    "auto" is bar on an interactive terminal and log otherwise, and always log
+    outside the main thread, where several cameras may sync at once.
+    """
+
+    LOG_EVERY = 10
+
+    def __init__(self, logger, total_bytes=None, total_files=0, mode='auto', interval=DEFAULT_INTERVAL_SEC, label=None):
+        """
+        Initializes the tracker; call start() to begin reporting.
+        Args:
+            logger: The logging object for logging messages.
+            total_bytes (int): Bytes to download, from the listing; None if unknown (no ETA).
+            total_files (int): Number of files to download.
+            mode (str): One of PROGRESS_MODES.
+            interval (float): Reporting interval in seconds.
+            label (str): Optional name of the camera, for log and JSON output.
+        """
+        if mode == 'auto':
+            interactive = sys.stderr.isatty() and threading.current_thread() is threading.main_thread()
+            mode = 'bar' if interactive else 'log'
+        self.logger = logger
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.mode = mode
+        self.interval = interval
+        self.label = label
+        self.lock = threading.Lock()
+        self.bytes_done = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.rate = None
+        self.started = time.monotonic()
+        self._last_time = self.started
+        self._last_bytes = 0
+        self._ticks = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, nbytes):
+        """Adds downloaded bytes; negative when a partial download is discarded."""
+        with self.lock:
+            self.bytes_done += nbytes
+
+    def file_done(self, ok=True):
+        with self.lock:
+            if ok:
+                self.files_done += 1
+            else:
+                self.files_failed += 1
+
+    def snapshot(self):
+        """Returns the current totals, throughput (bytes/s) and ETA (seconds, None if unknown)."""
+        with self.lock:
+            bytes_done, files_done, files_failed = self.bytes_done, self.files_done, self.files_failed
+        eta = None
+        if self.total_bytes is not None and self.rate:
+            eta = max(0, self.total_bytes - bytes_done) / self.rate
+        return {
+            'bytes': bytes_done,
+            'total_bytes': self.total_bytes,
+            'files': files_done,
+            'failed': files_failed,
+            'total_files': self.total_files,
+            'rate_bps': self.rate or 0.0,
+            'eta_sec': eta,
+            'elapsed_sec': time.monotonic() - self.started,
+        }
+
+    def _update_rate(self):
+        now = time.monotonic()
+        with self.lock:
+            bytes_done = self.bytes_done
+        dt = now - self._last_time
+        if dt <= 0:
+            return
+        instant = max(0, bytes_done - self._last_bytes) / dt
+        self.rate = instant if self.rate is None else EWMA_ALPHA * instant + (1 - EWMA_ALPHA) * self.rate
+        self._last_time, self._last_bytes = now, bytes_done
+
+    def _render(self, final=False):
+        state = self.snapshot()
+        if self.mode == 'json':
+            event = dict(state, event='done' if final else 'progress')
+            if self.label:
+                event['camera'] = self.label
+            sys.stdout.write(json.dumps(event) + '\n')
+            sys.stdout.flush()
+            return
+        total = f"/{_format_bytes(state['total_bytes'])}" if state['total_bytes'] is not None else ''
+        line = (f"{state['files']}/{state['total_files']} files, {_format_bytes(state['bytes'])}{total}, "
+                f"{_format_bytes(state['rate_bps'])}/s, ETA {_format_duration(state['eta_sec'])}")
+        if state['failed']:
+            line += f", {state['failed']} failed"
+        if self.mode == 'bar':
+            sys.stderr.write(f"\rDownloading: {line}\033[K" + ('\n' if final else ''))
+            sys.stderr.flush()
+        elif self.mode == 'log' and (final or self._ticks % self.LOG_EVERY == 0):
+            self.logger.info(f"Progress: {line}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._ticks += 1
+            self._update_rate()
+            self._render()
+
+    def start(self):
+        if self.mode != 'off':
+            self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Stops the reporter and renders the final state."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            # The average over the whole run, for the final line.
+            elapsed = time.monotonic() - self.started
+            self.rate = self.bytes_done / elapsed if elapsed > 0 else None
+            self._render(final=True)
@@ -0,0 +1,135 @@
+# Camera reachability check for the Insta360 Sync application.
+import errno
+import select
+import shlex
+import socket
+import subprocess
+import time
+
+CAMERA_PORTS = (6666, 80)
+INITIAL_DELAY_SEC = 0.005
+MAX_DELAY_SEC = 0.5
+ATTEMPT_TIMEOUT_SEC = 0.25
+
+
+def _bind(sock, bind_interface, source_address):
+    if bind_interface:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, bind_interface.encode())
+    if source_address:
+        sock.bind((source_address, 0))
+
+
+def _has_route(host, bind_interface=None, source_address=None):
+    """
+    Returns True once there is a route and a local address to reach host.
+
+    Connecting a UDP socket sends nothing, it only resolves the route: it
+    fails while the interface has no address yet (DHCP still running) or no
+    route to the camera subnet.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            _bind(sock, bind_interface, source_address)
+            sock.connect((host, 9))
+            return sock.getsockname()[0] != '0.0.0.0'
+        except OSError:
+            return False
+
+
+def _try_connect(host, ports, timeout, bind_interface=None, source_address=None):
+    """
+    Starts non-blocking connects to all ports at once and waits up to timeout.
+    Returns:
+        set: The ports that accepted the connection.
+    """
+    pending = {}
+    connected = set()
+    try:
+        for port in ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            pending[sock] = port
+            try:
+                _bind(sock, bind_interface, source_address)
+                result = sock.connect_ex((host, port))
+            except OSError as e:
+                result = e.errno
+            if result == 0:
+                connected.add(port)
+            elif result not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                # Refused or unreachable: the camera service is not up yet.
+                del pending[sock]
+                sock.close()
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            _, writable, _ = select.select([], list(pending), [], remaining)
+            for sock in writable:
+                port = pending.pop(sock)
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    connected.add(port)
+                sock.close()
+    finally:
+        for sock in pending:
+            sock.close()
+    return connected
+
+
+def run_dhcp(command, logger):
+    """Runs the DHCP client command after joining a camera Wi-Fi. Returns True on success."""
+    logger.info(f"Requesting an address: {command}")
+    try:
+        subprocess.run(shlex.split(command), check=True, capture_output=True, text=True, timeout=30)
+        return True
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.error(f"DHCP command failed: {e}")
+        return False
+
+
+def wait_until_ready(host, logger, ports=CAMERA_PORTS, timeout=30.0, bind_interface=None, source_address=None):
+    """
+    Waits until the camera accepts TCP connections on all ports.
+
+    First waits for a route to the camera (address assigned by DHCP), then
+    makes short non-blocking connect attempts. Between attempts the delay
+    starts at a few milliseconds and doubles up to MAX_DELAY_SEC, so a camera
+    that is ready quickly is detected within milliseconds, while one that
+    takes seconds is not flooded.
+    Args:
+        host (str): The camera IP address.
+        logger: The logging object for logging messages.
+        ports (tuple): TCP ports that must accept connections.
+        timeout (float): Overall time limit in seconds.
+        bind_interface (str): Optional network interface to connect through.
+        source_address (str): Optional local IP address to connect from.
+    Returns:
+        dict: {'route_sec', 'ready_sec'} measured from the call, or None on timeout.
+    """
+    t0 = time.monotonic()
+    deadline = t0 + timeout
+    delay = INITIAL_DELAY_SEC
+    route_sec = None
+    remaining_ports = set(ports)
+    attempts = 0
+    while True:
+        if route_sec is None and _has_route(host, bind_interface, source_address):
+            route_sec = time.monotonic() - t0
+            delay = INITIAL_DELAY_SEC
+        if route_sec is not None:
+            attempts += 1
+            remaining_ports -= _try_connect(host, sorted(remaining_ports), ATTEMPT_TIMEOUT_SEC,
+                                            bind_interface, source_address)
+            if not remaining_ports:
+                ready_sec = time.monotonic() - t0
+                logger.info(f"Camera {host} ready after {ready_sec * 1000:.0f} ms "
+                            f"(route after {route_sec * 1000:.0f} ms, {attempts} connect attempts).")
+                return {'route_sec': route_sec, 'ready_sec': ready_sec}
+        now = time.monotonic()
+        if now >= deadline:
+            missing = 'no route' if route_sec is None else f"ports {', '.join(map(str, sorted(remaining_ports)))} not answering"
+            logger.error(f"Camera {host} not reachable after {timeout:.0f} s: {missing}.")
+            return None
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, MAX_DELAY_SEC)
@@ -0,0 +1,243 @@
+# Integrity scrub of the backup library for the Insta360 Sync application.
+#
+# "main.py scrub" reads every file recorded in the manifest back from disk
+# and checks it against the size and content hash recorded when it was
+# downloaded. Files are verified in parallel by a pool of processes (hashing
+# is CPU bound and would be serialized by the GIL in threads), each reading
+# its file sequentially in large blocks with posix_fadvise() hints, so the
+# page cache is not flooded with data that is read only once. Progress is
+# checkpointed, so an interrupted scrub of a multi-TB library continues
+# where it stopped, and the total read rate can be capped to leave disk
+# bandwidth for syncs.
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from hashing import is_hash_available, new_hash
+from listing_cache import ListingCache
+from manifest import Manifest
+
+DEFAULT_READ_SIZE = 8 * 1024 * 1024
+DEFAULT_CHECKPOINT_INTERVAL_SEC = 30.0
+# Statuses of damaged files. "unverified" files have no hash in the manifest
+# and only had their size checked.
+PROBLEMS = ('missing', 'truncated', 'corrupt', 'unreadable')
+# Suffix of damaged files set aside so that the next sync downloads them again.
+QUARANTINE_SUFFIX = '.corrupt'
+
+
+def verify_file(path, size, digest, algorithm, read_size=DEFAULT_READ_SIZE, max_read_bps=0):
+    """
+    Checks one file against its manifest entry. Runs in a scrub worker process.
+    Args:
+        path (str): The local file.
+        size (int): Size recorded in the manifest, or None.
+        digest (str): Hex digest recorded in the manifest, or None.
+        algorithm (str): The hash algorithm of digest.
+        read_size (int): Size of each read.
+        max_read_bps (float): Read rate limit of this process in bytes per second (0: none).
+    Returns:
+        tuple: (status, detail, bytes read): status is "ok", "unverified" or one of PROBLEMS.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return 'missing', None, 0
+    except OSError as e:
+        return 'unreadable', str(e), 0
+    try:
+        actual_size = os.fstat(fd).st_size
+        if size is not None and actual_size != size:
+            status = 'truncated' if actual_size < size else 'corrupt'
+            return status, f"{actual_size} bytes, manifest has {size}", 0
+        if not digest or not is_hash_available(algorithm):
+            return 'unverified', None if not digest else f"{algorithm} is not available", 0
+        fadvise = hasattr(os, 'posix_fadvise')
+        if fadvise:
+            # Doubles the kernel read-ahead for this file.
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        h = new_hash(algorithm)
+        buf = bytearray(read_size)
+        view = memoryview(buf)
+        offset = 0
+        started = time.monotonic()
+        with open(fd, 'rb', buffering=0, closefd=False) as f:
+            while True:
+                n = f.readinto(view)
+                if not n:
+                    break
+                h.update(view[:n])
+                if fadvise:
+                    # Read once: drop it from the page cache instead of evicting hotter data.
+                    os.posix_fadvise(fd, offset, n, os.POSIX_FADV_DONTNEED)
+                offset += n
+                if max_read_bps:
+                    ahead = offset / max_read_bps - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        if h.hexdigest() != digest:
+            return 'corrupt', f"{algorithm} {h.hexdigest()}, manifest has {digest}", offset
+        return 'ok', None, offset
+    except OSError as e:
+        # EIO from a failing disk or card reader.
+        return 'unreadable', str(e), 0
+    finally:
+        os.close(fd)
+
+
+class Scrubber:
+    """
+    Verifies the files of one manifest with a process pool.
+
+    The checkpoint file next to the manifest holds the keys verified so far
+    and the problems found; it is rewritten every checkpoint_interval_sec
+    and when the scrub stops. A scrub that did not complete continues from
+    it; a complete one starts over.
+    """
+
+    CHECKPOINT_NAME = '.insta360_scrub.json'
+
+    def __init__(self, dest_dir, logger, processes=0, read_size=DEFAULT_READ_SIZE, max_read_bps=0,
+                 checkpoint_interval_sec=DEFAULT_CHECKPOINT_INTERVAL_SEC):
+        """
+        Initializes the scrubber.
+        Args:
+            dest_dir (Path): The directory of the manifest (the backup destination directory).
+            logger: The logging object for logging messages.
+            processes (int): Worker processes; 0 for one per CPU.
+            read_size (int): Size of each read.
+            max_read_bps (float): Read rate limit of all workers together in bytes per second (0: none).
+            checkpoint_interval_sec (float): Interval between checkpoint writes.
+        """
+        self.dest_dir = dest_dir
+        self.logger = logger
+        self.processes = processes or os.cpu_count() or 1
+        self.read_size = read_size
+        self.max_read_bps = max_read_bps
+        self.checkpoint_interval_sec = checkpoint_interval_sec
+        self.checkpoint_path = dest_dir / self.CHECKPOINT_NAME
+        self.manifest = Manifest(dest_dir, logger)
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable scrub checkpoint {self.checkpoint_path}: {e}")
+            return None
+        return None if checkpoint.get('complete') else checkpoint
+
+    def _save_checkpoint(self, state):
+        tmp_path = self.checkpoint_path.with_name(self.checkpoint_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def run(self, restart=False):
+        """
+        Verifies every file in the manifest.
+        Args:
+            restart (bool): Ignore the checkpoint of an interrupted scrub.
+        Returns:
+            dict: The scrub state: counts, problems ({key: [status, detail]}) and complete.
+        """
+        state = None if restart else self._load_checkpoint()
+        if state is not None:
+            self.logger.info(f"Continuing the scrub of {self.dest_dir} started at "
+                             f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state['started_at']))}: "
+                             f"{len(state['verified'])} files already verified.")
+        else:
+            state = {'started_at': time.time(), 'verified': [], 'problems': {}, 'unverified': 0,
+                     'bytes': 0, 'complete': False}
+        verified = set(state['verified'])
+        with self.manifest.lock:
+            todo = sorted((key, dict(entry)) for key, entry in self.manifest.entries.items() if key not in verified)
+        self.logger.info(f"Scrubbing {len(todo)} files in {self.dest_dir} with {self.processes} processes"
+                         f"{f', at most {self.max_read_bps / 1e6:.0f} MB/s' if self.max_read_bps else ''}...")
+        per_process_bps = self.max_read_bps / self.processes if self.max_read_bps else 0
+        started = time.monotonic()
+        read_bytes = 0
+        last_checkpoint = started
+        pending = {}
+        todo_iter = iter(todo)
+        pool = ProcessPoolExecutor(max_workers=self.processes)
+        try:
+            while True:
+                # A bounded window of submitted files keeps memory flat for millions of entries.
+                while len(pending) < 4 * self.processes:
+                    item = next(todo_iter, None)
+                    if item is None:
+                        break
+                    key, entry = item
+                    future = pool.submit(verify_file, str(self.dest_dir / key), entry.get('size'), entry.get('hash'),
+                                         entry.get('hash_algorithm'), self.read_size, per_process_bps)
+                    pending[future] = key
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    status, detail, nbytes = future.result()
+                    read_bytes += nbytes
+                    state['verified'].append(key)
+                    if status == 'unverified':
+                        state['unverified'] += 1
+                    elif status != 'ok':
+                        state['problems'][key] = [status, detail]
+                        self.logger.error(f"Scrub: {key} is {status}{f' ({detail})' if detail else ''}.")
+                if time.monotonic() - last_checkpoint >= self.checkpoint_interval_sec:
+                    last_checkpoint = time.monotonic()
+                    state['bytes'] += read_bytes
+                    read_bytes = 0
+                    self._save_checkpoint(state)
+                    self.logger.info(f"Scrub progress: {len(state['verified'])}/{len(verified) + len(todo)} files, "
+                                     f"{len(state['problems'])} problems.")
+            state['complete'] = True
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            state['bytes'] += read_bytes
+            self._save_checkpoint(state)
+        elapsed = time.monotonic() - started
+        self.logger.info(f"Scrub of {self.dest_dir} complete: {len(state['verified'])} files, "
+                         f"{len(state['problems'])} problems, {state['unverified']} without hash, "
+                         f"{state['bytes'] / 1e9:.1f} GB read in total ({elapsed:.0f}s this run).")
+        return state
+
+    def requeue(self, problems):
+        """
+        Arranges for damaged files to be downloaded again by the next sync.
+
+        Truncated, corrupt and unreadable files are renamed with
+        QUARANTINE_SUFFIX, so the sync finds them missing; the listing cache of
+        their camera is dropped, so the sync lists the camera again instead of
+        skipping it. Files already deleted from the camera cannot be
+        downloaded again and stay in place.
+        Args:
+            problems (dict): {key: [status, detail]} from run().
+        Returns:
+            tuple: (keys queued for download, keys no longer on a camera).
+        """
+        requeued, lost = [], []
+        serials = set()
+        for key, (status, _) in sorted(problems.items()):
+            entry = self.manifest.get(key)
+            if entry is None:
+                continue
+            if entry.get('camera_deleted_at'):
+                lost.append(key)
+                continue
+            if status != 'missing':
+                path = self.dest_dir / key
+                try:
+                    os.replace(path, path.with_name(path.name + QUARANTINE_SUFFIX))
+                except OSError as e:
+                    self.logger.error(f"Cannot set aside {key} for download: {e}")
+                    continue
+            requeued.append(key)
+            serials.add(entry.get('camera_serial'))
+        if serials:
+            ListingCache(self.dest_dir, self.logger).invalidate(None if None in serials else serials)
+        return requeued, lost
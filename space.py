@@ -0,0 +1,145 @@
+# Free-space planning and preallocation for the Insta360 Sync application.
+import ctypes
+import ctypes.util
+import errno
+import os
+import platform
+
+# What to do with capture units that do not fit in the free space:
+#   defer  download the oldest units that fit and stop at the first one that
+#          does not; it and all newer units wait for a later sync
+#   skip   leave out the units that do not fit but still download newer,
+#          smaller units that do
+#   off    no planning, as before
+SPACE_POLICIES = ('defer', 'skip', 'off')
+DEFAULT_MIN_FREE_MB = 512
+
+# fallocate() mode: allocate blocks past the end of the file, leaving its size unchanged.
+_FALLOC_FL_KEEP_SIZE = 0x01
+# Errors meaning the file system cannot preallocate, rather than that it is full.
+_PREALLOCATE_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL}
+
+_fallocate = None
+_unavailable_logged = False
+
+
+def _load_fallocate():
+    """Returns fallocate() with 64-bit offsets from the C library, or None."""
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    # fallocate() takes an off_t, which is only 32 bits wide on 32-bit glibc (e.g.
+    # Raspberry Pi OS armhf); fallocate64() always takes 64-bit offsets.
+    function = getattr(libc, 'fallocate64', None)
+    if function is None and ctypes.sizeof(ctypes.c_void_p) == 8:
+        function = getattr(libc, 'fallocate', None)
+    if function is not None:
+        function.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    return function
+
+
+def _log_unavailable(logger, reason):
+    global _unavailable_logged
+    if logger is not None and not _unavailable_logged:
+        _unavailable_logged = True
+        logger.debug(f"Disk space is not preallocated: {reason}.")
+
+
+def preallocate(fd, offset, length, logger=None):
+    """
+    Reserves disk blocks for length bytes from offset in the open file fd (Linux only).
+
+    Allocating a large file in one extent up front avoids the fragmentation
+    of many files growing in parallel, and reports a full disk before the
+    download instead of part way through it. Unlike posix_fallocate(), the
+    file size is kept: a ".part" file still only counts the bytes actually
+    written, which is what resuming relies on.
+    Args:
+        fd (int): The open file descriptor.
+        offset (int): Start of the range to reserve.
+        length (int): Bytes to reserve.
+        logger: Optional logging object; the first time preallocation is not
+            available, the reason is logged at debug level.
+    Returns:
+        bool: True if the space was reserved, False if not supported here.
+    Raises:
+        OSError: ENOSPC if the file system does not have length bytes free.
+    """
+    global _fallocate
+    if length <= 0:
+        return False
+    if platform.system() != 'Linux':
+        _log_unavailable(logger, "fallocate() is Linux only")
+        return False
+    if _fallocate is None:
+        _fallocate = _load_fallocate() or False
+    if not _fallocate:
+        _log_unavailable(logger, "the C library has no fallocate() with 64-bit offsets")
+        return False
+    if _fallocate(fd, _FALLOC_FL_KEEP_SIZE, offset, length) == 0:
+        return True
+    error = ctypes.get_errno()
+    if error in _PREALLOCATE_UNSUPPORTED:
+        _log_unavailable(logger, f"fallocate() failed with {errno.errorcode.get(error, error)}")
+        return False
+    raise OSError(error, os.strerror(error))
+
+
+def free_bytes(path):
+    """Returns the bytes available to unprivileged users on the file system of path."""
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+class SpacePlan:
+    """The capture units scheduled for download, and those left for a later sync."""
+
+    def __init__(self):
+        self.scheduled = []
+        self.left_out = []
+        self.unknown_size = 0 # scheduled files without a size in the listing
+        self.needed = {} # map directory to bytes scheduled on its file system
+        self.free = {} # map directory to usable bytes, after min_free
+
+
+def plan_space(units, landing_dir, dest_dir, part_bytes, policy='defer', min_free_bytes=DEFAULT_MIN_FREE_MB * 1024 * 1024):
+    """
+    Decides which capture units fit in the free space of the destination.
+    Args:
+        units (list): CaptureUnit objects in download order.
+        landing_dir (Path): The directory downloads are written to (dest_dir, or the staging directory).
+        dest_dir (Path): The backup destination directory.
+        part_bytes (function): Returns the bytes already in the ".part" file of a filename.
+        policy (str): One of SPACE_POLICIES.
+        min_free_bytes (int): Space to leave free on each file system.
+    Returns:
+        SpacePlan: The units to download and the units left out.
+    """
+    plan = SpacePlan()
+    # One budget per file system: a staging directory on another disk needs
+    # the remaining bytes of each file, the destination the whole file.
+    directories = [landing_dir]
+    if dest_dir != landing_dir and os.stat(dest_dir).st_dev != os.stat(landing_dir).st_dev:
+        directories.append(dest_dir)
+    for directory in directories:
+        plan.free[directory] = free_bytes(directory) - min_free_bytes
+        plan.needed[directory] = 0
+    blocked = False
+    for unit in units:
+        need = {directory: 0 for directory in directories}
+        unknown = 0
+        for filename, remote_file in unit.files.items():
+            if remote_file['size'] is None:
+                unknown += 1
+                continue
+            for directory in directories:
+                already = part_bytes(filename) if directory == landing_dir else 0
+                need[directory] += max(0, remote_file['size'] - already)
+        fits = all(plan.needed[d] + need[d] <= plan.free[d] for d in directories)
+        if policy == 'off' or (fits and not blocked):
+            plan.scheduled.append(unit)
+            plan.unknown_size += unknown
+            for directory in directories:
+                plan.needed[directory] += need[directory]
+        else:
+            plan.left_out.append(unit)
+            blocked = policy == 'defer'
+    return plan
@@ -0,0 +1,209 @@
+# Staging area and background mover for the Insta360 Sync application.
+#
+# With [Storage] staging_dir set, downloads land on a fast local disk (e.g.
+# NVMe) and are committed there. A StagingMover then migrates each verified
+# file to destination_dir on its own threads, at a low I/O priority, so that
+# a slow destination (a large HDD array, a network share) never holds up the
+# transfers from the camera.
+import ctypes
+import ctypes.util
+import errno
+import os
+import platform
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from durability import CommitItem
+from space import preallocate
+from transfer import PART_SUFFIX
+
+# I/O priority of the mover threads: idle (only when no other process uses
+# the disk), best-effort (lowest level of the default class) or normal.
+IO_PRIORITIES = ('idle', 'best-effort', 'normal')
+DEFAULT_MOVER_WORKERS = 2
+# Bytes per copy_file_range()/sendfile() call.
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_CLASS_BE = 2
+_IOPRIO_CLASS_IDLE = 3
+# ioprio_set has no libc wrapper; syscall numbers by architecture.
+_IOPRIO_SET_SYSCALL = {'x86_64': 251, 'amd64': 251, 'i386': 289, 'i686': 289,
+                       'aarch64': 30, 'arm64': 30, 'armv7l': 314, 'armv6l': 314}
+# copy_file_range() errors meaning "not supported for these files", not a failed copy.
+_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+
+_libc = None
+
+
+def set_io_priority(priority):
+    """
+    Sets the I/O priority of the calling thread (Linux only).
+    Args:
+        priority (str): One of IO_PRIORITIES.
+    Returns:
+        bool: True if the priority was changed.
+    """
+    global _libc
+    number = _IOPRIO_SET_SYSCALL.get(platform.machine().lower())
+    if priority == 'normal' or number is None or platform.system() != 'Linux':
+        return False
+    if priority == 'idle':
+        value = _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT
+    else:
+        value = (_IOPRIO_CLASS_BE << _IOPRIO_CLASS_SHIFT) | 7
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    # I/O priorities belong to threads: 0 is the calling thread.
+    return _libc.syscall(number, _IOPRIO_WHO_PROCESS, 0, value) == 0
+
+
+def copy_file(src, dst, logger=None):
+    """
+    Copies src to dst inside the kernel where possible.
+
+    Uses copy_file_range() (which can share extents or copy on the storage
+    side, e.g. on XFS, Btrfs or NFS 4.2), then sendfile(), then a plain
+    read/write loop, whichever the two file systems support. The copy is not
+    synced; that is up to the durability mode (see durability.py).
+    Args:
+        src (Path): The file to copy.
+        dst (Path): The copy, created or truncated.
+        logger: Optional logging object, see space.preallocate().
+    Returns:
+        int: Number of bytes copied.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        preallocate(fdst.fileno(), 0, size, logger)
+        copied = 0
+        methods = [m for m in ('copy_file_range', 'sendfile') if hasattr(os, m)]
+        while copied < size and methods:
+            count = min(COPY_CHUNK_SIZE, size - copied)
+            try:
+                if methods[0] == 'copy_file_range':
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), count, copied, copied)
+                else:
+                    n = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, count)
+            except OSError as e:
+                if e.errno not in _COPY_UNSUPPORTED or copied:
+                    raise
+                methods.pop(0)
+                continue
+            if n == 0:
+                break
+            copied += n
+        if copied < size:
+            fsrc.seek(copied)
+            fdst.seek(copied)
+            shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+            copied = fdst.tell()
+        return copied
+
+
+class StagingMover:
+    """
+    Moves committed files from the staging directory to the destination directory.
+
+    A file is moved under the same key (path relative to both directories):
+    copied to a ".part" file next to its destination and handed to the
+    committer, which renames it into place and records it in the manifest
+    (syncing according to the durability mode); only then is it removed from
+    staging. The manifest therefore never names a file that is not complete
+    at the destination, and a crash at any step leaves either the staged file
+    or the destination file intact. If both directories are on the same file
+    system the committer simply renames the staged file.
+
+    Moves run on their own pool of workers; the committer hands the finished
+    keys back to the sync thread, which queues them for deletion from the
+    camera.
+    """
+
+    def __init__(self, staging_dir, dest_dir, committer, logger, workers=DEFAULT_MOVER_WORKERS, io_priority='idle'):
+        """
+        Initializes the mover and starts its worker pool.
+        Args:
+            staging_dir (Path): The directory downloads land in.
+            dest_dir (Path): The backup destination directory.
+            committer (GroupCommitter): Commits the moved files to dest_dir and its manifest.
+            logger: The logging object for logging messages.
+            workers (int): Number of files moved in parallel.
+            io_priority (str): I/O priority of the mover threads, one of IO_PRIORITIES.
+        """
+        self.staging_dir = staging_dir
+        self.dest_dir = dest_dir
+        self.committer = committer
+        self.logger = logger
+        self.io_priority = io_priority
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.moved_count = 0
+        self.failed_count = 0
+        self.moved_bytes = 0
+        self.move_sec = 0.0
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='mover',
+                                        initializer=self._init_thread)
+
+    def _init_thread(self):
+        if self.io_priority != 'normal' and not set_io_priority(self.io_priority):
+            self.logger.debug(f"Could not set the '{self.io_priority}' I/O priority for {threading.current_thread().name}.")
+
+    def staged_path(self, key):
+        """Returns the path of key in the staging directory."""
+        return self.staging_dir / key
+
+    def submit(self, key, **fields):
+        """Queues the staged file key to be moved and recorded with the manifest fields."""
+        with self.lock:
+            self.pending += 1
+        self._pool.submit(self._move, key, fields)
+
+    def _move(self, key, fields):
+        src = self.staged_path(key)
+        dst = self.dest_dir / key
+        t0 = time.monotonic()
+        try:
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            if os.stat(src).st_dev == os.stat(dst.parent).st_dev:
+                item = CommitItem(key, src, dst, fields)
+                size = fields.get('size') or 0
+            else:
+                part_path = dst.with_name(dst.name + PART_SUFFIX)
+                size = copy_file(src, part_path, self.logger)
+                if fields.get('size') is not None and size != fields['size']:
+                    raise OSError(f"copied {size} bytes, expected {fields['size']}")
+                item = CommitItem(key, part_path, dst, fields, on_durable=lambda: self._remove_staged(src))
+        except OSError as e:
+            self.logger.error(f"Failed to move {key} from {self.staging_dir} to {self.dest_dir}: {e}. "
+                              f"The staged file is kept and moved by the next sync.")
+            with self.lock:
+                self.pending -= 1
+                self.failed_count += 1
+            return
+        elapsed = time.monotonic() - t0
+        self.committer.commit([item])
+        with self.lock:
+            self.pending -= 1
+            self.moved_count += 1
+            self.moved_bytes += size
+            self.move_sec += elapsed
+
+    def _remove_staged(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            self.logger.warning(f"Could not remove staged file {path}: {e}")
+
+    def close(self):
+        """Waits for all queued moves and stops the workers."""
+        with self.lock:
+            pending = self.pending
+        if pending:
+            self.logger.info(f"Waiting for {pending} files to be moved to {self.dest_dir}...")
+        self._pool.shutdown(wait=True)
+        rate = self.moved_bytes / self.move_sec / 1e6 if self.move_sec else 0.0
+        self.logger.info(f"Mover stats: {self.moved_count} files, {self.moved_bytes / 1e6:.1f} MB moved "
+                         f"at {rate:.1f} MB/s per worker, {self.failed_count} failed.")
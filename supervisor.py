@@ -0,0 +1,122 @@
+# Camera session recovery for the Insta360 Sync application.
+import http.client
+import threading
+import time
+
+import requests
+
+from readiness import run_dhcp, wait_until_ready
+from transfer import TruncatedDownloadError
+
+# Errors raised by a download when the link to the camera is gone.
+LINK_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    http.client.HTTPException,
+    ConnectionError,
+    TimeoutError,
+    TruncatedDownloadError,
+)
+
+
+class SessionSupervisor:
+    """
+    Brings a camera session back after the Wi-Fi link dropped.
+
+    Download workers call recover() when a transfer fails with a link error.
+    The first caller re-associates through the WifiManager, waits until the
+    camera is reachable again and reopens the protocol session (which also
+    restores the download session state); workers that failed because of the
+    same drop just wait for it and retry. Each recovery starts a new
+    generation: a worker passes the generation its attempt started in, so a
+    drop is only handled once however many transfers it broke.
+    """
+
+    MAX_RECOVERIES = 5
+    RECOVERY_TIMEOUT_SEC = 120.0
+    RETRY_INTERVAL_SEC = 1.0
+
+    def __init__(self, insta360_client, camera_ip, logger, wifi_manager=None, ssid_prefixes=None,
+                 dhcp_command=None, ready_timeout_sec=30.0, bind_interface=None, source_address=None):
+        """
+        Initializes the supervisor.
+        Args:
+            insta360_client (camera): The camera API client to reopen.
+            camera_ip (str): The camera IP address.
+            logger: The logging object for logging messages.
+            wifi_manager (WifiManager): Re-associates with the camera Wi-Fi, if given.
+            ssid_prefixes (list): SSID prefixes of the camera networks.
+            dhcp_command (str): Optional command run after re-associating to get an address.
+            ready_timeout_sec (float): Time limit for each reachability check.
+            bind_interface (str): Optional network interface the camera traffic is pinned to.
+            source_address (str): Optional local IP address the camera traffic is sent from.
+        """
+        self.insta360_client = insta360_client
+        self.camera_ip = camera_ip
+        self.logger = logger
+        self.wifi_manager = wifi_manager
+        self.ssid_prefixes = ssid_prefixes
+        self.dhcp_command = dhcp_command
+        self.ready_timeout_sec = ready_timeout_sec
+        self.bind_interface = bind_interface
+        self.source_address = source_address
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.recoveries = 0
+        self.failed = False
+
+    @staticmethod
+    def is_link_error(exc):
+        """Returns True if exc means the camera link was lost, rather than a bad file or disk."""
+        return isinstance(exc, LINK_ERRORS)
+
+    def recover(self, generation, reason):
+        """
+        Restores the session, unless another worker already did so since generation.
+        Args:
+            generation (int): self.generation when the failed attempt started.
+            reason (str): What failed, for the log.
+        Returns:
+            bool: True if the session is usable again and the caller should retry.
+        """
+        with self.lock:
+            if generation != self.generation:
+                return True
+            if self.failed:
+                return False
+            if self.recoveries >= self.MAX_RECOVERIES:
+                self.logger.error(f"Link lost again ({reason}), giving up after {self.recoveries} recoveries.")
+                self.failed = True
+                return False
+            self.recoveries += 1
+            self.logger.warning(f"Link to the camera lost ({reason}). Recovering session, attempt {self.recoveries}...")
+            t0 = time.monotonic()
+            deadline = t0 + self.RECOVERY_TIMEOUT_SEC
+            while time.monotonic() < deadline:
+                if self._reconnect():
+                    self.generation += 1
+                    self.logger.info(f"Session recovered in {time.monotonic() - t0:.1f}s; resuming downloads.")
+                    return True
+                time.sleep(self.RETRY_INTERVAL_SEC)
+            self.logger.error(f"Could not recover the camera session within {self.RECOVERY_TIMEOUT_SEC:.0f}s.")
+            self.failed = True
+            return False
+
+    def _reconnect(self):
+        """One round of re-association, reachability check and protocol reopen. Returns True on success."""
+        if self.wifi_manager is not None and self.wifi_manager.is_connected() is not True:
+            if not self.wifi_manager.find_and_connect(self.ssid_prefixes):
+                return False
+            if self.dhcp_command and not run_dhcp(self.dhcp_command, self.logger):
+                return False
+        if wait_until_ready(self.camera_ip, self.logger, timeout=self.ready_timeout_sec,
+                            bind_interface=self.bind_interface, source_address=self.source_address) is None:
+            return False
+        try:
+            self.insta360_client.Open()
+        except OSError as e:
+            # e.g. connection refused while the camera restarts its server: retried by recover().
+            self.logger.warning(f"Could not reopen the camera session: {e}")
+            return False
+        return self.insta360_client.camera_socket is not None
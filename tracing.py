@@ -0,0 +1,172 @@
+# Tracing spans for the Insta360 Sync application.
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Span:
+    """One timed operation: a sync phase, a file download or a step of it."""
+
+    __slots__ = ('name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name, parent_id, attributes):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, key, value):
+        """Sets an attribute, e.g. a size or a duration measured inside the span."""
+        self.attributes[key] = value
+
+    @property
+    def duration_sec(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class Tracer:
+    """
+    Collects nested spans in memory, from any thread.
+
+    Each thread has its own stack of open spans, so a span opened in a thread
+    is the parent of the spans that thread opens next. A worker thread starts
+    with an empty stack: pass parent= to attach its spans to a span of the
+    thread that submitted the work. Finished spans are kept for export() (in
+    the OTLP/JSON trace format) and summary().
+    """
+
+    def __init__(self, service_name='insta360-sync'):
+        self.service_name = service_name
+        self.trace_id = os.urandom(16).hex()
+        self.lock = threading.Lock()
+        self.spans = []
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        """Returns the innermost open span of the calling thread, or None."""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        """
+        Times the enclosed block as a span.
+        Args:
+            name (str): The span name; the summary aggregates spans by name.
+            parent (Span): Parent span, by default the innermost open span of this thread.
+            **attributes: Span attributes.
+        Yields:
+            Span: The open span, to add attributes.
+        """
+        stack = self._stack()
+        if parent is None and stack:
+            parent = stack[-1]
+        span = Span(name, parent.span_id if parent is not None else None, attributes)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            stack.pop()
+            with self.lock:
+                self.spans.append(span)
+
+    def add(self, name, start_ns, end_ns, parent=None, **attributes):
+        """Records an already measured interval as a finished span, by default under the current span."""
+        if parent is None:
+            parent = self.current()
+        span = Span(name, parent.span_id if parent is not None else None, attributes)
+        span.start_ns = start_ns
+        span.end_ns = end_ns
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def export(self, path):
+        """Writes the finished spans to path as an OTLP/JSON trace (ExportTraceServiceRequest)."""
+        with self.lock:
+            spans = list(self.spans)
+        otlp_spans = []
+        for span in spans:
+            item = {
+                'traceId': self.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': 1,
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in span.attributes.items()],
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+            }
+            if span.parent_id:
+                item['parentSpanId'] = span.parent_id
+            otlp_spans.append(item)
+        document = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+            'scopeSpans': [{'scope': {'name': 'insta360_sync'}, 'spans': otlp_spans}],
+        }]}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(document, f)
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        """
+        Aggregates the finished spans by name, in order of first appearance.
+        Returns:
+            list: Rows of {'name', 'count', 'errors', 'total_sec', 'mean_sec', 'max_sec'}.
+        """
+        with self.lock:
+            spans = list(self.spans)
+        rows = {}
+        for span in sorted(spans, key=lambda s: s.start_ns):
+            row = rows.setdefault(span.name, {'name': span.name, 'count': 0, 'errors': 0, 'total_sec': 0.0, 'max_sec': 0.0})
+            duration = span.duration_sec
+            row['count'] += 1
+            row['errors'] += span.error is not None
+            row['total_sec'] += duration
+            row['max_sec'] = max(row['max_sec'], duration)
+        for row in rows.values():
+            row['mean_sec'] = row['total_sec'] / row['count']
+        return list(rows.values())
+
+    def format_summary(self):
+        """Returns the summary as a text table."""
+        lines = [f"{'span':<24} {'count':>7} {'errors':>6} {'total s':>10} {'mean s':>9} {'max s':>9}"]
+        for row in self.summary():
+            lines.append(f"{row['name']:<24} {row['count']:>7} {row['errors']:>6} {row['total_sec']:>10.3f} "
+                         f"{row['mean_sec']:>9.3f} {row['max_sec']:>9.3f}")
+        return '\n'.join(lines)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+# The process wide tracer, like the logging module's loggers.
+_tracer = Tracer()
+
+
+def get_tracer():
+    """Returns the process wide Tracer."""
+    return _tracer
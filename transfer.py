@@ -0,0 +1,368 @@
+# Streaming download pipeline for the Insta360 Sync application.
+import http.client
+import queue
+import socket
+import threading
+import time
+
+import requests
+import urllib3
+from urllib3.connection import HTTPConnection
+
+from space import preallocate
+
+# Size of each reusable transfer buffer, see clamp_buffer_size().
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+MIN_BUFFER_SIZE = 1 * 1024 * 1024
+MAX_BUFFER_SIZE = 8 * 1024 * 1024
+# Upper bound for the memory held by the write-behind stage.
+DEFAULT_MAX_BUFFERED_BYTES = 64 * 1024 * 1024
+# Suffix of files still being downloaded.
+PART_SUFFIX = '.part'
+# urllib3 major versions whose HTTPResponse keeps the http.client response it
+# wraps in the private _fp attribute (checked with 1.26 and 2.x).
+_RAW_FP_URLLIB3_VERSIONS = ('1.', '2.')
+
+
+def clamp_buffer_size(size):
+    """Limits a configured buffer size to the supported 1-8 MB range."""
+    return max(MIN_BUFFER_SIZE, min(MAX_BUFFER_SIZE, size))
+
+
+class BoundHTTPAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTPAdapter whose connections leave through a given interface or source address.
+
+    With several Wi-Fi adapters connected to cameras, the default route would
+    send every download through one of them. bind_interface pins the sockets
+    to a device with SO_BINDTODEVICE (Linux, needs CAP_NET_RAW);
+    source_address binds them to the local address of the adapter instead.
+    """
+
+    def __init__(self, bind_interface=None, source_address=None, **kwargs):
+        # Set before HTTPAdapter.__init__(), which creates the pool manager.
+        self.socket_options = list(HTTPConnection.default_socket_options)
+        if bind_interface:
+            self.socket_options.append((socket.SOL_SOCKET, socket.SO_BINDTODEVICE, bind_interface.encode()))
+        self.source_address = (source_address, 0) if source_address else None
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs['socket_options'] = self.socket_options
+        if self.source_address is not None:
+            pool_kwargs['source_address'] = self.source_address
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+
+
+def make_http_session(bind_interface=None, source_address=None, pool_size=4):
+    """
+    Creates the requests.Session used for camera downloads.
+    Args:
+        bind_interface (str): Optional network interface the connections are bound to.
+        source_address (str): Optional local IP address the connections are bound to.
+        pool_size (int): Connections kept per host, at least the number of download workers.
+    """
+    session = requests.Session()
+    adapter = BoundHTTPAdapter(bind_interface, source_address, pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class WriteBehindError(Exception):
+    """Raised when the disk writer thread failed to write a file."""
+
+
+class VerificationError(Exception):
+    """Raised when a downloaded file does not match what the camera announced."""
+
+
+class TruncatedDownloadError(VerificationError):
+    """Raised when the response body ended before its Content-Length, i.e. the connection dropped."""
+
+
+class WriteBehindWriter:
+    """
+    Writes downloaded data to disk on a dedicated thread.
+
+    The network reader takes an empty buffer with acquire(), fills it and hands
+    it over with submit(). The writer thread writes it to the current file and
+    gives the buffer back to the free pool. Because the pool is bounded, a slow
+    disk only stalls the reader once all buffers are queued, instead of on every
+    single write.
+
+    When a file is opened with a hash object, every buffer is also fed to it by
+    a second thread, so the content hash is ready when the file is closed
+    without reading the file back. A buffer returns to the pool once both the
+    writer and the hash thread are done with it.
+    """
+
+    _OPEN = 'open'
+    _DATA = 'data'
+    _CLOSE = 'close'
+    _STOP = 'stop'
+
+    def __init__(self, logger, buffer_size=DEFAULT_BUFFER_SIZE, max_buffered_bytes=DEFAULT_MAX_BUFFERED_BYTES, preallocate=True):
+        """
+        Initializes the writer and starts its threads.
+        Args:
+            logger: The logging object for logging messages.
+            buffer_size (int): Size in bytes of each reusable buffer.
+            max_buffered_bytes (int): Memory cap for all buffers together.
+            preallocate (bool): Reserve the disk space of files opened with a known size.
+        """
+        self.logger = logger
+        self.preallocate = preallocate
+        self.buffer_size = buffer_size
+        self.buffer_count = max(2, max_buffered_bytes // buffer_size)
+        self._free_buffers = queue.Queue()
+        for _ in range(self.buffer_count):
+            self._free_buffers.put(bytearray(buffer_size))
+        self._pending = queue.Queue()
+        self._hash_pending = queue.Queue()
+        self._refs_lock = threading.Lock()
+        self._file = None
+        self._hasher = None
+        self._error = None
+        # Statistics, reported by stats().
+        self._stats_lock = threading.Lock()
+        self._reader_stall_sec = 0.0
+        self._write_sec = 0.0
+        self._hash_sec = 0.0
+        self._bytes_written = 0
+        self._depth_samples = 0
+        self._depth_total = 0
+        self._max_depth = 0
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        self._hash_thread = threading.Thread(target=self._run_hash, name='stream-hash', daemon=True)
+        self._hash_thread.start()
+        self.logger.debug(f"Write-behind stage started with {self.buffer_count} buffers of {buffer_size} bytes.")
+
+    def open(self, path, hasher=None, offset=0, size=None):
+        """
+        Starts writing a new file; the previous file must have been closed.
+        Args:
+            path: The destination file path.
+            hasher: Optional hash object (see hashing.new_hash) fed with the file content.
+            offset (int): Resume an existing file: keep its first offset bytes and append
+                after them. The hasher must already have been fed with those bytes.
+            size (int): Expected final size of the file, if known, to preallocate it.
+        """
+        self._error = None
+        self._hasher = hasher
+        self._pending.put((self._OPEN, (path, size), offset))
+
+    def acquire(self):
+        """Returns an empty buffer, blocking while all of them are queued for writing."""
+        try:
+            return self._free_buffers.get_nowait()
+        except queue.Empty:
+            pass
+        t0 = time.monotonic()
+        buf = self._free_buffers.get()
+        with self._stats_lock:
+            self._reader_stall_sec += time.monotonic() - t0
+        return buf
+
+    def release(self, buf):
+        """Gives back a buffer which was acquired but not submitted."""
+        self._free_buffers.put(buf)
+
+    def submit(self, buf, length):
+        """Queues the first length bytes of buf for writing to the current file."""
+        if self._error is not None:
+            self.release(buf)
+            raise WriteBehindError(str(self._error)) from self._error
+        if self._hasher is not None:
+            # Shared with the hash thread: [buffer, number of pending users].
+            item = [buf, 2]
+            self._hash_pending.put((self._DATA, item, length))
+        else:
+            item = [buf, 1]
+        self._pending.put((self._DATA, item, length))
+        depth = self._pending.qsize()
+        with self._stats_lock:
+            self._depth_samples += 1
+            self._depth_total += depth
+            self._max_depth = max(self._max_depth, depth)
+
+    def close(self):
+        """
+        Waits until the current file is completely written and closes it.
+        Returns:
+            str: The hex digest of the file content, or None if opened without a hasher.
+        Raises:
+            WriteBehindError: If any write to the file failed.
+        """
+        done = threading.Event()
+        self._pending.put((self._CLOSE, done, None))
+        digest = None
+        if self._hasher is not None:
+            hashed = threading.Event()
+            self._hash_pending.put((self._CLOSE, hashed, None))
+            hashed.wait()
+            digest = self._hasher.hexdigest()
+            self._hasher = None
+        done.wait()
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise WriteBehindError(str(error)) from error
+        return digest
+
+    def shutdown(self):
+        """Stops the writer threads after all queued data is written."""
+        self._pending.put((self._STOP, None, None))
+        self._hash_pending.put((self._STOP, None, None))
+        self._thread.join()
+        self._hash_thread.join()
+
+    def stats(self):
+        """Returns a dictionary with queue depth and stall time statistics."""
+        with self._stats_lock:
+            avg_depth = self._depth_total / self._depth_samples if self._depth_samples else 0.0
+            return {
+                'buffers': self.buffer_count,
+                'buffer_size': self.buffer_size,
+                'bytes_written': self._bytes_written,
+                'max_queue_depth': self._max_depth,
+                'avg_queue_depth': avg_depth,
+                'reader_stall_sec': self._reader_stall_sec,
+                'write_sec': self._write_sec,
+                'hash_sec': self._hash_sec,
+            }
+
+    def _put_back(self, item):
+        """Returns a shared buffer to the pool when its last user is done."""
+        with self._refs_lock:
+            item[1] -= 1
+            if item[1]:
+                return
+        self._free_buffers.put(item[0])
+
+    def _run(self):
+        """Writer thread loop: executes queued open/data/close requests in order."""
+        while True:
+            kind, arg, length = self._pending.get()
+            if kind == self._STOP:
+                break
+            if kind == self._OPEN:
+                path, size = arg
+                try:
+                    if length:
+                        self._file = open(path, 'r+b')
+                        self._file.truncate(length)
+                        self._file.seek(length)
+                    else:
+                        self._file = open(path, 'wb')
+                    if self.preallocate and size:
+                        # Fails with ENOSPC now rather than after most of the transfer.
+                        preallocate(self._file.fileno(), length, size - length, self.logger)
+                except OSError as e:
+                    self._error = e
+            elif kind == self._DATA:
+                try:
+                    if self._file is not None and self._error is None:
+                        t0 = time.monotonic()
+                        self._file.write(memoryview(arg[0])[:length])
+                        with self._stats_lock:
+                            self._write_sec += time.monotonic() - t0
+                            self._bytes_written += length
+                except OSError as e:
+                    self._error = e
+                finally:
+                    self._put_back(arg)
+            elif kind == self._CLOSE:
+                if self._file is not None:
+                    try:
+                        self._file.close()
+                    except OSError as e:
+                        self._error = self._error or e
+                    self._file = None
+                arg.set()
+
+    def _run_hash(self):
+        """Hash thread loop: feeds queued buffers to the hash object of the current file."""
+        while True:
+            kind, arg, length = self._hash_pending.get()
+            if kind == self._STOP:
+                break
+            if kind == self._DATA:
+                try:
+                    t0 = time.monotonic()
+                    self._hasher.update(memoryview(arg[0])[:length])
+                    with self._stats_lock:
+                        self._hash_sec += time.monotonic() - t0
+                finally:
+                    self._put_back(arg)
+            elif kind == self._CLOSE:
+                arg.set()
+
+
+def _raw_reader(response):
+    """
+    Returns an object whose readinto() fills caller buffers from the response body.
+
+    The camera serves files without Content-Encoding, so the body can be read
+    straight from the http.client response underneath urllib3. Its readinto()
+    receives directly into our buffer, whereas urllib3's readinto() allocates a
+    temporary bytes object for every call.
+
+    This relies on the private HTTPResponse._fp of urllib3 1.x and 2.x, and so
+    is only done with those versions and if _fp is an http.client response;
+    otherwise the public response.raw is used. Reading below urllib3 bypasses
+    its Content-Length enforcement and exception wrapping: a short body is
+    caught by the size check of the caller (TruncatedDownloadError), and the
+    plain socket errors are in supervisor.LINK_ERRORS.
+    """
+    raw = response.raw
+    if response.headers.get('content-encoding') or not urllib3.__version__.startswith(_RAW_FP_URLLIB3_VERSIONS):
+        return raw
+    fp = getattr(raw, '_fp', None)
+    if isinstance(fp, http.client.HTTPResponse):
+        return fp
+    return raw
+
+
+def stream_response(response, writer, on_progress=None):
+    """
+    Reads a streamed HTTP response into the write-behind stage.
+
+    Every read goes into a preallocated buffer from the writer pool, and the
+    same buffer is written to disk, so no bytes objects are created per chunk.
+    Args:
+        response: A requests.Response opened with stream=True.
+        writer (WriteBehindWriter): The writer with the destination file open.
+        on_progress (callable): Optional, called with the number of bytes handed over.
+    Returns:
+        int: The number of bytes read from the response.
+    """
+    reader = _raw_reader(response)
+    total = 0
+    buf = None
+    try:
+        while True:
+            buf = writer.acquire()
+            view = memoryview(buf)
+            filled = 0
+            while filled < writer.buffer_size:
+                n = reader.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+            view.release()
+            full, buf = buf, None
+            if not filled:
+                writer.release(full)
+                break
+            writer.submit(full, filled)
+            total += filled
+            if on_progress:
+                on_progress(filled)
+            if filled < writer.buffer_size:
+                break
+    finally:
+        if buf is not None:
+            writer.release(buf)
+    return total
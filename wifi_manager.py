@@ -1,3 +1,5 @@
+import json
+import os
 import pywifi
 from pywifi import const
 import time
@@ -8,20 +10,38 @@ import subprocess # Added for subprocess calls on macOS
 class WifiManager:
     """Handles Wi-Fi scanning, connection, and disconnection."""
 
-    def __init__(self, logger):
+    # pywifi connection timing (Linux/Windows).
+    DIRECT_CONNECT_TIMEOUT_SEC = 4.0   # Known camera, connect without scanning first
+    SCAN_TIMEOUT_SEC = 5.0             # Give up scanning when no camera network shows up
+    SCAN_POLL_INTERVAL_SEC = 0.25
+    CONNECT_TIMEOUT_SEC = 10.0
+    STATUS_POLL_INTERVAL_SEC = 0.05
+
+    def __init__(self, logger, interface=None, cache_path=None):
         """
         Initializes the WifiManager.
         Args:
             logger: The logging object for logging messages.
+            interface (str): Optional, the name of the wireless interface to use (Linux/Windows).
+                Defaults to the first one found.
+            cache_path: Optional JSON file remembering the camera networks connected to,
+                so that the next connection can skip the scan.
         """
         self.logger = logger
+        self.cache_path = cache_path
+        self.profile_cache = self._load_profile_cache()
+        self.connect_timings = {}
         self.os_platform = platform.system()
         # pywifi is only used for Linux/Windows
         if self.os_platform == "Linux" or self.os_platform == "Windows":
             self.wifi = pywifi.PyWiFi()
             try:
                 # Ensure an interface is found before proceeding
-                self.iface = self.wifi.interfaces()[0]  # Get the first wireless interface
+                interfaces = self.wifi.interfaces()
+                if interface is not None:
+                    # Several adapters (fleet mode): pick the requested one.
+                    interfaces = [i for i in interfaces if i.name() == interface]
+                self.iface = interfaces[0]  # Get the first wireless interface
                 self.logger.info(f"WifiManager initialized for {self.os_platform} on interface {self.iface.name()}")
             except IndexError:
                 self.logger.error("No wireless interface found by pywifi. Check Wi-Fi adapter.")
@@ -54,53 +74,137 @@ class WifiManager:
             return False
 
     def _connect_pywifi(self, ssid_prefixes):
-        """Handles connection using pywifi for Linux and Windows."""
-        self.logger.info("Scanning for Wi-Fi networks using pywifi...")
-        try:
-            self.iface.scan()
-            time.sleep(5)  # Wait for scan to complete
+        """
+        Handles connection using pywifi for Linux and Windows.
 
-            scan_results = self.iface.scan_results()
-            target_network_ssid = None
+        Cameras seen before are tried first without scanning, reusing their
+        saved profile. Otherwise a scan is started and its results are polled
+        until a camera network appears. Connection state is polled at a short
+        interval (pywifi exposes no events), so every phase ends as soon as
+        its condition is met. Phase durations are kept in self.connect_timings.
+        """
+        self.connect_timings = {}
+        t_start = time.monotonic()
+        try:
+            # Phase 1: direct connect to the most recently used matching camera.
+            cached_ssids = self._cached_ssids(ssid_prefixes)
+            if cached_ssids:
+                ssid = cached_ssids[0]
+                self.logger.info(f"Trying direct connection to known camera network {ssid}...")
+                t0 = time.monotonic()
+                connected = self._associate(ssid, self.DIRECT_CONNECT_TIMEOUT_SEC)
+                self.connect_timings['direct_connect'] = time.monotonic() - t0
+                if connected:
+                    return self._connected(ssid, t_start)
+                self.logger.info(f"{ssid} is not reachable, scanning.")
 
-            for network in scan_results:
-                for prefix in ssid_prefixes:
-                    if network.ssid.startswith(prefix):
-                        self.logger.info(f"Found target camera network: {network.ssid}")
-                        target_network_ssid = network.ssid
-                        break
-                if target_network_ssid:
-                    break
-            
-            if not target_network_ssid:
+            # Phase 2: scan, polling results until a camera network shows up.
+            self.logger.info("Scanning for Wi-Fi networks using pywifi...")
+            t0 = time.monotonic()
+            network = self._scan_for(ssid_prefixes)
+            self.connect_timings['scan'] = time.monotonic() - t0
+            if network is None:
                 self.logger.warning("No camera Wi-Fi network found using pywifi.")
                 return False
+            self.logger.info(f"Found target camera network: {network.ssid}")
 
-            # Create a new profile for the connection
-            profile = pywifi.Profile()
-            profile.ssid = target_network_ssid
-            profile.auth = const.AUTH_ALG_OPEN
-            profile.akm.append(const.AKM_TYPE_NONE)
-            profile.cipher = const.CIPHER_TYPE_NONE
+            # Phase 3: associate.
+            self.logger.info(f"Connecting to {network.ssid} using pywifi...")
+            t0 = time.monotonic()
+            connected = self._associate(network.ssid, self.CONNECT_TIMEOUT_SEC)
+            self.connect_timings['associate'] = time.monotonic() - t0
+            if connected:
+                return self._connected(network.ssid, t_start, bssid=getattr(network, 'bssid', None))
 
-            self.iface.remove_all_network_profiles()
-            temp_profile = self.iface.add_network_profile(profile)
-
-            self.logger.info(f"Connecting to {target_network_ssid} using pywifi...")
-            self.iface.connect(temp_profile)
-
-            # Wait for connection
-            for _ in range(10): # 10 seconds timeout
-                if self.iface.status() == const.IFACE_CONNECTED:
-                    self.logger.info("Successfully connected to Wi-Fi using pywifi.")
-                    return True
-                time.sleep(1)
-            
-            self.logger.error(f"Failed to connect to Wi-Fi network {target_network_ssid} using pywifi after 10 seconds.")
+            self.logger.error(f"Failed to connect to Wi-Fi network {network.ssid} using pywifi after {self.CONNECT_TIMEOUT_SEC} seconds.")
             return False
         except Exception as e:
             self.logger.error(f"Error during pywifi connection: {e}")
             return False
+        finally:
+            self.connect_timings['total'] = time.monotonic() - t_start
+            self.logger.info("Wi-Fi connect timings: " + ", ".join(f"{k} {v:.2f}s" for k, v in self.connect_timings.items()))
+
+    def _scan_for(self, ssid_prefixes):
+        """Scans and returns the first camera network found (a known BSSID first), or None after SCAN_TIMEOUT_SEC."""
+        known_bssids = {entry.get('bssid') for entry in self.profile_cache.values() if entry.get('bssid')}
+        self.iface.scan()
+        deadline = time.monotonic() + self.SCAN_TIMEOUT_SEC
+        while True:
+            matches = [network for network in self.iface.scan_results()
+                       if any(network.ssid.startswith(prefix) for prefix in ssid_prefixes)]
+            if matches:
+                matches.sort(key=lambda network: getattr(network, 'bssid', None) not in known_bssids)
+                return matches[0]
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.SCAN_POLL_INTERVAL_SEC)
+
+    def _associate(self, ssid, timeout):
+        """Connects to ssid with its saved profile (created if missing). Returns True once connected."""
+        profile = self._profile_for(ssid)
+        self.iface.connect(profile)
+        return self._wait_for_status(const.IFACE_CONNECTED, timeout)
+
+    def _profile_for(self, ssid):
+        """Returns the saved network profile for ssid, adding one for an open network if there is none."""
+        for profile in self.iface.network_profiles():
+            if profile.ssid == ssid:
+                return profile
+        # Create a new profile for the connection
+        profile = pywifi.Profile()
+        profile.ssid = ssid
+        profile.auth = const.AUTH_ALG_OPEN
+        profile.akm.append(const.AKM_TYPE_NONE)
+        profile.cipher = const.CIPHER_TYPE_NONE
+        return self.iface.add_network_profile(profile)
+
+    def _wait_for_status(self, status, timeout):
+        """Polls the interface status every STATUS_POLL_INTERVAL_SEC until it equals status. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.iface.status() == status:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.STATUS_POLL_INTERVAL_SEC)
+
+    def _connected(self, ssid, t_start, bssid=None):
+        """Records a successful connection in the profile cache. Returns True."""
+        self.logger.info("Successfully connected to Wi-Fi using pywifi.")
+        entry = self.profile_cache.setdefault(ssid, {})
+        if bssid:
+            entry['bssid'] = bssid
+        entry['last_connected'] = time.time()
+        entry['connect_sec'] = round(time.monotonic() - t_start, 3)
+        self._save_profile_cache()
+        return True
+
+    def _cached_ssids(self, ssid_prefixes):
+        """Returns the cached camera SSIDs matching ssid_prefixes, most recently connected first."""
+        ssids = [ssid for ssid in self.profile_cache if any(ssid.startswith(prefix) for prefix in ssid_prefixes)]
+        return sorted(ssids, key=lambda ssid: self.profile_cache[ssid].get('last_connected', 0), reverse=True)
+
+    def _load_profile_cache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable Wi-Fi profile cache {self.cache_path}: {e}")
+            return {}
+
+    def _save_profile_cache(self):
+        if self.cache_path is None:
+            return
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.profile_cache, f, indent=1)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            self.logger.warning(f"Could not save Wi-Fi profile cache {self.cache_path}: {e}")
 
     def _connect_macos(self, ssid_prefixes):
         """Handles connection for macOS using subprocess and networksetup."""
@@ -177,6 +281,18 @@ class WifiManager:
             self.logger.error(f"An unexpected error occurred during macOS Wi-Fi connection: {e}")
             return False
 
+    def is_connected(self):
+        """
+        Returns True if the Wi-Fi interface is associated, False if not, or None if unknown
+        (macOS, where the state is not tracked).
+        """
+        if self.iface is not None:
+            try:
+                return self.iface.status() == const.IFACE_CONNECTED
+            except Exception as e:
+                self.logger.warning(f"Cannot read pywifi interface status: {e}")
+        return None
+
     def disconnect(self):
         """Disconnects from the current Wi-Fi network."""
         if self.os_platform == "Linux" or self.os_platform == "Windows":